@@ -73,6 +73,10 @@ def create_app():
     from .auth import bp as auth_blueprint
     app.register_blueprint(auth_blueprint, url_prefix='/auth') 
 
+    # --- 3. REGISTER CLI COMMANDS ---
+    from .commands import kpi_rollup_cli
+    app.cli.add_command(kpi_rollup_cli)
+
     with app.app_context():
         from . import models
                 
@@ -1,9 +1,13 @@
 # app/api/transactions.py
 # (This file is for all transaction related routes.)
 
-from flask import Blueprint, request, jsonify
+from datetime import datetime
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
 from flask_login import login_required
-from app.utils import finance_admin_required, allowed_file, _handle_service_result
+from app.utils import (
+    finance_admin_required, allowed_file, _handle_service_result, kpi_cached, idempotent,
+    etag_matches, not_modified_response, _handle_conditional_service_result
+)
 
 # --- IMPORT UPDATED ---
 # We now import 'process_excel_file' from its new location
@@ -13,20 +17,42 @@ from app.services.excel_parser import process_excel_file
 from app.services.transactions import (
     save_transaction,
     get_transactions,
+    get_transactions_page,
     get_transaction_details,
+    get_transaction_etag,
+    get_transaction_list_etag,
     approve_transaction,
     reject_transaction,
+    approve_transactions_batch,
+    reject_transactions_batch,
     update_transaction_content,
     recalculate_commission_and_metrics,
-    calculate_preview_metrics
+    calculate_preview_metrics,
+    DETAIL_INCLUDES
 )
+from app.models import Transaction
 # ----------------------
-from app.services.fixed_costs import lookup_investment_codes, lookup_recurring_services
+from app.services.catalogue import search_catalogue
+from app.services.analytics import get_leaderboard, LEADERBOARD_GROUPS
+from app.services.portfolio import get_portfolio_projection
+from app.services.export import export_transactions
+from app.services.fixed_costs import (
+    lookup_investment_codes,
+    lookup_recurring_services,
+    lookup_deal_codes,
+    stream_investment_codes,
+    stream_recurring_services
+)
 from app.services.kpi import (
     get_pending_mrc_sum,
     get_pending_transaction_count,
     get_pending_comisiones_sum,
-    get_average_gross_margin
+    get_average_gross_margin,
+    get_kpi_summary,
+    get_kpi_timeseries,
+    TIMESERIES_METRICS,
+    TIMESERIES_BUCKETS,
+    TIMESERIES_GROUPS
 )
 
 bp = Blueprint('transactions', __name__)
@@ -67,6 +93,7 @@ def calculate_preview_route():
 
 @bp.route('/submit-transaction', methods=['POST'])
 @login_required 
+@idempotent
 def create_transaction_route():
     data = request.get_json()
     if not data:
@@ -75,20 +102,180 @@ def create_transaction_route():
     # Service returns a tuple (dict, 500) on error
     return _handle_service_result(result)
 
+def _parse_transaction_filters(args):
+    """
+    Reads the optional list filters from the query string.
+    Raises ValueError with a user-facing message on invalid values.
+    """
+    def _date(name):
+        value = args.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f"Invalid '{name}'. Use the format YYYY-MM-DD.")
+
+    def _number(name):
+        value = args.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f"Invalid '{name}'. Expected a number.")
+
+    status = args.get('status')
+    return {
+        'status': [item.strip().upper() for item in status.split(',') if item.strip()] if status else None,
+        'unidadNegocio': args.get('unidadNegocio') or None,
+        'salesman': args.get('salesman') or None,
+        'date_from': _date('from'),
+        'date_to': _date('to'),
+        'mrc_min': _number('mrc_min'),
+        'mrc_max': _number('mrc_max'),
+        'margin_min': _number('margin_min'),
+        'margin_max': _number('margin_max'),
+        'q': (args.get('q') or '').strip() or None,
+    }
+
+def _parse_name_list(args, name, allowed):
+    """
+    Reads a comma-separated list of names (e.g. ?fields=id,clientName).
+    Returns None if the parameter is absent. Raises ValueError on unknown names.
+    """
+    value = args.get(name)
+    if value is None:
+        return None
+    names = list(dict.fromkeys(item.strip() for item in value.split(',') if item.strip()))
+    unknown = [item for item in names if item not in allowed]
+    if unknown:
+        raise ValueError(f"Invalid '{name}': {', '.join(unknown)}. Allowed: {', '.join(allowed)}.")
+    return names
+
 @bp.route('/transactions', methods=['GET'])
 @login_required 
 def get_transactions_route():
-    page = request.args.get('page', 1, type=int)
+    """
+    Lists transactions, newest first.
+    - Page mode (default): ?page=N&per_page=M (OFFSET pagination with total/pages)
+    - Cursor mode: ?cursor=&per_page=M for the first page, then ?cursor=<next_cursor>.
+      Add include_total=1 to also get the total count.
+    - include_counts=1 (both modes): adds fixed_costs_count / recurring_services_count
+    - fields (both modes): Comma-separated transaction fields to return ('id' is always
+      returned), e.g. ?fields=clientName,MRC_pen,ApprovalStatus
+
+    Optional filters (both modes):
+    - status: Comma-separated approval statuses (e.g., ?status=PENDING,APPROVED)
+    - unidadNegocio, salesman: Exact match
+    - from / to: Submission date range as YYYY-MM-DD
+    - mrc_min / mrc_max: MRC_pen range
+    - margin_min / margin_max: grossMarginRatio range
+    - q: Free-text search over clientName, companyID, orderID and id
+    """
     per_page = request.args.get('per_page', 30, type=int)
-    result = get_transactions(page=page, per_page=per_page) 
-    return _handle_service_result(result)
+    include_counts = request.args.get('include_counts', '').lower() in ['1', 'true', 'yes']
+    try:
+        filters = _parse_transaction_filters(request.args)
+        fields = _parse_name_list(request.args, 'fields', Transaction.LIST_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    if 'cursor' in request.args:
+        per_page = min(max(per_page, 1), 200)
+        include_total = request.args.get('include_total', '').lower() in ['1', 'true', 'yes']
+        result = get_transactions_page(
+            cursor=request.args.get('cursor') or None,
+            per_page=per_page,
+            include_total=include_total,
+            include_counts=include_counts,
+            filters=filters,
+            fields=fields
+        )
+    else:
+        page = request.args.get('page', 1, type=int)
+        result = get_transactions(
+            page=page, per_page=per_page, include_counts=include_counts, filters=filters, fields=fields
+        )
+
+    # Weak conditional GET over the returned page (see get_transaction_list_etag)
+    etag = None
+    if isinstance(result, dict) and result.get('success'):
+        etag = get_transaction_list_etag(result['data'], sorted(request.args.items(multi=True)))
+        if etag_matches(etag, weak=True):
+            return not_modified_response(etag, weak=True)
+    return _handle_conditional_service_result(result, etag, weak=True)
+
+@bp.route('/transactions/export', methods=['GET'])
+@login_required
+def export_transactions_route():
+    """
+    Streams the transaction list as a file download (same role-based
+    filtering and optional filters as GET /api/transactions).
+
+    Query parameters:
+    - format: 'csv' (default), 'ndjson' or 'xlsx'
+    - include_children=1: Adds fixed cost / recurring service rows
+    - include_metrics=1: Adds the cached financial metrics
+    """
+    try:
+        filters = _parse_transaction_filters(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    result = export_transactions(
+        request.args.get('format', 'csv'),
+        filters=filters,
+        include_children=request.args.get('include_children', '').lower() in ['1', 'true', 'yes'],
+        include_metrics=request.args.get('include_metrics', '').lower() in ['1', 'true', 'yes']
+    )
+    if isinstance(result[0], dict):
+        return _handle_service_result(result)
+
+    generator, mimetype, filename = result
+    return Response(
+        stream_with_context(generator),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
 
 @bp.route('/transaction/<string:transaction_id>', methods=['GET'])
 @login_required
 def get_transaction_details_route(transaction_id):
-    result = get_transaction_details(transaction_id)
+    """
+    Returns a transaction with its metrics, timeline and child rows.
+
+    Optional sparse fieldsets (without them the full response is returned):
+    - fields: Comma-separated transaction fields ('id' is always returned)
+    - include: Comma-separated parts among timeline, fixed_costs, recurring_services.
+      If only 'fields' is given, none of them are included.
+    """
+    try:
+        fields = _parse_name_list(request.args, 'fields', Transaction.LIST_FIELDS)
+        include = _parse_name_list(request.args, 'include', DETAIL_INCLUDES)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    # Conditional GET: answer 304 before loading or calculating anything
+    etag = get_transaction_etag(transaction_id, variant=(fields, include))
+    if etag and etag_matches(etag):
+        return not_modified_response(etag)
+
+    result = get_transaction_details(transaction_id, fields=fields, include=include)
     # Service returns a tuple (dict, 404 or 500) on failure
-    return _handle_service_result(result, default_error_status=404)
+    return _handle_conditional_service_result(result, etag, default_error_status=404)
+
+def _parse_expected_version(data):
+    """
+    Reads the optional 'content_version' (optimistic locking) from a request body.
+    Raises ValueError with a user-facing message on invalid values.
+    """
+    value = data.get('content_version')
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("'content_version' must be an integer.")
+    return value
 
 @bp.route('/transaction/<string:transaction_id>', methods=['PUT'])
 @login_required
@@ -105,15 +292,22 @@ def update_transaction_route(transaction_id):
         {
             "transactions": {...},      # Updated transaction fields
             "fixed_costs": [...],       # New/updated fixed costs
-            "recurring_services": [...] # New/updated recurring services
+            "recurring_services": [...], # New/updated recurring services
+            "content_version": 3         # Optional: version the edit is based on
         }
+
+    Returns 409 with 'current_version' if the transaction was modified in between.
     """
     data = request.get_json()
     if not data:
         return jsonify({"success": False, "error": "No data provided in the request"}), 400
+    try:
+        expected_version = _parse_expected_version(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
 
-    result = update_transaction_content(transaction_id, data)
-    # Service returns a tuple (dict, 403, 404, or 500) on failure
+    result = update_transaction_content(transaction_id, data, expected_version=expected_version)
+    # Service returns a tuple (dict, 403, 404, 409 or 500) on failure
     return _handle_service_result(result)
 
 
@@ -122,9 +316,15 @@ def update_transaction_route(transaction_id):
 @bp.route('/transaction/approve/<string:transaction_id>', methods=['POST'])
 @login_required
 @finance_admin_required
+@idempotent
 def approve_transaction_route(transaction_id):
     # Parse optional request body containing updated transaction data
+    # and the optional 'content_version' (409 if the transaction changed in between)
     data = request.get_json() or {}
+    try:
+        expected_version = _parse_expected_version(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
 
     # Check if data contains transaction updates (beyond just metadata)
     # If the body has 'transactions', 'fixed_costs', or 'recurring_services', treat it as an update payload
@@ -132,21 +332,26 @@ def approve_transaction_route(transaction_id):
 
     if has_update_data:
         # Pass the data payload to the service for pre-approval updates
-        result = approve_transaction(transaction_id, data_payload=data)
+        result = approve_transaction(transaction_id, data_payload=data, expected_version=expected_version)
     else:
         # No update data, just approve with existing values
-        result = approve_transaction(transaction_id)
+        result = approve_transaction(transaction_id, expected_version=expected_version)
 
-    # Service returns a tuple (dict, 400, 404, or 500) on failure
+    # Service returns a tuple (dict, 400, 404, 409 or 500) on failure
     return _handle_service_result(result)
 
 @bp.route('/transaction/reject/<string:transaction_id>', methods=['POST'])
 @login_required
 @finance_admin_required
+@idempotent
 def reject_transaction_route(transaction_id):
-    # Extract optional rejection note and transaction updates from request body
+    # Extract optional rejection note, transaction updates and 'content_version' from request body
     data = request.get_json() or {}
     rejection_note = data.get('rejection_note')
+    try:
+        expected_version = _parse_expected_version(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
 
     # Validate note length if provided
     if rejection_note and len(rejection_note) > 500:
@@ -161,12 +366,103 @@ def reject_transaction_route(transaction_id):
 
     if has_update_data:
         # Pass both the rejection note and data payload to the service
-        result = reject_transaction(transaction_id, rejection_note=rejection_note, data_payload=data)
+        result = reject_transaction(
+            transaction_id, rejection_note=rejection_note, data_payload=data, expected_version=expected_version
+        )
     else:
         # Only rejection note, no transaction updates
-        result = reject_transaction(transaction_id, rejection_note=rejection_note)
+        result = reject_transaction(transaction_id, rejection_note=rejection_note, expected_version=expected_version)
 
-    # Service returns a tuple (dict, 400, 404, or 500) on failure
+    # Service returns a tuple (dict, 400, 404, 409 or 500) on failure
+    return _handle_service_result(result)
+
+def _parse_batch_ids(data):
+    """
+    Reads 'transaction_ids' from a batch request body.
+    Raises ValueError with a user-facing message on invalid values.
+    """
+    transaction_ids = data.get('transaction_ids')
+    if not isinstance(transaction_ids, list) or not transaction_ids:
+        raise ValueError("'transaction_ids' must be a non-empty list.")
+    if not all(isinstance(transaction_id, str) and transaction_id for transaction_id in transaction_ids):
+        raise ValueError("'transaction_ids' must contain transaction ID strings.")
+    max_size = current_app.config['BATCH_DECISION_MAX_SIZE']
+    if len(transaction_ids) > max_size:
+        raise ValueError(f"Too many transactions in one batch (maximum {max_size}).")
+    return transaction_ids
+
+def _parse_batch_versions(data):
+    """
+    Reads the optional 'content_versions' ({id: version}) from a batch request body.
+    Raises ValueError with a user-facing message on invalid values.
+    """
+    versions = data.get('content_versions')
+    if versions is None:
+        return None
+    if not isinstance(versions, dict) or not all(
+        isinstance(version, int) and not isinstance(version, bool) for version in versions.values()
+    ):
+        raise ValueError("'content_versions' must map transaction IDs to integer versions.")
+    return versions
+
+@bp.route('/transactions/approve-batch', methods=['POST'])
+@login_required
+@finance_admin_required
+@idempotent
+def approve_transactions_batch_route():
+    """
+    Approves several PENDING transactions in one request.
+
+    Request Body:
+        {"transaction_ids": ["FLX...", ...], "content_versions": {"FLX...": 3}}  # versions optional
+
+    Transactions that are missing, not PENDING or modified since the given
+    version are reported in 'skipped'.
+    """
+    data = request.get_json() or {}
+    try:
+        transaction_ids = _parse_batch_ids(data)
+        expected_versions = _parse_batch_versions(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    result = approve_transactions_batch(transaction_ids, expected_versions=expected_versions)
+    return _handle_service_result(result)
+
+@bp.route('/transactions/reject-batch', methods=['POST'])
+@login_required
+@finance_admin_required
+@idempotent
+def reject_transactions_batch_route():
+    """
+    Rejects several PENDING transactions in one request.
+
+    Request Body:
+        {"transaction_ids": ["FLX...", ...], "rejection_note": "...", "content_versions": {...}}
+        (note optional and shared by all; versions optional, as in approve-batch)
+
+    Transactions that are missing, not PENDING or modified since the given
+    version are reported in 'skipped'.
+    """
+    data = request.get_json() or {}
+    rejection_note = data.get('rejection_note')
+
+    # Validate note length if provided
+    if rejection_note and len(rejection_note) > 500:
+        return jsonify({
+            "success": False,
+            "error": "Rejection note cannot exceed 500 characters."
+        }), 400
+
+    try:
+        transaction_ids = _parse_batch_ids(data)
+        expected_versions = _parse_batch_versions(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    result = reject_transactions_batch(
+        transaction_ids, rejection_note=rejection_note, expected_versions=expected_versions
+    )
     return _handle_service_result(result)
 
 @bp.route('/transaction/<string:transaction_id>/calculate-commission', methods=['POST'])
@@ -176,9 +472,15 @@ def calculate_commission_route(transaction_id):
     """
     Triggers recalculation. Checks for ApprovalStatus == 'PENDING'
     and returns 403 Forbidden otherwise.
+    Optional body {"content_version": N}: returns 409 if the transaction changed in between.
     """
-    result = recalculate_commission_and_metrics(transaction_id)
-    # Service returns a tuple (dict, 403, 404, or 500) on failure
+    try:
+        expected_version = _parse_expected_version(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    result = recalculate_commission_and_metrics(transaction_id, expected_version=expected_version)
+    # Service returns a tuple (dict, 403, 404, 409 or 500) on failure
     return _handle_service_result(result)
 
 # --- NEW ROUTE FOR FIXED COST LOOKUP ---
@@ -188,6 +490,9 @@ def lookup_fixed_costs_route():
     """
     Accepts a list of Investment Codes and returns structured FixedCost objects
     from the external master database.
+
+    Query parameters (optional):
+    - stream=1: Stream the results as NDJSON (one FixedCost per line) for bulk lookups
     """
     data = request.get_json()
     codes = data.get('investment_codes')
@@ -197,6 +502,12 @@ def lookup_fixed_costs_route():
     if not codes or not isinstance(codes, list) or not all(isinstance(c, str) for c in codes):
         return jsonify({"success": False, "error": "Missing or invalid 'investment_codes' list of strings."}), 400
 
+    if request.args.get('stream') == '1':
+        result = stream_investment_codes(codes, tipo_cambio)
+        if isinstance(result, tuple):
+            return _handle_service_result(result)
+        return Response(stream_with_context(result), mimetype='application/x-ndjson')
+
     result = lookup_investment_codes(codes, tipo_cambio)
     # _handle_service_result handles the tuple (error_dict, status_code) on failure
     return _handle_service_result(result)
@@ -208,6 +519,9 @@ def lookup_recurring_services_route():
     """
     Accepts a list of service codes ('quotation codes') and returns structured
     RecurringService objects from the external master database (dim_cotizacion_bi).
+
+    Query parameters (optional):
+    - stream=1: Stream the results as NDJSON (one RecurringService per line) for bulk lookups
     """
     data = request.get_json()
     # CRITICAL: Check the key is 'service_codes' as per the frontend brief
@@ -218,14 +532,185 @@ def lookup_recurring_services_route():
     if not codes or not isinstance(codes, list) or not all(isinstance(c, str) for c in codes):
         return jsonify({"success": False, "error": "Missing or invalid 'service_codes' list of strings."}), 400
 
+    if request.args.get('stream') == '1':
+        result = stream_recurring_services(codes, tipo_cambio)
+        if isinstance(result, tuple):
+            return _handle_service_result(result)
+        return Response(stream_with_context(result), mimetype='application/x-ndjson')
+
     result = lookup_recurring_services(codes, tipo_cambio)
     # _handle_service_result handles the tuple (error_dict, status_code) on failure
     return _handle_service_result(result)
 
 
+# --- COMBINED LOOKUP (FIXED COSTS + RECURRING SERVICES) ---
+@bp.route('/lookup', methods=['POST'])
+@login_required
+def lookup_deal_codes_route():
+    """
+    Accepts 'investment_codes' and/or 'service_codes' and returns both the
+    FixedCost and RecurringService objects in a single merged payload.
+    The two Data Warehouse queries run concurrently.
+    """
+    data = request.get_json() or {}
+    investment_codes = data.get('investment_codes') or []
+    service_codes = data.get('service_codes') or []
+    # Optional: Accept tipoCambio for calculating PEN values
+    tipo_cambio = data.get('tipoCambio', 1)
+
+    for key, codes in (('investment_codes', investment_codes), ('service_codes', service_codes)):
+        if not isinstance(codes, list) or not all(isinstance(c, str) for c in codes):
+            return jsonify({"success": False, "error": f"Invalid '{key}': expected a list of strings."}), 400
+
+    if not investment_codes and not service_codes:
+        return jsonify({"success": False, "error": "Provide at least one of 'investment_codes' or 'service_codes'."}), 400
+
+    result = lookup_deal_codes(investment_codes, service_codes, tipo_cambio)
+    return _handle_service_result(result)
+
+
+# --- CATALOGUE AUTOCOMPLETE ---
+@bp.route('/catalogue/search', methods=['GET'])
+@login_required
+def search_catalogue_route():
+    """
+    Type-ahead search over DW services/quotation codes and products/tickets,
+    answered from an in-memory index (no DW round-trip per keystroke).
+
+    Query parameters:
+    - q: Prefix to search for (required)
+    - limit: Maximum number of results (default 20, max 100)
+    - type: Optional filter, 'recurring_service' or 'fixed_cost'
+    """
+    query = (request.args.get('q') or '').strip()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    entry_type = request.args.get('type')
+
+    if not query:
+        return jsonify({"success": False, "error": "Missing search query 'q'."}), 400
+    if entry_type not in (None, 'recurring_service', 'fixed_cost'):
+        return jsonify({"success": False, "error": "Invalid 'type'. Use 'recurring_service' or 'fixed_cost'."}), 400
+
+    result = search_catalogue(query, limit=limit, entry_type=entry_type)
+    return _handle_service_result(result)
+
+# --- ANALYTICS (FINANCE/ADMIN) ---
+@bp.route('/analytics/leaderboard', methods=['GET'])
+@login_required
+@finance_admin_required
+def get_leaderboard_route():
+    """
+    Ranks salesmen or business units by approved MRC, approval rate and
+    median payback, including the gross margin distribution per group.
+    Results are cached for ANALYTICS_CACHE_TTL seconds (default 60).
+
+    Query parameters (optional):
+    - group_by: 'salesman' (default) or 'unidadNegocio'
+    - from / to: Submission date range as YYYY-MM-DD
+    """
+    group_by = request.args.get('group_by', 'salesman')
+    if group_by not in LEADERBOARD_GROUPS:
+        return jsonify({"success": False, "error": f"Invalid 'group_by'. Use one of: {', '.join(LEADERBOARD_GROUPS)}."}), 400
+
+    try:
+        date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid date. Use the format YYYY-MM-DD for 'from' and 'to'."}), 400
+
+    result = get_leaderboard(group_by=group_by, date_from=date_from, date_to=date_to)
+    return _handle_service_result(result)
+
+@bp.route('/analytics/portfolio-projection', methods=['GET'])
+@login_required
+@finance_admin_required
+def get_portfolio_projection_route():
+    """
+    Projected company-wide monthly cash-in, cash-out and net cash flow of the
+    APPROVED portfolio, starting with the current month.
+
+    Query parameters (optional):
+    - months: Number of months to project (default 12, max 120)
+    """
+    months = min(max(request.args.get('months', 12, type=int), 1), 120)
+    result = get_portfolio_projection(months=months)
+    return _handle_service_result(result)
+
 # --- KPI ENDPOINTS ---
+@bp.route('/kpi/summary', methods=['GET'])
+@login_required
+@kpi_cached
+def get_kpi_summary_route():
+    """
+    Returns every dashboard KPI (pending MRC, pending count, pending comisiones
+    and average gross margin) in one response, computed with a single query.
+    Role-based filtering:
+    - SALES: Only their own transactions
+    - FINANCE: All transactions
+    - ADMIN: All transactions
+
+    Query parameters (optional, apply to the average gross margin):
+    - months_back: Filter transactions from last N months (e.g., ?months_back=3)
+    - status: Filter by approval status (e.g., ?status=APPROVED)
+    """
+    months_back = request.args.get('months_back', type=int)
+    status_filter = request.args.get('status', type=str)
+
+    result = get_kpi_summary(months_back=months_back, status_filter=status_filter)
+    return _handle_service_result(result)
+
+
+@bp.route('/kpi/timeseries', methods=['GET'])
+@login_required
+@kpi_cached
+def get_kpi_timeseries_route():
+    """
+    Returns KPI trends per month or week as columnar arrays for charts.
+    Role-based filtering:
+    - SALES: Only their own transactions
+    - FINANCE: All transactions
+    - ADMIN: All transactions
+
+    Query parameters (optional):
+    - bucket: 'month' (default) or 'week'
+    - metric: Comma-separated subset of mrc,count,comisiones,gross_margin (default: all)
+    - group_by: 'salesman' or 'unidadNegocio' (one series per group)
+    - status: Filter by approval status (e.g., ?status=APPROVED)
+    - from / to: Date range as YYYY-MM-DD (e.g., ?from=2025-01-01&to=2025-06-30)
+    """
+    bucket = request.args.get('bucket', 'month')
+    group_by = request.args.get('group_by')
+    status_filter = request.args.get('status', type=str)
+    metric_arg = request.args.get('metric')
+    metrics = [m.strip() for m in metric_arg.split(',') if m.strip()] if metric_arg else None
+
+    if bucket not in TIMESERIES_BUCKETS:
+        return jsonify({"success": False, "error": f"Invalid 'bucket'. Use one of: {', '.join(TIMESERIES_BUCKETS)}."}), 400
+    if group_by is not None and group_by not in TIMESERIES_GROUPS:
+        return jsonify({"success": False, "error": f"Invalid 'group_by'. Use one of: {', '.join(TIMESERIES_GROUPS)}."}), 400
+    if metrics and any(m not in TIMESERIES_METRICS for m in metrics):
+        return jsonify({"success": False, "error": f"Invalid 'metric'. Use any of: {', '.join(TIMESERIES_METRICS)}."}), 400
+
+    try:
+        date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid date. Use the format YYYY-MM-DD for 'from' and 'to'."}), 400
+
+    result = get_kpi_timeseries(
+        bucket=bucket,
+        metrics=metrics,
+        group_by=group_by,
+        status_filter=status_filter,
+        date_from=date_from,
+        date_to=date_to
+    )
+    return _handle_service_result(result)
+
+
 @bp.route('/kpi/pending-mrc', methods=['GET'])
 @login_required
+@kpi_cached
 def get_pending_mrc_route():
     """
     Returns the sum of MRC for pending transactions.
@@ -240,6 +725,7 @@ def get_pending_mrc_route():
 
 @bp.route('/kpi/pending-count', methods=['GET'])
 @login_required
+@kpi_cached
 def get_pending_count_route():
     """
     Returns the count of pending transactions.
@@ -254,6 +740,7 @@ def get_pending_count_route():
 
 @bp.route('/kpi/pending-comisiones', methods=['GET'])
 @login_required
+@kpi_cached
 def get_pending_comisiones_route():
     """
     Returns the sum of comisiones for pending transactions.
@@ -268,6 +755,7 @@ def get_pending_comisiones_route():
 
 @bp.route('/kpi/average-gross-margin', methods=['GET'])
 @login_required
+@kpi_cached
 def get_average_gross_margin_route():
     """
     Returns the average gross margin ratio for transactions.
@@ -0,0 +1,32 @@
+# app/commands.py
+# Maintenance commands for the Flask CLI (e.g. 'flask kpi-rollup reconcile').
+
+import click
+from flask.cli import AppGroup
+
+kpi_rollup_cli = AppGroup('kpi-rollup', help='Maintenance of the kpi_rollup aggregate table.')
+
+
+@kpi_rollup_cli.command('reconcile')
+@click.option('--fix', is_flag=True, help='Rebuild kpi_rollup from the transaction table if it has drifted.')
+def reconcile_command(fix):
+    """Verifies kpi_rollup against a full scan of the transaction table."""
+    from .services.kpi_rollup import reconcile_kpi_rollup
+
+    mismatches = reconcile_kpi_rollup(fix=fix)
+    if not mismatches:
+        click.echo("kpi_rollup is consistent with the transaction table.")
+        return
+
+    for mismatch in sorted(mismatches, key=lambda m: tuple(str(part) for part in m['key'])):
+        salesman, status, month = mismatch['key']
+        click.echo(
+            f"MISMATCH salesman='{salesman}' status='{status}' month={month}: "
+            f"expected {mismatch['expected']}, found {mismatch['actual']}"
+        )
+
+    if fix:
+        click.echo(f"Rebuilt kpi_rollup ({len(mismatches)} mismatching rows).")
+    else:
+        click.echo(f"{len(mismatches)} mismatching rows. Run with --fix to rebuild the table.")
+        raise SystemExit(1)
@@ -128,6 +128,43 @@ class Config:
     # If DATAWAREHOUSE_URL is missing, the app will FAIL FAST at startup
     DATAWAREHOUSE_URI = os.environ.get('DATAWAREHOUSE_URL')
 
+    # --- Data Warehouse Resilience Settings ---
+    # Per-call timeouts so a slow DW cannot block a sync gunicorn worker
+    DW_CONNECT_TIMEOUT = int(os.environ.get('DW_CONNECT_TIMEOUT') or 5)  # seconds
+    DW_STATEMENT_TIMEOUT_MS = int(os.environ.get('DW_STATEMENT_TIMEOUT_MS') or 10000)  # milliseconds
+    # Circuit breaker: opens when the failure rate over the last WINDOW_SIZE calls
+    # reaches FAILURE_RATE (after at least MIN_CALLS), retries after RESET_TIMEOUT seconds
+    DW_BREAKER_FAILURE_RATE = float(os.environ.get('DW_BREAKER_FAILURE_RATE') or 0.5)
+    DW_BREAKER_WINDOW_SIZE = int(os.environ.get('DW_BREAKER_WINDOW_SIZE') or 20)
+    DW_BREAKER_MIN_CALLS = int(os.environ.get('DW_BREAKER_MIN_CALLS') or 5)
+    DW_BREAKER_RESET_TIMEOUT = int(os.environ.get('DW_BREAKER_RESET_TIMEOUT') or 30)  # seconds
+    # Lookup cache: entries are fresh for TTL seconds, then served as stale
+    # (and revalidated in the background) for up to STALE_TTL seconds
+    DW_LOOKUP_CACHE_TTL = int(os.environ.get('DW_LOOKUP_CACHE_TTL') or 300)
+    DW_LOOKUP_CACHE_STALE_TTL = int(os.environ.get('DW_LOOKUP_CACHE_STALE_TTL') or 86400)
+    DW_LOOKUP_CACHE_MAX_ENTRIES = int(os.environ.get('DW_LOOKUP_CACHE_MAX_ENTRIES') or 5000)
+    # Pooled DW connections per worker process (also caps concurrent lookup threads)
+    DW_POOL_MAX_CONNECTIONS = int(os.environ.get('DW_POOL_MAX_CONNECTIONS') or 5)
+    # Seconds before the in-memory catalogue index (autocomplete) is rebuilt
+    CATALOGUE_REFRESH_INTERVAL = int(os.environ.get('CATALOGUE_REFRESH_INTERVAL') or 3600)
+    # Rows fetched per round-trip by server-side cursors in streaming lookups
+    DW_STREAM_ITERSIZE = int(os.environ.get('DW_STREAM_ITERSIZE') or 2000)
+
+    # --- KPI Cache Settings ---
+    # Seconds a cached KPI response is served before it is recomputed (entries
+    # are also invalidated when a transaction of the salesman is committed)
+    KPI_CACHE_TTL = int(os.environ.get('KPI_CACHE_TTL') or 30)
+    KPI_CACHE_MAX_ENTRIES = int(os.environ.get('KPI_CACHE_MAX_ENTRIES') or 2000)
+
+    # Seconds a leaderboard/analytics result is reused before it is recomputed
+    ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL') or 60)
+
+    # Maximum number of transactions per approve-batch / reject-batch request
+    BATCH_DECISION_MAX_SIZE = int(os.environ.get('BATCH_DECISION_MAX_SIZE') or 200)
+
+    # Seconds a stored Idempotency-Key response is replayed to retries (default: 24 hours)
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL') or 86400)
+
     @staticmethod
     def validate_config():
         """
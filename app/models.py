@@ -83,7 +83,22 @@ class Transaction(db.Model):
     submissionDate = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     approvalDate = db.Column(db.DateTime, nullable=True)
     rejection_note = db.Column(db.String(500), nullable=True)
-    financial_cache = db.Column(db.JSON, nullable=True)  # Stores cached financial metrics for APPROVED/REJECTED transactions
+    financial_cache = db.Column(db.JSON, nullable=True)  # Stores cached financial metrics (see financial_cache_version)
+    # Row version: incremented on every write of the deal (content edits, commission
+    # recalculation, approval/rejection). Drives the PENDING cache, the ETags and
+    # optimistic locking (see __mapper_args__)
+    content_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # content_version the financial_cache was computed from (PENDING cache validity)
+    financial_cache_version = db.Column(db.Integer, nullable=True)
+
+    # Optimistic concurrency control: every ORM UPDATE carries
+    # "WHERE content_version = <version loaded>" and raises StaleDataError if a
+    # concurrent request changed the row first. The services bump the version
+    # explicitly (version_id_generator=False).
+    __mapper_args__ = {
+        'version_id_col': content_version,
+        'version_id_generator': False,
+    }
 
     # --- Database Indexes for Performance Optimization ---
     __table_args__ = (
@@ -99,6 +114,12 @@ class Transaction(db.Model):
         # Used in: kpi.py - get_average_gross_margin() with optional filters
         db.Index('idx_transaction_approval_salesman_submission',
                  'ApprovalStatus', 'salesman', 'submissionDate'),
+
+        # Covering index for the leaderboard (index-only scans, PostgreSQL INCLUDE)
+        # Used in: analytics.py - get_leaderboard() with optional date range
+        db.Index('idx_transaction_leaderboard_covering', 'submissionDate',
+                 postgresql_include=['salesman', 'unidadNegocio', 'ApprovalStatus',
+                                     'MRC_pen', 'payback', 'grossMarginRatio']),
     )
 
     # --- Relationships to the other tables ---
@@ -106,48 +127,37 @@ class Transaction(db.Model):
     fixed_costs = db.relationship('FixedCost', backref='transaction', lazy=True, cascade="all, delete-orphan")
     recurring_services = db.relationship('RecurringService', backref='transaction', lazy=True, cascade="all, delete-orphan")
 
+    # Scalar fields exposed by to_dict() and the list view (financial_cache excluded)
+    LIST_FIELDS = (
+        'id', 'unidadNegocio', 'clientName', 'companyID', 'salesman', 'orderID', 'tipoCambio',
+        'MRC_original', 'MRC_currency', 'MRC_pen', 'NRC_original', 'NRC_currency', 'NRC_pen',
+        'VAN', 'TIR', 'payback', 'totalRevenue', 'totalExpense', 'comisiones', 'comisionesRate',
+        'costoInstalacion', 'costoInstalacionRatio', 'grossMargin', 'grossMarginRatio',
+        'plazoContrato', 'costoCapitalAnual', 'tasaCartaFianza', 'costoCartaFianza',
+        'aplicaCartaFianza', 'gigalan_region', 'gigalan_sale_type', 'gigalan_old_mrc',
+        'ApprovalStatus', 'submissionDate', 'approvalDate', 'rejection_note', 'content_version',
+    )
+
+    @classmethod
+    def list_columns(cls, fields=None):
+        """Column attributes for LIST_FIELDS (or a subset), for column-only (non-ORM) queries."""
+        return [getattr(cls, field) for field in (fields or cls.LIST_FIELDS)]
+
+    @staticmethod
+    def row_to_dict(row, fields=None):
+        """
+        Converts a row with the LIST_FIELDS attributes (a Transaction or a
+        column-query Row) to a dictionary, optionally restricted to 'fields'.
+        """
+        data = {field: getattr(row, field) for field in (fields or Transaction.LIST_FIELDS)}
+        for field in ('submissionDate', 'approvalDate'):
+            if data.get(field):
+                data[field] = data[field].isoformat()
+        return data
+
     def to_dict(self):
         """Converts the transaction to a dictionary."""
-        return {
-            'id': self.id,
-            'unidadNegocio': self.unidadNegocio,
-            'clientName': self.clientName,
-            'companyID': self.companyID,
-            'salesman': self.salesman,
-            'orderID': self.orderID,
-            'tipoCambio': self.tipoCambio,
-            
-            'MRC_original': self.MRC_original,
-            'MRC_currency': self.MRC_currency,
-            'MRC_pen': self.MRC_pen,
-            'NRC_original': self.NRC_original,
-            'NRC_currency': self.NRC_currency,
-            'NRC_pen': self.NRC_pen,
-            
-            'VAN': self.VAN,
-            'TIR': self.TIR,
-            'payback': self.payback,
-            'totalRevenue': self.totalRevenue,
-            'totalExpense': self.totalExpense,
-            'comisiones': self.comisiones,
-            'comisionesRate': self.comisionesRate,
-            'costoInstalacion': self.costoInstalacion,
-            'costoInstalacionRatio': self.costoInstalacionRatio,
-            'grossMargin': self.grossMargin,
-            'grossMarginRatio': self.grossMarginRatio,
-            'plazoContrato': self.plazoContrato,
-            'costoCapitalAnual': self.costoCapitalAnual,
-            'tasaCartaFianza': self.tasaCartaFianza,
-            'costoCartaFianza': self.costoCartaFianza,
-            'aplicaCartaFianza': self.aplicaCartaFianza,
-            'gigalan_region': self.gigalan_region,
-            'gigalan_sale_type': self.gigalan_sale_type,
-            'gigalan_old_mrc': self.gigalan_old_mrc,
-            'ApprovalStatus': self.ApprovalStatus,
-            'submissionDate': self.submissionDate.isoformat() if self.submissionDate else None,
-            'approvalDate': self.approvalDate.isoformat() if self.approvalDate else None,
-            'rejection_note': self.rejection_note,
-        }
+        return Transaction.row_to_dict(self)
 
 # --- 3. FIXED COST MODEL (EXISTING) ---
 class FixedCost(db.Model):
@@ -175,26 +185,37 @@ class FixedCost(db.Model):
             return self.cantidad * self.costoUnitario_pen
         return None
 
-    def to_dict(self):
-        """Converts the fixed cost to a dictionary."""
+    @staticmethod
+    def row_to_dict(row):
+        """
+        Converts a row with the table's column attributes (a FixedCost or a
+        column-query Row) to a dictionary, including the derived total_pen.
+        """
+        total_pen = None
+        if row.cantidad is not None and row.costoUnitario_pen is not None:
+            total_pen = row.cantidad * row.costoUnitario_pen
         return {
-            'id': self.id,
-            'transaction_id': self.transaction_id,
-            'categoria': self.categoria,
-            'tipo_servicio': self.tipo_servicio,
-            'ticket': self.ticket,
-            'ubicacion': self.ubicacion,
-            'cantidad': self.cantidad,
+            'id': row.id,
+            'transaction_id': row.transaction_id,
+            'categoria': row.categoria,
+            'tipo_servicio': row.tipo_servicio,
+            'ticket': row.ticket,
+            'ubicacion': row.ubicacion,
+            'cantidad': row.cantidad,
             
-            'costoUnitario_original': self.costoUnitario_original,
-            'costoUnitario_currency': self.costoUnitario_currency,
-            'costoUnitario_pen': self.costoUnitario_pen,
+            'costoUnitario_original': row.costoUnitario_original,
+            'costoUnitario_currency': row.costoUnitario_currency,
+            'costoUnitario_pen': row.costoUnitario_pen,
 
-            'total_pen': self.total_pen,
-            'periodo_inicio': self.periodo_inicio,
-            'duracion_meses': self.duracion_meses
+            'total_pen': total_pen,
+            'periodo_inicio': row.periodo_inicio,
+            'duracion_meses': row.duracion_meses
         }
 
+    def to_dict(self):
+        """Converts the fixed cost to a dictionary."""
+        return FixedCost.row_to_dict(self)
+
 # --- 4. RECURRING SERVICE MODEL (EXISTING) ---
 class RecurringService(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -233,29 +254,41 @@ class RecurringService(db.Model):
         q = self.Q or 0
         return (cu1_pen + cu2_pen) * q
 
-    def to_dict(self):
-        """Converts the recurring service to a dictionary."""
+    @staticmethod
+    def row_to_dict(row):
+        """
+        Converts a row with the table's column attributes (a RecurringService
+        or a column-query Row) to a dictionary, including the derived
+        ingreso_pen / egreso_pen.
+        """
+        ingreso_pen = None
+        if row.Q is not None and row.P_pen is not None:
+            ingreso_pen = row.Q * row.P_pen
         return {
-            'id': self.id,
-            'transaction_id': self.transaction_id,
-            'tipo_servicio': self.tipo_servicio,
-            'nota': self.nota,
-            'ubicacion': self.ubicacion,
-            'Q': self.Q,
+            'id': row.id,
+            'transaction_id': row.transaction_id,
+            'tipo_servicio': row.tipo_servicio,
+            'nota': row.nota,
+            'ubicacion': row.ubicacion,
+            'Q': row.Q,
             
-            'P_original': self.P_original,
-            'P_currency': self.P_currency,
-            'P_pen': self.P_pen,
-            'CU1_original': self.CU1_original,
-            'CU2_original': self.CU2_original,
-            'CU_currency': self.CU_currency,
-            'CU1_pen': self.CU1_pen,
-            'CU2_pen': self.CU2_pen,
-
-            'proveedor': self.proveedor,
-            'ingreso_pen': self.ingreso_pen,
-            'egreso_pen': self.egreso_pen
+            'P_original': row.P_original,
+            'P_currency': row.P_currency,
+            'P_pen': row.P_pen,
+            'CU1_original': row.CU1_original,
+            'CU2_original': row.CU2_original,
+            'CU_currency': row.CU_currency,
+            'CU1_pen': row.CU1_pen,
+            'CU2_pen': row.CU2_pen,
+
+            'proveedor': row.proveedor,
+            'ingreso_pen': ingreso_pen,
+            'egreso_pen': ((row.CU1_pen or 0) + (row.CU2_pen or 0)) * (row.Q or 0)
         }
+
+    def to_dict(self):
+        """Converts the recurring service to a dictionary."""
+        return RecurringService.row_to_dict(self)
     
 # --- 5. NEW: MASTER VARIABLE MODEL ---
 class MasterVariable(db.Model):
@@ -294,4 +327,56 @@ class MasterVariable(db.Model):
             'user_id': self.user_id,
             'recorder_username': self.recorder.username if self.recorder else None,
             'comment': self.comment # Add the comment to the JSON output
-        }
\ No newline at end of file
+        }
+
+# --- 6. KPI ROLLUP MODEL ---
+class KpiRollup(db.Model):
+    """
+    Pre-aggregated dashboard KPIs per (salesman, ApprovalStatus, submission month).
+    Maintained incrementally in the same DB transaction as every Transaction
+    write (see services/kpi_rollup.py), so KPI reads touch O(#salesmen) rows
+    instead of scanning the transaction table.
+    """
+    __tablename__ = 'kpi_rollup'
+
+    salesman = db.Column(db.String(128), primary_key=True)
+    ApprovalStatus = db.Column(db.String(64), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)  # First day of the submission month
+
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    mrc_pen_sum = db.Column(db.Float, nullable=False, default=0.0)
+    comisiones_sum = db.Column(db.Float, nullable=False, default=0.0)
+    # Sum and count of non-null grossMarginRatio values (average = sum / count)
+    gross_margin_ratio_sum = db.Column(db.Float, nullable=False, default=0.0)
+    gross_margin_ratio_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'salesman': self.salesman,
+            'ApprovalStatus': self.ApprovalStatus,
+            'month': self.month.isoformat(),
+            'transaction_count': self.transaction_count,
+            'mrc_pen_sum': self.mrc_pen_sum,
+            'comisiones_sum': self.comisiones_sum,
+            'gross_margin_ratio_sum': self.gross_margin_ratio_sum,
+            'gross_margin_ratio_count': self.gross_margin_ratio_count,
+        }
+
+# --- 7. IDEMPOTENCY KEY MODEL ---
+class IdempotencyKey(db.Model):
+    """
+    Outcome of a POST sent with an Idempotency-Key header, so that client
+    retries replay the first response instead of repeating the work
+    (see services/idempotency.py). Rows expire after IDEMPOTENCY_KEY_TTL seconds.
+    """
+    __tablename__ = 'idempotency_key'
+
+    # Keys are scoped per user
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    key = db.Column(db.String(128), primary_key=True)
+    # SHA-256 of method, path and body: a key may not be reused for another request
+    request_hash = db.Column(db.String(64), nullable=False)
+    # NULL while the first request is still being processed
+    status_code = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
@@ -0,0 +1,128 @@
+# app/services/analytics.py
+# Management analytics (FINANCE/ADMIN): salesman and business-unit leaderboards.
+# Computed in PostgreSQL with window functions and percentile_cont in a single
+# query, and cached per process for ANALYTICS_CACHE_TTL seconds.
+
+import time
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, cast, Float
+from app import db
+from app.models import Transaction
+
+LEADERBOARD_GROUPS = ('salesman', 'unidadNegocio')
+
+# Module-level result cache (one per gunicorn worker process)
+_leaderboard_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _leaderboard_rows(group_by, date_from, date_to):
+    group_column = getattr(Transaction, group_by)
+    is_approved = Transaction.ApprovalStatus == 'APPROVED'
+    is_rejected = Transaction.ApprovalStatus == 'REJECTED'
+
+    approved_mrc = func.coalesce(func.sum(Transaction.MRC_pen).filter(is_approved), 0.0)
+    # Rows are counted with count(*), not count(id): id is not in the covering
+    # index (idx_transaction_leaderboard_covering), so the query stays index-only
+    approved_count = func.count().filter(is_approved)
+    rejected_count = func.count().filter(is_rejected)
+    # Share of decided (approved + rejected) deals that were approved
+    approval_rate = cast(approved_count, Float) / func.nullif(approved_count + rejected_count, 0)
+    median_payback = func.percentile_cont(0.5).within_group(Transaction.payback).filter(is_approved)
+
+    query = db.session.query(
+        group_column.label('group'),
+        func.count().label('transaction_count'),
+        approved_count.label('approved_count'),
+        rejected_count.label('rejected_count'),
+        approved_mrc.label('approved_mrc'),
+        func.rank().over(order_by=approved_mrc.desc()).label('rank_approved_mrc'),
+        approval_rate.label('approval_rate'),
+        func.rank().over(order_by=approval_rate.desc().nulls_last()).label('rank_approval_rate'),
+        median_payback.label('median_payback'),
+        func.rank().over(order_by=median_payback.asc().nulls_last()).label('rank_median_payback'),
+        func.avg(Transaction.grossMarginRatio).label('margin_average'),
+        func.percentile_cont(0.25).within_group(Transaction.grossMarginRatio).label('margin_p25'),
+        func.percentile_cont(0.5).within_group(Transaction.grossMarginRatio).label('margin_median'),
+        func.percentile_cont(0.75).within_group(Transaction.grossMarginRatio).label('margin_p75')
+    )
+
+    if date_from is not None:
+        query = query.filter(Transaction.submissionDate >= datetime.combine(date_from, datetime.min.time()))
+    if date_to is not None:
+        query = query.filter(Transaction.submissionDate < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+
+    return query.group_by(group_column).order_by('rank_approved_mrc', group_column).all()
+
+
+def get_leaderboard(group_by='salesman', date_from=None, date_to=None):
+    """
+    Ranks salesmen (or business units) by approved MRC, approval rate and
+    median payback, with the gross margin distribution (p25/median/p75) of
+    each group. Access is restricted to FINANCE/ADMIN at the route level.
+
+    Parameters:
+        group_by (str): 'salesman' or 'unidadNegocio'.
+        date_from / date_to (date, optional): Submission date range (inclusive).
+
+    Returns:
+        tuple: (dict, status_code) on error, or dict on success
+    """
+    try:
+        key = (group_by, date_from, date_to)
+        now = time.monotonic()
+        with _cache_lock:
+            entry = _leaderboard_cache.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        rows = _leaderboard_rows(group_by, date_from, date_to)
+
+        def _float(value):
+            return float(value) if value is not None else None
+
+        result = {
+            "success": True,
+            "data": {
+                "group_by": group_by,
+                "generated_at": datetime.utcnow().isoformat(),
+                "rows": [
+                    {
+                        "group": row.group,
+                        "transaction_count": int(row.transaction_count),
+                        "approved_count": int(row.approved_count),
+                        "rejected_count": int(row.rejected_count),
+                        "approved_mrc": float(row.approved_mrc),
+                        "rank_approved_mrc": int(row.rank_approved_mrc),
+                        "approval_rate": _float(row.approval_rate),
+                        "rank_approval_rate": int(row.rank_approval_rate),
+                        "median_payback": _float(row.median_payback),
+                        "rank_median_payback": int(row.rank_median_payback),
+                        "margin_average": _float(row.margin_average),
+                        "margin_p25": _float(row.margin_p25),
+                        "margin_median": _float(row.margin_median),
+                        "margin_p75": _float(row.margin_p75),
+                    }
+                    for row in rows
+                ]
+            },
+            "filters": {
+                "from": date_from.isoformat() if date_from else None,
+                "to": date_to.isoformat() if date_to else None
+            }
+        }
+
+        with _cache_lock:
+            # Drop expired entries so distinct filter combinations do not pile up
+            for stale_key in [k for k, (expires_at, _) in _leaderboard_cache.items() if expires_at <= now]:
+                del _leaderboard_cache[stale_key]
+            _leaderboard_cache[key] = (now + current_app.config['ANALYTICS_CACHE_TTL'], result)
+
+        return result
+
+    except Exception as e:
+        current_app.logger.error("Error computing leaderboard: %s", str(e), exc_info=True)
+        return ({"success": False, "error": f"Database error: {str(e)}"}, 500)
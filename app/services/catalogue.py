@@ -0,0 +1,198 @@
+# app/services/catalogue.py
+# In-memory price catalogue index for line-item autocomplete.
+# Built from the Data Warehouse and refreshed periodically, so type-ahead
+# queries are answered with a binary search instead of a DW round-trip.
+
+import threading
+import unicodedata
+from bisect import bisect_left
+from datetime import datetime
+from threading import Thread
+
+import psycopg2
+from flask import current_app
+
+from .datawarehouse import connect_datawarehouse, call_with_breaker, DataWarehouseUnavailable
+
+
+def _normalize(text):
+    """Case- and accent-insensitive search key ('Inversión ' -> 'inversion')."""
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return ' '.join(stripped.casefold().split())
+
+
+class CatalogueIndex:
+    """
+    Prefix index over catalogue entries using sorted arrays and bisect.
+
+    Every entry is indexed under its code, its full name and each word-suffix
+    of its name ('internet dedicado' is found by 'inter' and by 'dedi').
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.built_at = datetime.utcnow()
+
+        pairs = []
+        for position, entry in enumerate(entries):
+            keys = {_normalize(entry['code'])}
+            words = _normalize(entry['name'] or '').split(' ')
+            for i in range(len(words)):
+                keys.add(' '.join(words[i:]))
+            pairs.extend((key, position) for key in keys if key)
+
+        pairs.sort()
+        self._keys = [key for key, _ in pairs]
+        self._positions = [position for _, position in pairs]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, query, limit=20, entry_type=None):
+        """Returns up to 'limit' entries with a key starting with 'query'."""
+        prefix = _normalize(query)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        i = bisect_left(self._keys, prefix)
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            position = self._positions[i]
+            i += 1
+            if position in seen:
+                continue
+            seen.add(position)
+            entry = self.entries[position]
+            if entry_type and entry['type'] != entry_type:
+                continue
+            results.append(entry)
+            if len(results) >= limit:
+                break
+        return results
+
+
+# Module-level state (one index per gunicorn worker process)
+_index = None
+_refreshing = False
+# Re-entrant: the first build runs under it (see get_catalogue_index) and
+# _build_index takes it again to publish the index
+_state_lock = threading.RLock()
+
+
+def _fetch_catalogue_entries():
+    """
+    Reads the distinct service and product names from the DW through
+    server-side cursors, so the load does not spike worker memory.
+    """
+    itersize = current_app.config['DW_STREAM_ITERSIZE']
+    entries = []
+
+    conn = connect_datawarehouse()
+    try:
+        cursor = conn.cursor(name='catalogue_cotizacion')
+        cursor.itersize = itersize
+        cursor.execute("""
+            SELECT DISTINCT "cotizacion", "servicio"
+            FROM dim_cotizacion_bi
+            WHERE "cotizacion" IS NOT NULL;
+        """)
+        for cotizacion, servicio in cursor:
+            entries.append({"type": "recurring_service", "code": cotizacion, "name": servicio})
+        cursor.close()
+
+        cursor = conn.cursor(name='catalogue_ticket')
+        cursor.itersize = itersize
+        cursor.execute("""
+            SELECT DISTINCT ticket, producto
+            FROM dim_ticket_interno_producto_bi
+            WHERE ticket IS NOT NULL;
+        """)
+        for ticket, producto in cursor:
+            entries.append({"type": "fixed_cost", "code": ticket, "name": producto})
+        cursor.close()
+    finally:
+        conn.close()
+
+    return entries
+
+
+def _build_index():
+    global _index
+    entries = call_with_breaker(_fetch_catalogue_entries)
+    index = CatalogueIndex(entries)
+    with _state_lock:
+        _index = index
+    current_app.logger.info("Catalogue index built: %d entries", len(index))
+    return index
+
+
+def _refresh_in_background(app):
+    global _refreshing
+    with app.app_context():
+        try:
+            _build_index()
+        except Exception as e:
+            current_app.logger.warning("Catalogue index refresh failed: %s", str(e))
+        finally:
+            with _state_lock:
+                _refreshing = False
+
+
+def get_catalogue_index():
+    """
+    Returns the current catalogue index, building it on first use.
+    Once older than CATALOGUE_REFRESH_INTERVAL seconds it keeps being served
+    while a background thread rebuilds it.
+    """
+    global _refreshing
+    with _state_lock:
+        index = _index
+    if index is None:
+        # Only one thread scans the DW; concurrent first requests wait for it
+        with _state_lock:
+            if _index is None:
+                return _build_index()
+            index = _index
+
+    age = (datetime.utcnow() - index.built_at).total_seconds()
+    if age > current_app.config['CATALOGUE_REFRESH_INTERVAL']:
+        with _state_lock:
+            start_refresh = not _refreshing
+            _refreshing = True
+        if start_refresh:
+            app = current_app._get_current_object()
+            Thread(target=_refresh_in_background, args=[app], daemon=True).start()
+
+    return index
+
+
+def search_catalogue(query, limit=20, entry_type=None):
+    """
+    Type-ahead search over quotation codes/services (dim_cotizacion_bi) and
+    tickets/products (dim_ticket_interno_producto_bi).
+
+    Args:
+        query: Prefix typed by the user (matched against codes and name words)
+        limit: Maximum number of results
+        entry_type: Optional filter, 'recurring_service' or 'fixed_cost'
+    """
+    try:
+        index = get_catalogue_index()
+        results = index.search(query, limit=limit, entry_type=entry_type)
+        return {
+            "success": True,
+            "data": {
+                "results": results,
+                "built_at": index.built_at.isoformat()
+            }
+        }
+    except DataWarehouseUnavailable:
+        return {"success": False, "error": "The catalogue is not available yet because the Data Warehouse is unreachable. Please try again later."}, 503
+    except psycopg2.Error as e:
+        current_app.logger.error("Data Warehouse error while building catalogue index: %s", str(e), exc_info=True)
+        return {"success": False, "error": f"Database query failed. Error: {str(e)}"}, 500
+    except Exception as e:
+        current_app.logger.error("Unexpected error during catalogue search: %s", str(e), exc_info=True)
+        return {"success": False, "error": f"An unexpected error occurred during search: {str(e)}"}, 500
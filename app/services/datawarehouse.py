@@ -0,0 +1,415 @@
+# app/services/datawarehouse.py
+# Data Warehouse access layer: pooled connections with per-call timeouts, a
+# circuit breaker that fails fast during DW brown-outs, and a
+# stale-while-revalidate cache for lookup results.
+
+import os
+import time
+import threading
+import urllib.parse
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Thread
+
+import psycopg2
+import psycopg2.pool
+from flask import current_app
+
+
+class DataWarehouseUnavailable(Exception):
+    """
+    Raised when the DW must not be contacted right now: the circuit breaker is
+    open, or no pooled connection became free within DW_CONNECT_TIMEOUT.
+    """
+
+
+# --- CIRCUIT BREAKER ---
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker over a rolling window of recent DW calls.
+
+    - CLOSED: calls go through; outcomes are recorded in the window.
+    - OPEN: calls fail fast until 'reset_timeout' seconds have passed.
+    - HALF_OPEN: a single trial call is let through; success closes the
+      circuit, failure opens it again.
+    """
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+    def __init__(self, failure_rate_threshold=0.5, window_size=20, min_calls=5, reset_timeout=30):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self._outcomes = deque(maxlen=window_size)
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow_request(self):
+        """Returns True if a DW call may be attempted right now."""
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+
+            if self._state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+                self._trial_in_flight = False
+            self._outcomes.append(True)
+
+    def release_trial(self):
+        """Ends a HALF_OPEN trial that never reached the DW (no outcome to record)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open()
+                return
+
+            self._outcomes.append(False)
+            if len(self._outcomes) >= self.min_calls:
+                failure_rate = self._outcomes.count(False) / len(self._outcomes)
+                if failure_rate >= self.failure_rate_threshold:
+                    self._open()
+
+    def _open(self):
+        # Caller must hold the lock
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._trial_in_flight = False
+
+
+# --- LOOKUP CACHE ---
+
+class LookupCache:
+    """
+    Per-process cache of raw DW lookup records, keyed by (kind, code).
+    Each entry remembers when it was fetched so callers can tell fresh
+    entries from stale ones. Oldest entries are evicted beyond 'max_entries'.
+    """
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind, code):
+        """Returns (records, age_in_seconds) or None if the code was never fetched."""
+        with self._lock:
+            entry = self._entries.get((kind, code))
+        if entry is None:
+            return None
+        fetched_at, records = entry
+        return records, time.monotonic() - fetched_at
+
+    def set_many(self, kind, records_by_code):
+        now = time.monotonic()
+        with self._lock:
+            for code, records in records_by_code.items():
+                key = (kind, code)
+                self._entries.pop(key, None)
+                self._entries[key] = (now, records)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Module-level singletons (one per gunicorn worker process)
+_breaker = None
+_singleton_lock = threading.Lock()
+_lookup_cache = None
+_revalidating = set()
+_pool = None
+_pool_slots = None
+_pool_pid = None
+_executor = None
+_executor_pid = None
+_revalidating_lock = threading.Lock()
+
+
+def get_circuit_breaker():
+    """Returns the process-wide DW circuit breaker, configured from app config."""
+    global _breaker
+    if _breaker is None:
+        with _singleton_lock:
+            if _breaker is None:
+                config = current_app.config
+                _breaker = CircuitBreaker(
+                    failure_rate_threshold=config['DW_BREAKER_FAILURE_RATE'],
+                    window_size=config['DW_BREAKER_WINDOW_SIZE'],
+                    min_calls=config['DW_BREAKER_MIN_CALLS'],
+                    reset_timeout=config['DW_BREAKER_RESET_TIMEOUT']
+                )
+    return _breaker
+
+
+def get_lookup_cache():
+    """Returns the process-wide DW lookup cache."""
+    global _lookup_cache
+    if _lookup_cache is None:
+        with _singleton_lock:
+            if _lookup_cache is None:
+                _lookup_cache = LookupCache(current_app.config['DW_LOOKUP_CACHE_MAX_ENTRIES'])
+    return _lookup_cache
+
+
+# --- CONNECTIONS ---
+
+def _connection_kwargs():
+    """psycopg2 connection arguments, including connect and statement timeouts."""
+    config = current_app.config
+    url = urllib.parse.urlparse(config['DATAWAREHOUSE_URI'])
+
+    return dict(
+        dbname=url.path[1:],
+        user=url.username,
+        password=url.password,
+        host=url.hostname,
+        port=url.port,
+        connect_timeout=config['DW_CONNECT_TIMEOUT'],
+        options=f"-c statement_timeout={config['DW_STATEMENT_TIMEOUT_MS']}"
+    )
+
+
+def connect_datawarehouse():
+    """
+    Opens a dedicated psycopg2 connection to the external Data Warehouse with a
+    connect timeout and a server-side statement timeout, so a slow DW cannot
+    hold a sync worker hostage. Used for long-lived (streaming) reads.
+    """
+    return psycopg2.connect(**_connection_kwargs())
+
+
+def _get_pool():
+    """
+    Returns this process's DW connection pool and the semaphore guarding its
+    slots. Both are created lazily and re-created after a fork, so gunicorn
+    workers never share sockets.
+    """
+    global _pool, _pool_slots, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _singleton_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                max_connections = current_app.config['DW_POOL_MAX_CONNECTIONS']
+                _pool = psycopg2.pool.ThreadedConnectionPool(0, max_connections, **_connection_kwargs())
+                _pool_slots = threading.BoundedSemaphore(max_connections)
+                _pool_pid = os.getpid()
+    return _pool, _pool_slots
+
+
+@contextmanager
+def dw_connection():
+    """
+    Borrows a pooled DW connection for short lookup queries.
+    Callers wait up to DW_CONNECT_TIMEOUT for a free slot instead of getting a
+    PoolError when request, executor, revalidation and prefetch threads exhaust
+    the pool together (an exhausted pool is not a DW failure and must not trip
+    the breaker). The connection is rolled back before being returned to the
+    pool, and discarded if the query failed (it may be broken).
+
+    Raises:
+        DataWarehouseUnavailable: If no connection became free in time
+    """
+    pool, slots = _get_pool()
+    if not slots.acquire(timeout=current_app.config['DW_CONNECT_TIMEOUT']):
+        raise DataWarehouseUnavailable("No Data Warehouse connection became free in time.")
+    try:
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.rollback()
+        except Exception:
+            pool.putconn(conn, close=True)
+            raise
+        else:
+            pool.putconn(conn)
+    finally:
+        slots.release()
+
+
+def run_concurrently(*calls):
+    """
+    Runs independent DW calls in parallel threads and returns their results in
+    order. Each call is a (fn, args) tuple and runs inside the app context, so
+    total latency is that of the slowest call rather than the sum.
+    """
+    app = current_app._get_current_object()
+
+    def _run(fn, args):
+        with app.app_context():
+            return fn(*args)
+
+    futures = [_get_executor().submit(_run, fn, args) for fn, args in calls]
+    return [future.result() for future in futures]
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _singleton_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(
+                    max_workers=current_app.config['DW_POOL_MAX_CONNECTIONS'],
+                    thread_name_prefix='dw-lookup'
+                )
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def call_with_breaker(fn, *args, **kwargs):
+    """
+    Runs a DW call through the circuit breaker.
+
+    Raises:
+        DataWarehouseUnavailable: If the circuit is open (fail fast) or no
+            pooled connection became free in time (not recorded as a failure)
+        Exception: Whatever the call itself raises (recorded as a failure)
+    """
+    breaker = get_circuit_breaker()
+    if not breaker.allow_request():
+        raise DataWarehouseUnavailable("Data Warehouse circuit is open; failing fast.")
+
+    succeeded = False
+    try:
+        result = fn(*args, **kwargs)
+        succeeded = True
+    except DataWarehouseUnavailable:
+        # Local back-pressure (pool exhausted): the DW was never contacted
+        breaker.release_trial()
+        succeeded = None
+        raise
+    finally:
+        # Every outcome is recorded, whatever the exception type, so a
+        # HALF_OPEN trial always settles instead of blocking the circuit
+        if succeeded:
+            breaker.record_success()
+        elif succeeded is False:
+            breaker.record_failure()
+    return result
+
+
+# --- STALE-WHILE-REVALIDATE LOOKUPS ---
+
+def cached_lookup(kind, codes, fetch_fn):
+    """
+    Resolves lookup codes through the cache, hitting the DW only for codes
+    that were never fetched (or are older than the stale limit).
+
+    Args:
+        kind: Cache namespace (e.g. 'investment', 'recurring_service')
+        codes: List of lookup codes
+        fetch_fn: Callable(codes) -> {code: [records]} that queries the DW
+
+    Returns:
+        tuple: ({code: [records]}, stale) where 'stale' is True if any entry
+               was served past its fresh TTL. Stale entries are refreshed in
+               a background thread.
+
+    Raises:
+        DataWarehouseUnavailable / psycopg2.Error: If uncached codes cannot be fetched
+    """
+    config = current_app.config
+    fresh_ttl = config['DW_LOOKUP_CACHE_TTL']
+    stale_ttl = config['DW_LOOKUP_CACHE_STALE_TTL']
+    cache = get_lookup_cache()
+
+    results = {}
+    stale_codes = []
+    missing_codes = []
+
+    for code in dict.fromkeys(codes):
+        entry = cache.get(kind, code)
+        if entry is None or entry[1] > stale_ttl:
+            missing_codes.append(code)
+            continue
+        records, age = entry
+        results[code] = records
+        if age > fresh_ttl:
+            stale_codes.append(code)
+
+    if missing_codes:
+        fetched = call_with_breaker(fetch_fn, missing_codes)
+        # Codes not found in the DW are cached as empty lists (negative caching)
+        fetched = {code: fetched.get(code, []) for code in missing_codes}
+        cache.set_many(kind, fetched)
+        results.update(fetched)
+
+    if stale_codes:
+        _revalidate_async(kind, stale_codes, fetch_fn)
+
+    return results, bool(stale_codes)
+
+
+def prefetch_async(kind, codes, fetch_fn):
+    """
+    Warms the lookup cache in a background thread for codes that are not
+    already fresh, so follow-up lookups are served from memory.
+    Best-effort: DW errors in the background thread are logged, not raised.
+    """
+    fresh_ttl = current_app.config['DW_LOOKUP_CACHE_TTL']
+    cache = get_lookup_cache()
+
+    pending = []
+    for code in dict.fromkeys(codes):
+        entry = cache.get(kind, code)
+        if entry is None or entry[1] > fresh_ttl:
+            pending.append(code)
+
+    if pending:
+        _revalidate_async(kind, pending, fetch_fn)
+
+
+def _revalidate_async(kind, codes, fetch_fn):
+    """Refreshes cache entries in a background thread (deduplicated per code)."""
+    with _revalidating_lock:
+        pending = [code for code in codes if (kind, code) not in _revalidating]
+        _revalidating.update((kind, code) for code in pending)
+    if not pending:
+        return
+
+    app = current_app._get_current_object()
+    thr = Thread(target=_revalidate, args=[app, kind, pending, fetch_fn], daemon=True)
+    thr.start()
+
+
+def _revalidate(app, kind, codes, fetch_fn):
+    # We must use the app_context to access current_app.config in the background thread.
+    with app.app_context():
+        try:
+            fetched = call_with_breaker(fetch_fn, codes)
+            get_lookup_cache().set_many(kind, {code: fetched.get(code, []) for code in codes})
+        except DataWarehouseUnavailable:
+            # Circuit open or pool busy; keep serving stale data until the next attempt
+            pass
+        except Exception as e:
+            current_app.logger.warning("Background revalidation of %s lookups failed: %s", kind, str(e))
+        finally:
+            with _revalidating_lock:
+                _revalidating.difference_update((kind, code) for code in codes)
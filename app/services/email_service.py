@@ -114,4 +114,44 @@ def send_status_update_email(transaction, new_status):
     if new_status == "REJECTED" and transaction.rejection_note:
         body += f"\n\nMotivo del rechazo:\n{transaction.rejection_note}"
 
-    send_email_async(recipient_email, subject, body)
\ No newline at end of file
+    send_email_async(recipient_email, subject, body)
+
+
+def send_status_digest_emails(transactions, new_status):
+    """
+    Triggered by a batch approval or rejection.
+    Sends one email per salesman listing all of their transactions in the batch.
+    """
+    if not current_app.config.get('MAIL_USERNAME') or not transactions:
+        print("--- DIAGNOSTIC: MAIL_USERNAME not set or empty batch. Skipping email. ---")
+        return
+
+    by_salesman = {}
+    for transaction in transactions:
+        by_salesman.setdefault(transaction.salesman, []).append(transaction)
+
+    # 1. Find all the salesmen's emails in one query
+    emails = {
+        user.username: user.email
+        for user in User.query.filter(User.username.in_(list(by_salesman))).all()
+    }
+
+    status_text = "confirmado" if new_status == "APPROVED" else "rechazado"
+    for salesman, salesman_transactions in by_salesman.items():
+        recipient_email = emails.get(salesman)
+        if not recipient_email:
+            print(f"--- DIAGNOSTIC: Could not find email for salesman {salesman}. Skipping email. ---")
+            continue
+
+        # 2. Format the digest
+        subject = f"Actualización de Solicitudes: {len(salesman_transactions)} {status_text}s"
+        lines = [f"Se han {status_text} las siguientes solicitudes:"]
+        for transaction in salesman_transactions:
+            lines.append(f"- {transaction.clientName} (ID: {transaction.id})")
+
+        # Rejection note is shared by the whole batch
+        rejection_note = salesman_transactions[0].rejection_note
+        if new_status == "REJECTED" and rejection_note:
+            lines.append(f"\nMotivo del rechazo:\n{rejection_note}")
+
+        send_email_async(recipient_email, subject, "\n".join(lines))
@@ -9,6 +9,25 @@ from flask_login import login_required
 # --- Service Dependencies ---
 from .variables import get_latest_master_variables
 from .transactions import _calculate_financial_metrics, _convert_numpy_types
+from .fixed_costs import prefetch_deal_codes
+
+
+def _extract_lookup_codes(rows, field):
+    """
+    Collects the distinct, non-empty lookup codes found in 'field' of the parsed rows.
+    Numeric cells (e.g. a ticket read as 12345.0) are normalized to '12345'.
+    """
+    codes = []
+    for row in rows:
+        value = row.get(field)
+        if value is None or pd.isna(value):
+            continue
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        code = str(value).strip()
+        if code:
+            codes.append(code)
+    return list(dict.fromkeys(codes))
 
 
 @login_required 
@@ -197,6 +216,12 @@ def process_excel_file(excel_file):
 
         clean_data = _convert_numpy_types(final_data_package)
 
+        # Step 7: Warm the DW lookup cache for the codes in the workbook.
+        # Reps almost always look up these tickets right after parsing.
+        # NOTE: The template has no quotation ('cotizacion') column, so only
+        # the fixed-cost tickets can be prefetched.
+        prefetch_deal_codes(_extract_lookup_codes(clean_data['fixed_costs'], 'ticket'))
+
         return {"success": True, "data": clean_data}
 
     except Exception as e:
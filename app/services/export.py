@@ -0,0 +1,205 @@
+# app/services/export.py
+# Streaming exports of the transaction list (CSV / NDJSON / XLSX).
+#
+# Rows are read with yield_per (a server-side cursor on PostgreSQL) and written
+# out batch by batch, so memory stays flat regardless of the export size.
+
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+from itertools import islice
+
+from openpyxl import Workbook
+from app.models import Transaction, FixedCost, RecurringService
+from .transactions import _transaction_list_query, _list_row_to_dict
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+_BATCH_SIZE = 1000
+_FILE_CHUNK_SIZE = 64 * 1024
+
+
+def _export_batches(filters, include_metrics):
+    """Yields lists of (transaction_dict, financial_cache) in submission order, newest first."""
+    query = _transaction_list_query(filters=filters)
+    if include_metrics:
+        query = query.add_columns(Transaction.financial_cache, Transaction.financial_cache_version)
+
+    rows = iter(query.order_by(
+        Transaction.submissionDate.desc(), Transaction.id.desc()
+    ).yield_per(_BATCH_SIZE))
+
+    while True:
+        batch = list(islice(rows, _BATCH_SIZE))
+        if not batch:
+            return
+        yield [
+            (_list_row_to_dict(row), _current_metrics(row) if include_metrics else None)
+            for row in batch
+        ]
+
+
+def _current_metrics(row):
+    """
+    The cached metrics of a row, or None if they are outdated: a PENDING
+    deal's cache is only current for the content_version it was built for
+    (closed deals are frozen, so their cache is always current).
+    """
+    if row.ApprovalStatus == 'PENDING' and row.financial_cache_version != row.content_version:
+        return None
+    return row.financial_cache
+
+
+def _children_by_transaction(transaction_ids):
+    """Loads the FixedCost / RecurringService rows of one batch (two IN queries)."""
+    fixed_costs = {transaction_id: [] for transaction_id in transaction_ids}
+    recurring_services = {transaction_id: [] for transaction_id in transaction_ids}
+
+    for cost in FixedCost.query.filter(FixedCost.transaction_id.in_(transaction_ids)).order_by(FixedCost.id):
+        fixed_costs[cost.transaction_id].append(cost.to_dict())
+    for service in RecurringService.query.filter(RecurringService.transaction_id.in_(transaction_ids)).order_by(RecurringService.id):
+        recurring_services[service.transaction_id].append(service.to_dict())
+
+    return fixed_costs, recurring_services
+
+
+def _batches_with_children(filters, include_children, include_metrics):
+    """Yields lists of (transaction_dict, financial_cache, fixed_costs, recurring_services)."""
+    for batch in _export_batches(filters, include_metrics):
+        if include_children:
+            fixed_costs, recurring_services = _children_by_transaction([tx['id'] for tx, _ in batch])
+            yield [
+                (tx, metrics, fixed_costs[tx['id']], recurring_services[tx['id']])
+                for tx, metrics in batch
+            ]
+        else:
+            yield [(tx, metrics, None, None) for tx, metrics in batch]
+
+
+def _generate_ndjson(filters, include_children, include_metrics):
+    for batch in _batches_with_children(filters, include_children, include_metrics):
+        lines = []
+        for tx, metrics, fixed_costs, recurring_services in batch:
+            if include_metrics:
+                tx['financial_cache'] = metrics
+            if include_children:
+                tx['fixed_costs'] = fixed_costs
+                tx['recurring_services'] = recurring_services
+            lines.append(json.dumps(tx, default=str) + "\n")
+        yield ''.join(lines)
+
+
+def _generate_csv(filters, include_children, include_metrics):
+    # Nested data is written as JSON text columns (one CSV line per transaction)
+    header = list(Transaction.LIST_FIELDS)
+    if include_metrics:
+        header.append('financial_cache')
+    if include_children:
+        header.extend(['fixed_costs', 'recurring_services'])
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+
+    for batch in _batches_with_children(filters, include_children, include_metrics):
+        buffer.seek(0)
+        buffer.truncate()
+        for tx, metrics, fixed_costs, recurring_services in batch:
+            values = [tx[field] for field in Transaction.LIST_FIELDS]
+            if include_metrics:
+                values.append(json.dumps(metrics, default=str) if metrics is not None else '')
+            if include_children:
+                values.append(json.dumps(fixed_costs, default=str))
+                values.append(json.dumps(recurring_services, default=str))
+            writer.writerow(values)
+        yield buffer.getvalue()
+
+
+def _generate_xlsx(filters, include_children, include_metrics):
+    """
+    Builds the workbook with openpyxl's write-only mode (rows go straight to
+    temporary files, not memory), saves it to a temp file and streams it.
+    """
+    workbook = Workbook(write_only=True)
+    transactions_sheet = workbook.create_sheet('Transactions')
+    header = list(Transaction.LIST_FIELDS)
+    if include_metrics:
+        header.append('financial_cache')
+    transactions_sheet.append(header)
+
+    child_sheets = {}
+    if include_children:
+        child_sheets = {
+            'fixed_costs': [workbook.create_sheet('FixedCosts'), None],
+            'recurring_services': [workbook.create_sheet('RecurringServices'), None],
+        }
+
+    def _append_child(kind, item):
+        sheet_state = child_sheets[kind]
+        if sheet_state[1] is None:
+            # Header from the first row's keys
+            sheet_state[1] = list(item.keys())
+            sheet_state[0].append(sheet_state[1])
+        sheet_state[0].append([item.get(field) for field in sheet_state[1]])
+
+    for batch in _batches_with_children(filters, include_children, include_metrics):
+        for tx, metrics, fixed_costs, recurring_services in batch:
+            values = [tx[field] for field in Transaction.LIST_FIELDS]
+            if include_metrics:
+                values.append(json.dumps(metrics, default=str) if metrics is not None else None)
+            transactions_sheet.append(values)
+            if include_children:
+                for item in fixed_costs:
+                    _append_child('fixed_costs', item)
+                for item in recurring_services:
+                    _append_child('recurring_services', item)
+
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as export_file:
+            while True:
+                chunk = export_file.read(_FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+_GENERATORS = {
+    'csv': _generate_csv,
+    'ndjson': _generate_ndjson,
+    'xlsx': _generate_xlsx,
+}
+
+
+def export_transactions(export_format, filters=None, include_children=False, include_metrics=False):
+    """
+    Prepares a streaming export of the (role-filtered) transaction list.
+
+    Args:
+        export_format: 'csv', 'ndjson' or 'xlsx'
+        filters: Optional list filters (see transactions._transaction_filter_conditions)
+        include_children: Include FixedCost / RecurringService rows
+        include_metrics: Include the cached financial metrics (financial_cache);
+            empty for PENDING deals whose cache is outdated
+
+    Returns:
+        tuple: (generator, mimetype, filename) on success, or (dict, status_code) on error
+    """
+    if export_format not in _GENERATORS:
+        return {"success": False, "error": f"Invalid 'format'. Use one of: {', '.join(_GENERATORS)}."}, 400
+
+    filename = f"transactions_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    generator = _GENERATORS[export_format](filters, include_children, include_metrics)
+    return generator, EXPORT_FORMATS[export_format], filename
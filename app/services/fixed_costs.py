@@ -1,10 +1,22 @@
 # In app/services/fixed_costs.py
 
+import json
 import psycopg2
 from flask import current_app
 # <<<
 from flask_login import current_user
-import urllib.parse
+
+# --- Data Warehouse access layer (timeouts, circuit breaker, lookup cache) ---
+from .datawarehouse import (
+    connect_datawarehouse,
+    dw_connection,
+    run_concurrently,
+    cached_lookup,
+    prefetch_async,
+    call_with_breaker,
+    get_circuit_breaker,
+    DataWarehouseUnavailable
+)
 
 
 # --- HELPER FUNCTION ---
@@ -18,43 +30,26 @@ def _normalize_to_pen(value, currency, exchange_rate):
     return value
 
 
-# New Service Function to look up costs
-def lookup_investment_codes(investment_codes, tipo_cambio=1):
-    """
-    Connects to the external Data Warehouse and retrieves FixedCost data
-    based on a list of ticket IDs (Investment Codes).
+def _dw_unavailable_response():
+    """Fail-fast response used while the Data Warehouse is unavailable (see DataWarehouseUnavailable)."""
+    return {"success": False, "error": "The Data Warehouse is temporarily unavailable. Please try again in a few moments."}, 503
 
-    Args:
-        investment_codes: List of ticket IDs to lookup
-        tipo_cambio: Exchange rate for USD to PEN conversion (default: 1)
-    """
-    if not investment_codes:
-        return {"success": True, "data": {"fixed_costs": []}}
 
-    # The external DB URI is stored in app.config
-    db_uri = current_app.config['DATAWAREHOUSE_URI']
+# --- DATA WAREHOUSE QUERIES ---
 
-    # We must parse the connection string to get psycopg2 arguments
-    import urllib.parse
-    url = urllib.parse.urlparse(db_uri)
+def _fetch_investment_records(investment_codes):
+    """
+    Queries dim_ticket_interno_producto_bi for the given tickets.
 
-    conn = None
-    try:
-        # 1. Connect to the external database
-        conn = psycopg2.connect(
-            dbname=url.path[1:], 
-            user=url.username, 
-            password=url.password, 
-            host=url.hostname, 
-            port=url.port
-        )
+    Returns:
+        dict: {ticket: [raw records]}
+    """
+    with dw_connection() as conn:
         cursor = conn.cursor()
 
-        # 2. Construct the dynamic SQL query
         # Use placeholders (%s) for the list of codes for security against SQL injection.
-        # We also need to map DB columns to our model's column names.
         placeholders = ', '.join(['%s'] * len(investment_codes))
-        
+
         # NOTE: producto is mapped to tipo_servicio
         # NOTE: moneda is mapped to costo_currency
         sql_query = f"""
@@ -64,101 +59,26 @@ def lookup_investment_codes(investment_codes, tipo_cambio=1):
         """
 
         cursor.execute(sql_query, investment_codes)
-        records = cursor.fetchall()
-        
-        # 3. Map the raw records to the FixedCost model structure
-        mapped_costs = []
-        for record in records:
-            # DB columns: ticket, producto, cantidad, moneda, costo_unitario
-            ticket, tipo_servicio, cantidad_raw, costo_currency_raw, costoUnitario_raw = record
-            
-            periodo_inicio = 0
-            duracion_meses = 1 
-            costo_currency_clean = (costo_currency_raw or "USD").upper().strip()
-            if costo_currency_clean not in ["PEN", "USD"]:
-                costo_currency_clean = "USD"
-            
-            # Ensure numeric types are valid floats, defaulting to 0.0
-            clean_cantidad = float(cantidad_raw) if cantidad_raw is not None else 0.0
-            clean_costoUnitario = float(costoUnitario_raw) if costoUnitario_raw is not None else 0.0
-            
-            
-            # --- FIX: Calculate PEN values for frontend display ---
-            costoUnitario_pen = _normalize_to_pen(clean_costoUnitario, costo_currency_clean, tipo_cambio)
-            total_pen = clean_cantidad * costoUnitario_pen
-
-            cost = {
-                "id": ticket,
-                "categoria": "Inversión",  # Placeholder category
-                "tipo_servicio": tipo_servicio,
-                "ticket": ticket,
-                "ubicacion": "N/A",  # Placeholder location
-                "cantidad": clean_cantidad,
-                "costoUnitario_original": clean_costoUnitario,
-                "costoUnitario_currency": costo_currency_clean,
-                "costoUnitario_pen": costoUnitario_pen,  # PEN value for frontend
-                "periodo_inicio": periodo_inicio,
-                "duracion_meses": duracion_meses
-            }
-
-            # 4. Calculate the required 'total' field for preview (in original currency)
-            total = cost['cantidad'] * cost['costoUnitario_original']
-            cost['total'] = total
-            cost['total_pen'] = total_pen  # PEN value for frontend display
-            
-            mapped_costs.append(cost)
-
-        return {"success": True, "data": {"fixed_costs": mapped_costs}}
 
-    except psycopg2.Error as e:
-        current_app.logger.error("Data Warehouse connection/query error: %s", str(e), exc_info=True)
-        return {"success": False, "error": f"Database query failed. Error: {str(e)}"}, 500
-    except Exception as e:
-        current_app.logger.error("Unexpected error during Fixed Cost lookup: %s", str(e), exc_info=True)
-        return {"success": False, "error": f"An unexpected error occurred during lookup: {str(e)}"}, 500
-    finally:
-        if conn:
-            conn.close()
+        records_by_code = {}
+        for record in cursor.fetchall():
+            records_by_code.setdefault(record[0], []).append(record)
+        return records_by_code
 
-def lookup_recurring_services(service_codes, tipo_cambio=1):
-    """
-    Connects to the external Data Warehouse and retrieves RecurringService data
-    from the dim_cotizacion_bi table based on a list of service codes (Cotizacion).
 
-    --- MODIFIED ---
-    This function also enriches the data by looking up the 'cliente_id'
-    in the 'dim_cliente_bi' table to add 'ruc' and 'razon_social'.
-
-    Args:
-        service_codes: List of service codes to lookup
-        tipo_cambio: Exchange rate for USD to PEN conversion (default: 1)
+def _fetch_recurring_service_records(service_codes):
     """
-    if not service_codes:
-        return {"success": True, "data": {"recurring_services": []}}
-
-    # The external DB URI is stored in app.config
-    db_uri = current_app.config['DATAWAREHOUSE_URI']
+    Queries dim_cotizacion_bi for the given quotation codes and enriches each
+    record with 'ruc' and 'razon_social' from dim_cliente_bi.
 
-    # We must parse the connection string to get psycopg2 arguments
-    import urllib.parse
-    url = urllib.parse.urlparse(db_uri)
-
-    conn = None
-    try:
-        # 1. Connect to the external database
-        conn = psycopg2.connect(
-            dbname=url.path[1:], 
-            user=url.username, 
-            password=url.password, 
-            host=url.hostname, 
-            port=url.port
-        )
+    Returns:
+        dict: {cotizacion: [raw records + (ruc, razon_social)]}
+    """
+    with dw_connection() as conn:
         cursor = conn.cursor()
 
-        # 2. Construct the dynamic SQL query for services
-        # --- MODIFIED: Added "cliente_id" and fixed "linea" case
         placeholders = ', '.join(['%s'] * len(service_codes))
-        
+
         sql_query = f"""
             SELECT 
                 "servicio", 
@@ -175,15 +95,11 @@ def lookup_recurring_services(service_codes, tipo_cambio=1):
 
         cursor.execute(sql_query, service_codes)
         records = cursor.fetchall()
-        
-        # --- NEW: Step 3 - Collect client_ids for enrichment ---
-        client_ids = set()
-        for record in records:
-            cliente_id = record[7] # Get the 8th item (cliente_id)
-            if cliente_id:
-                client_ids.add(cliente_id)
 
-        # --- NEW: Step 4 - Query client table and build lookup map ---
+        # Collect client_ids for enrichment
+        client_ids = {record[7] for record in records if record[7]}
+
+        # Query client table and build lookup map
         client_lookup_map = {}
         if client_ids:
             client_placeholders = ', '.join(['%s'] * len(client_ids))
@@ -192,96 +108,372 @@ def lookup_recurring_services(service_codes, tipo_cambio=1):
                 FROM dim_cliente_bi
                 WHERE cliente_id IN ({client_placeholders});
             """
-            # Use list(client_ids) to pass the set as a list
-            cursor.execute(client_query, list(client_ids)) 
-            client_records = cursor.fetchall()
-            
-            # Build a fast-access map
-            for client_rec in client_records:
-                c_id, c_ruc, c_razon = client_rec
-                client_lookup_map[c_id] = {
-                    "ruc": c_ruc,
-                    "razon_social": c_razon
-                }
-        
-        # --- MODIFIED: Step 5 - Map records and merge client data ---
-        mapped_services = []
-        
+            cursor.execute(client_query, list(client_ids))
+            for c_id, c_ruc, c_razon in cursor.fetchall():
+                client_lookup_map[c_id] = (c_ruc, c_razon)
+
+        records_by_code = {}
         for record in records:
-            # DB columns: linea, destino_direccion, cantidad, precio_unitario_new, moneda, id_servicio, Cotizacion, cliente_id
-            servicio, destino, cantidad_raw, precio_raw, moneda_raw, id_servicio, cotizacion_code, cliente_id = record
-            
-            # Ensure numeric types are valid floats, defaulting to 0.0
-            clean_q = float(cantidad_raw) if cantidad_raw is not None else 0.0
-            clean_p = float(precio_raw) if precio_raw is not None else 0.0
-            
-            # Clean currency (defaults to PEN if missing)
-            moneda_clean = (moneda_raw or "PEN").upper().strip()
-            if moneda_clean not in ["PEN", "USD"]:
-                moneda_clean = "PEN"
-
-            # Placeholder values for cost fields
-            cu1 = 0.0
-            cu2 = 0.0
-            cu_currency = 'USD'
-            proveedor = None # <-- Set to None as requested
-
-            # --- NEW: Get enriched client data from the map ---
-            # Use .get(cliente_id, {}) to safely handle cases where
-            # the client_id is None or not found in the map
-            client_data = client_lookup_map.get(cliente_id, {})
-            ruc = client_data.get("ruc")
-            razon_social = client_data.get("razon_social")
-            
-            # --- FIX: Calculate _pen fields for frontend display ---
-            P_pen = _normalize_to_pen(clean_p, moneda_clean, tipo_cambio)
-            CU1_pen = _normalize_to_pen(cu1, cu_currency, tipo_cambio)
-            CU2_pen = _normalize_to_pen(cu2, cu_currency, tipo_cambio)
-
-            service = {
-                "id": cotizacion_code,
-                "tipo_servicio": servicio,
-                "ubicacion": destino,
-                "Q": clean_q,
-                "P_original": clean_p,
-                "P_currency": moneda_clean,
-                "P_pen": P_pen,
-
-                # Preview calculation in original currency
-                "ingreso": clean_q * clean_p,
-                # Calculated values in PEN for frontend display
-                "ingreso_pen": clean_q * P_pen,
-
-                # Placeholder fields for costs
-                "CU1_original": cu1,
-                "CU2_original": cu2,
-                "CU_currency": cu_currency,
-                "CU1_pen": CU1_pen,
-                "CU2_pen": CU2_pen,
-                "proveedor": proveedor,
-                "egreso": (cu1 + cu2) * clean_q,
-                # Calculated cost in PEN for frontend display
-                "egreso_pen": (CU1_pen + CU2_pen) * clean_q,
-
-                # Original IDs retained for context
-                "id_servicio_lookup": id_servicio,
-                "cotizacion_code_lookup": cotizacion_code,
-
-                # --- NEW ENRICHED FIELDS ---
-                "ruc": ruc,
-                "razon_social": razon_social
-            }
-            
-            mapped_services.append(service)
-
-        return {"success": True, "data": {"recurring_services": mapped_services}}
+            ruc, razon_social = client_lookup_map.get(record[7], (None, None))
+            records_by_code.setdefault(record[6], []).append(record + (ruc, razon_social))
+        return records_by_code
+
+
+# --- RECORD MAPPING ---
+
+def _map_investment_record(record, tipo_cambio):
+    """Maps a raw dim_ticket_interno_producto_bi record to the FixedCost structure."""
+    # DB columns: ticket, producto, cantidad, moneda, costo_unitario
+    ticket, tipo_servicio, cantidad_raw, costo_currency_raw, costoUnitario_raw = record
+
+    periodo_inicio = 0
+    duracion_meses = 1 
+    costo_currency_clean = (costo_currency_raw or "USD").upper().strip()
+    if costo_currency_clean not in ["PEN", "USD"]:
+        costo_currency_clean = "USD"
+
+    # Ensure numeric types are valid floats, defaulting to 0.0
+    clean_cantidad = float(cantidad_raw) if cantidad_raw is not None else 0.0
+    clean_costoUnitario = float(costoUnitario_raw) if costoUnitario_raw is not None else 0.0
+
+    # --- FIX: Calculate PEN values for frontend display ---
+    costoUnitario_pen = _normalize_to_pen(clean_costoUnitario, costo_currency_clean, tipo_cambio)
+    total_pen = clean_cantidad * costoUnitario_pen
+
+    return {
+        "id": ticket,
+        "categoria": "Inversión",  # Placeholder category
+        "tipo_servicio": tipo_servicio,
+        "ticket": ticket,
+        "ubicacion": "N/A",  # Placeholder location
+        "cantidad": clean_cantidad,
+        "costoUnitario_original": clean_costoUnitario,
+        "costoUnitario_currency": costo_currency_clean,
+        "costoUnitario_pen": costoUnitario_pen,  # PEN value for frontend
+        "periodo_inicio": periodo_inicio,
+        "duracion_meses": duracion_meses,
+        # 'total' for preview (in original currency)
+        "total": clean_cantidad * clean_costoUnitario,
+        "total_pen": total_pen  # PEN value for frontend display
+    }
+
+
+def _map_recurring_service_record(record, tipo_cambio):
+    """Maps an enriched dim_cotizacion_bi record to the RecurringService structure."""
+    # DB columns: servicio, destino_direccion, cantidad, precio_unitario_new, moneda, id_servicio, cotizacion, cliente_id
+    # + enrichment: ruc, razon_social
+    servicio, destino, cantidad_raw, precio_raw, moneda_raw, id_servicio, cotizacion_code, cliente_id, ruc, razon_social = record
+
+    # Ensure numeric types are valid floats, defaulting to 0.0
+    clean_q = float(cantidad_raw) if cantidad_raw is not None else 0.0
+    clean_p = float(precio_raw) if precio_raw is not None else 0.0
+
+    # Clean currency (defaults to PEN if missing)
+    moneda_clean = (moneda_raw or "PEN").upper().strip()
+    if moneda_clean not in ["PEN", "USD"]:
+        moneda_clean = "PEN"
+
+    # Placeholder values for cost fields
+    cu1 = 0.0
+    cu2 = 0.0
+    cu_currency = 'USD'
+    proveedor = None
+
+    # --- FIX: Calculate _pen fields for frontend display ---
+    P_pen = _normalize_to_pen(clean_p, moneda_clean, tipo_cambio)
+    CU1_pen = _normalize_to_pen(cu1, cu_currency, tipo_cambio)
+    CU2_pen = _normalize_to_pen(cu2, cu_currency, tipo_cambio)
+
+    return {
+        "id": cotizacion_code,
+        "tipo_servicio": servicio,
+        "ubicacion": destino,
+        "Q": clean_q,
+        "P_original": clean_p,
+        "P_currency": moneda_clean,
+        "P_pen": P_pen,
+
+        # Preview calculation in original currency
+        "ingreso": clean_q * clean_p,
+        # Calculated values in PEN for frontend display
+        "ingreso_pen": clean_q * P_pen,
+
+        # Placeholder fields for costs
+        "CU1_original": cu1,
+        "CU2_original": cu2,
+        "CU_currency": cu_currency,
+        "CU1_pen": CU1_pen,
+        "CU2_pen": CU2_pen,
+        "proveedor": proveedor,
+        "egreso": (cu1 + cu2) * clean_q,
+        # Calculated cost in PEN for frontend display
+        "egreso_pen": (CU1_pen + CU2_pen) * clean_q,
+
+        # Original IDs retained for context
+        "id_servicio_lookup": id_servicio,
+        "cotizacion_code_lookup": cotizacion_code,
+
+        # --- ENRICHED FIELDS (dim_cliente_bi) ---
+        "ruc": ruc,
+        "razon_social": razon_social
+    }
+
+
+# --- PUBLIC SERVICE FUNCTIONS ---
+
+def lookup_investment_codes(investment_codes, tipo_cambio=1):
+    """
+    Retrieves FixedCost data from the external Data Warehouse based on a list
+    of ticket IDs (Investment Codes).
+
+    Lookups go through the DW circuit breaker and cache: while the DW is slow or
+    down, cached results are served with 'stale': True and refreshed in the
+    background, and uncached codes fail fast with a 503.
+
+    Args:
+        investment_codes: List of ticket IDs to lookup
+        tipo_cambio: Exchange rate for USD to PEN conversion (default: 1)
+    """
+    if not investment_codes:
+        return {"success": True, "data": {"fixed_costs": []}, "stale": False}
+
+    try:
+        records_by_code, stale = cached_lookup('investment', investment_codes, _fetch_investment_records)
+
+        mapped_costs = [
+            _map_investment_record(record, tipo_cambio)
+            for records in records_by_code.values()
+            for record in records
+        ]
+
+        return {"success": True, "data": {"fixed_costs": mapped_costs}, "stale": stale}
+
+    except DataWarehouseUnavailable as e:
+        current_app.logger.warning("Fixed Cost lookup rejected: %s", str(e))
+        return _dw_unavailable_response()
+    except psycopg2.Error as e:
+        current_app.logger.error("Data Warehouse connection/query error: %s", str(e), exc_info=True)
+        return {"success": False, "error": f"Database query failed. Error: {str(e)}"}, 500
+    except Exception as e:
+        current_app.logger.error("Unexpected error during Fixed Cost lookup: %s", str(e), exc_info=True)
+        return {"success": False, "error": f"An unexpected error occurred during lookup: {str(e)}"}, 500
+
+def lookup_recurring_services(service_codes, tipo_cambio=1):
+    """
+    Retrieves RecurringService data from the dim_cotizacion_bi table of the
+    external Data Warehouse based on a list of service codes (Cotizacion).
+
+    Each record is enriched with 'ruc' and 'razon_social' by looking up its
+    'cliente_id' in the 'dim_cliente_bi' table.
+
+    Lookups go through the DW circuit breaker and cache (see lookup_investment_codes).
+
+    Args:
+        service_codes: List of service codes to lookup
+        tipo_cambio: Exchange rate for USD to PEN conversion (default: 1)
+    """
+    if not service_codes:
+        return {"success": True, "data": {"recurring_services": []}, "stale": False}
+
+    try:
+        records_by_code, stale = cached_lookup('recurring_service', service_codes, _fetch_recurring_service_records)
+
+        mapped_services = [
+            _map_recurring_service_record(record, tipo_cambio)
+            for records in records_by_code.values()
+            for record in records
+        ]
 
+        return {"success": True, "data": {"recurring_services": mapped_services}, "stale": stale}
+
+    except DataWarehouseUnavailable as e:
+        current_app.logger.warning("Recurring Service lookup rejected: %s", str(e))
+        return _dw_unavailable_response()
     except psycopg2.Error as e:
         current_app.logger.error("Data Warehouse connection/query error: %s", str(e), exc_info=True)
         return {"success": False, "error": f"Database query failed. Error: {str(e)}"}, 500
     except Exception as e:
         current_app.logger.error("Unexpected error during Recurring Service lookup: %s", str(e), exc_info=True)
         return {"success": False, "error": f"An unexpected error occurred during lookup: {str(e)}"}, 500
+
+
+def lookup_deal_codes(investment_codes, service_codes, tipo_cambio=1):
+    """
+    Combined lookup for loading a deal: resolves Investment Codes (FixedCost)
+    and quotation codes (RecurringService) in one call.
+
+    Both lookups run concurrently on pooled DW connections, so latency is that
+    of the slower query instead of the sum of two HTTP round-trips.
+
+    Args:
+        investment_codes: List of ticket IDs to lookup (may be empty)
+        service_codes: List of quotation codes to lookup (may be empty)
+        tipo_cambio: Exchange rate for USD to PEN conversion (default: 1)
+
+    Returns:
+        dict: {"success": True, "data": {"fixed_costs": [...], "recurring_services": [...]}, "stale": bool}
+        or a tuple (error_dict, status_code) if either lookup fails.
+    """
+    calls = []
+    if investment_codes:
+        calls.append((lookup_investment_codes, (investment_codes, tipo_cambio)))
+    if service_codes:
+        calls.append((lookup_recurring_services, (service_codes, tipo_cambio)))
+
+    try:
+        results = run_concurrently(*calls)
+    except Exception as e:
+        current_app.logger.error("Unexpected error during combined lookup: %s", str(e), exc_info=True)
+        return {"success": False, "error": f"An unexpected error occurred during lookup: {str(e)}"}, 500
+
+    # Surface the first failure (each lookup returns a (dict, status) tuple on error)
+    for result in results:
+        if isinstance(result, tuple):
+            return result
+
+    merged = {"fixed_costs": [], "recurring_services": []}
+    stale = False
+    for result in results:
+        merged.update(result["data"])
+        stale = stale or result["stale"]
+
+    return {"success": True, "data": merged, "stale": stale}
+
+
+def prefetch_deal_codes(investment_codes, service_codes=None):
+    """
+    Starts a background prefetch of the given codes into the DW lookup cache.
+    Called after an Excel template is parsed, since reps almost always look up
+    the tickets and quotation codes that appear in the workbook next.
+    """
+    try:
+        if investment_codes:
+            prefetch_async('investment', investment_codes, _fetch_investment_records)
+        if service_codes:
+            prefetch_async('recurring_service', service_codes, _fetch_recurring_service_records)
+    except Exception as e:
+        # Prefetching is an optimization only; never fail the caller
+        current_app.logger.warning("Could not start DW lookup prefetch: %s", str(e))
+
+
+# --- STREAMING LOOKUPS (NDJSON) ---
+# For bulk lookups the results are read through a named (server-side) cursor
+# in batches of DW_STREAM_ITERSIZE rows, mapped lazily and emitted one JSON
+# object per line, so worker memory stays flat regardless of result size.
+# Streaming lookups bypass the lookup cache.
+
+def _open_stream(stream_fn, codes, tipo_cambio, label):
+    """
+    Opens the DW connection up-front (so connection errors are reported with a
+    proper status code) and returns a generator that owns the connection.
+    """
+    try:
+        conn = call_with_breaker(connect_datawarehouse)
+    except DataWarehouseUnavailable:
+        current_app.logger.warning("%s stream rejected: Data Warehouse circuit is open", label)
+        return _dw_unavailable_response()
+    except psycopg2.Error as e:
+        current_app.logger.error("Data Warehouse connection error: %s", str(e), exc_info=True)
+        return {"success": False, "error": f"Database query failed. Error: {str(e)}"}, 500
+
+    return _ndjson_lines(conn, stream_fn(conn, codes, tipo_cambio), label)
+
+
+def _ndjson_lines(conn, rows, label):
+    """Serializes mapped rows as NDJSON, closing the connection when done."""
+    try:
+        for row in rows:
+            yield json.dumps(row) + "\n"
+    except psycopg2.Error as e:
+        # Headers are already sent: report the failure in-band as the last line
+        get_circuit_breaker().record_failure()
+        current_app.logger.error("Data Warehouse error during %s stream: %s", label, str(e), exc_info=True)
+        yield json.dumps({"success": False, "error": f"Database query failed. Error: {str(e)}"}) + "\n"
     finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        conn.close()
+
+
+def _stream_investment_rows(conn, investment_codes, tipo_cambio):
+    """Yields mapped FixedCost rows from a server-side cursor."""
+    cursor = conn.cursor(name='fixed_costs_lookup_stream')
+    cursor.itersize = current_app.config['DW_STREAM_ITERSIZE']
+
+    placeholders = ', '.join(['%s'] * len(investment_codes))
+    cursor.execute(f"""
+        SELECT ticket, producto, cantidad, moneda, costo_unitario 
+        FROM dim_ticket_interno_producto_bi 
+        WHERE ticket IN ({placeholders});
+    """, investment_codes)
+
+    # Iterating a named cursor fetches 'itersize' rows per round-trip
+    for record in cursor:
+        yield _map_investment_record(record, tipo_cambio)
+
+
+def _stream_recurring_service_rows(conn, service_codes, tipo_cambio):
+    """
+    Yields mapped RecurringService rows from a server-side cursor. Client
+    enrichment (dim_cliente_bi) is done per batch with a regular cursor.
+    """
+    itersize = current_app.config['DW_STREAM_ITERSIZE']
+    cursor = conn.cursor(name='recurring_services_lookup_stream')
+    cursor.itersize = itersize
+    client_cursor = conn.cursor()
+
+    placeholders = ', '.join(['%s'] * len(service_codes))
+    cursor.execute(f"""
+        SELECT 
+            "servicio", 
+            "destino_direccion", 
+            "cantidad", 
+            "precio_unitario_new", 
+            "moneda", 
+            "id_servicio",
+            "cotizacion",
+            "cliente_id" 
+        FROM dim_cotizacion_bi 
+        WHERE "cotizacion" IN ({placeholders});
+    """, service_codes)
+
+    while True:
+        batch = cursor.fetchmany(itersize)
+        if not batch:
+            break
+
+        client_ids = {record[7] for record in batch if record[7]}
+        client_lookup_map = {}
+        if client_ids:
+            client_placeholders = ', '.join(['%s'] * len(client_ids))
+            client_cursor.execute(f"""
+                SELECT cliente_id, ruc, razon_social
+                FROM dim_cliente_bi
+                WHERE cliente_id IN ({client_placeholders});
+            """, list(client_ids))
+            for c_id, c_ruc, c_razon in client_cursor.fetchall():
+                client_lookup_map[c_id] = (c_ruc, c_razon)
+
+        for record in batch:
+            ruc, razon_social = client_lookup_map.get(record[7], (None, None))
+            yield _map_recurring_service_record(record + (ruc, razon_social), tipo_cambio)
+
+
+def stream_investment_codes(investment_codes, tipo_cambio=1):
+    """
+    Streaming variant of lookup_investment_codes.
+
+    Returns:
+        A generator of NDJSON lines (one FixedCost object per line),
+        or a tuple (error_dict, status_code) if the DW cannot be reached.
+    """
+    return _open_stream(_stream_investment_rows, investment_codes, tipo_cambio, "Fixed Cost")
+
+
+def stream_recurring_services(service_codes, tipo_cambio=1):
+    """
+    Streaming variant of lookup_recurring_services.
+
+    Returns:
+        A generator of NDJSON lines (one RecurringService object per line),
+        or a tuple (error_dict, status_code) if the DW cannot be reached.
+    """
+    return _open_stream(_stream_recurring_service_rows, service_codes, tipo_cambio, "Recurring Service")
@@ -0,0 +1,79 @@
+# app/services/idempotency.py
+# Idempotency-Key support for the non-idempotent POST routes (see utils.idempotent).
+#
+# The first request with a key claims it by inserting a placeholder row (the
+# primary key makes concurrent claims of the same key fail), runs, and stores
+# its response. Retries with the same key and body get the stored response
+# back without touching the deal, the calculator or the email service.
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import IdempotencyKey
+
+MAX_KEY_LENGTH = 128
+
+# A claimed key whose request never completed (e.g. the worker died) can be
+# reclaimed after this long
+_IN_PROGRESS_TIMEOUT = timedelta(minutes=5)
+
+
+def _expiry_cutoff(now):
+    return now - timedelta(seconds=current_app.config['IDEMPOTENCY_KEY_TTL'])
+
+
+def claim_idempotency_key(key, request_hash):
+    """
+    Claims an Idempotency-Key for the current user.
+
+    Returns:
+        tuple: (outcome, record) where outcome is
+            'claimed'     - first request with this key; the caller must run it and
+                            then call complete_idempotency_key / release_idempotency_key
+            'replay'      - a response is stored in 'record'
+            'in_progress' - the first request with this key has not finished yet
+            'mismatch'    - the key was used for a different request
+    """
+    now = datetime.utcnow()
+    record = db.session.get(IdempotencyKey, (current_user.id, key))
+
+    if record is not None:
+        abandoned = record.status_code is None and record.created_at < now - _IN_PROGRESS_TIMEOUT
+        if record.created_at < _expiry_cutoff(now) or abandoned:
+            db.session.delete(record)
+        elif record.request_hash != request_hash:
+            return 'mismatch', record
+        elif record.status_code is None:
+            return 'in_progress', record
+        else:
+            return 'replay', record
+
+    # Expired keys are purged opportunistically (indexed on created_at)
+    IdempotencyKey.query.filter(IdempotencyKey.created_at < _expiry_cutoff(now)).delete(synchronize_session=False)
+    record = IdempotencyKey(user_id=current_user.id, key=key, request_hash=request_hash, created_at=now)
+    db.session.add(record)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request claimed the same key first
+        db.session.rollback()
+        return 'in_progress', None
+    return 'claimed', record
+
+
+def complete_idempotency_key(key, status_code, response_body):
+    """Stores the response of a claimed key for replay."""
+    IdempotencyKey.query.filter_by(user_id=current_user.id, key=key).update(
+        {'status_code': status_code, 'response_body': response_body}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def release_idempotency_key(key):
+    """Drops a claimed key whose request failed, so that a retry runs it again."""
+    db.session.rollback()
+    IdempotencyKey.query.filter_by(user_id=current_user.id, key=key).delete(synchronize_session=False)
+    db.session.commit()
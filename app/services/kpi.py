@@ -1,11 +1,15 @@
 # app/services/kpi.py
 # KPI calculation services for dashboard metrics
+#
+# PENDING totals and the all-time average gross margin are read from the
+# kpi_rollup table (one row per salesman/status/month, maintained by
+# services/kpi_rollup.py) instead of scanning the transaction table.
 
 from flask_login import current_user
-from sqlalchemy import func
+from sqlalchemy import func, literal_column
 from app import db
-from app.models import Transaction
-from datetime import datetime, timedelta
+from app.models import Transaction, KpiRollup
+from datetime import datetime, date, timedelta
 
 
 def get_pending_mrc_sum():
@@ -20,14 +24,14 @@ def get_pending_mrc_sum():
     """
     try:
         # Base query: sum MRC_pen for PENDING transactions (all KPIs in PEN)
-        query = db.session.query(func.sum(Transaction.MRC_pen)).filter(
-            Transaction.ApprovalStatus == 'PENDING'
+        query = db.session.query(func.sum(KpiRollup.mrc_pen_sum)).filter(
+            KpiRollup.ApprovalStatus == 'PENDING'
         )
 
         # Apply role-based filtering
         if current_user.role == 'SALES':
             # Sales users only see their own transactions
-            query = query.filter(Transaction.salesman == current_user.username)
+            query = query.filter(KpiRollup.salesman == current_user.username)
         # FINANCE and ADMIN see all pending transactions (no additional filter needed)
 
         # Execute query
@@ -60,14 +64,14 @@ def get_pending_transaction_count():
     """
     try:
         # Base query: count PENDING transactions
-        query = db.session.query(func.count(Transaction.id)).filter(
-            Transaction.ApprovalStatus == 'PENDING'
+        query = db.session.query(func.sum(KpiRollup.transaction_count)).filter(
+            KpiRollup.ApprovalStatus == 'PENDING'
         )
 
         # Apply role-based filtering
         if current_user.role == 'SALES':
             # Sales users only see their own transactions
-            query = query.filter(Transaction.salesman == current_user.username)
+            query = query.filter(KpiRollup.salesman == current_user.username)
         # FINANCE and ADMIN see all pending transactions (no additional filter needed)
 
         # Execute query
@@ -100,14 +104,14 @@ def get_pending_comisiones_sum():
     """
     try:
         # Base query: sum comisiones for PENDING transactions
-        query = db.session.query(func.sum(Transaction.comisiones)).filter(
-            Transaction.ApprovalStatus == 'PENDING'
+        query = db.session.query(func.sum(KpiRollup.comisiones_sum)).filter(
+            KpiRollup.ApprovalStatus == 'PENDING'
         )
 
         # Apply role-based filtering
         if current_user.role == 'SALES':
             # Sales users only see their own transactions
-            query = query.filter(Transaction.salesman == current_user.username)
+            query = query.filter(KpiRollup.salesman == current_user.username)
         # FINANCE and ADMIN see all pending transactions (no additional filter needed)
 
         # Execute query
@@ -128,6 +132,23 @@ def get_pending_comisiones_sum():
         return ({"success": False, "error": f"Database error: {str(e)}"}, 500)
 
 
+def _rollup_average_margin(status_filter=None):
+    """Average grossMarginRatio from kpi_rollup (sum / count), role-filtered."""
+    query = db.session.query(
+        func.sum(KpiRollup.gross_margin_ratio_sum),
+        func.sum(KpiRollup.gross_margin_ratio_count)
+    )
+    if current_user.role == 'SALES':
+        query = query.filter(KpiRollup.salesman == current_user.username)
+    if status_filter is not None:
+        query = query.filter(KpiRollup.ApprovalStatus == status_filter)
+
+    margin_sum, margin_count = query.one()
+    if not margin_count:
+        return 0.0
+    return margin_sum / margin_count
+
+
 def get_average_gross_margin(months_back=None, status_filter=None):
     """
     Returns the average gross margin ratio for transactions based on user role.
@@ -152,7 +173,22 @@ def get_average_gross_margin(months_back=None, status_filter=None):
         - get_average_gross_margin(months_back=3, status_filter='APPROVED') -> last 3 months, approved only
     """
     try:
+        # Without a date window the rollup already holds sum/count per status
+        if months_back is None:
+            avg_margin = _rollup_average_margin(status_filter)
+            return {
+                "success": True,
+                "average_gross_margin_ratio": float(avg_margin),
+                "user_role": current_user.role,
+                "username": current_user.username,
+                "filters": {
+                    "months_back": months_back,
+                    "status_filter": status_filter
+                }
+            }
+
         # Base query: average grossMarginRatio
+        # (the day-based cutoff is finer than the rollup's month buckets)
         query = db.session.query(func.avg(Transaction.grossMarginRatio))
 
         # Apply role-based filtering
@@ -190,3 +226,258 @@ def get_average_gross_margin(months_back=None, status_filter=None):
 
     except Exception as e:
         return ({"success": False, "error": f"Database error: {str(e)}"}, 500)
+
+
+def get_kpi_summary(months_back=None, status_filter=None):
+    """
+    Returns all dashboard KPIs in a single SQL statement over kpi_rollup, using
+    conditional aggregates (FILTER (WHERE ...)) instead of one query per KPI:
+    - total_pending_mrc, pending_count, total_pending_comisiones (PENDING only)
+    - average_gross_margin_ratio (optionally filtered like get_average_gross_margin)
+
+    Parameters:
+        months_back (int, optional): Restricts the average gross margin to the last N months.
+                                     The day-based cutoff needs the transaction table, so
+                                     the average is then computed by a second query.
+        status_filter (str, optional): Restricts the average gross margin to an ApprovalStatus.
+
+    Role-based filtering (applies to every KPI):
+    - SALES: Only their own transactions (matching salesman field)
+    - FINANCE: All transactions
+    - ADMIN: All transactions
+
+    Returns:
+        tuple: (dict, status_code) on error, or dict on success
+    """
+    try:
+        is_pending = KpiRollup.ApprovalStatus == 'PENDING'
+
+        margin_sum = func.sum(KpiRollup.gross_margin_ratio_sum)
+        margin_count = func.sum(KpiRollup.gross_margin_ratio_count)
+        if status_filter is not None:
+            margin_sum = margin_sum.filter(KpiRollup.ApprovalStatus == status_filter)
+            margin_count = margin_count.filter(KpiRollup.ApprovalStatus == status_filter)
+
+        query = db.session.query(
+            func.sum(KpiRollup.mrc_pen_sum).filter(is_pending),
+            func.sum(KpiRollup.transaction_count).filter(is_pending),
+            func.sum(KpiRollup.comisiones_sum).filter(is_pending),
+            margin_sum,
+            margin_count
+        )
+
+        # Apply role-based filtering
+        if current_user.role == 'SALES':
+            # Sales users only see their own transactions
+            query = query.filter(KpiRollup.salesman == current_user.username)
+        # FINANCE and ADMIN see all transactions (no additional filter needed)
+
+        total_mrc, count, total_comisiones, total_margin, margin_rows = query.one()
+        average_margin = total_margin / margin_rows if margin_rows else 0.0
+
+        if months_back is not None:
+            cutoff_date = datetime.utcnow() - timedelta(days=months_back * 30)
+            margin_query = db.session.query(func.avg(Transaction.grossMarginRatio)).filter(
+                Transaction.submissionDate >= cutoff_date
+            )
+            if status_filter is not None:
+                margin_query = margin_query.filter(Transaction.ApprovalStatus == status_filter)
+            if current_user.role == 'SALES':
+                margin_query = margin_query.filter(Transaction.salesman == current_user.username)
+            average_margin = margin_query.scalar()
+
+        return {
+            "success": True,
+            "total_pending_mrc": float(total_mrc or 0.0),
+            "pending_count": int(count or 0),
+            "total_pending_comisiones": float(total_comisiones or 0.0),
+            "average_gross_margin_ratio": float(average_margin or 0.0),
+            "user_role": current_user.role,
+            "username": current_user.username,
+            "filters": {
+                "months_back": months_back,
+                "status_filter": status_filter
+            }
+        }
+
+    except Exception as e:
+        return ({"success": False, "error": f"Database error: {str(e)}"}, 500)
+
+
+# --- TIME SERIES ---
+
+TIMESERIES_METRICS = ('mrc', 'count', 'comisiones', 'gross_margin')
+TIMESERIES_BUCKETS = ('month', 'week')
+TIMESERIES_GROUPS = ('salesman', 'unidadNegocio')
+
+
+def _bucket_start(day, bucket):
+    """First day of the bucket containing 'day' (weeks start on Monday, like date_trunc)."""
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day - timedelta(days=day.weekday())
+
+
+def _next_bucket(start, bucket):
+    if bucket == 'month':
+        return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start + timedelta(days=7)
+
+
+def _timeseries_rows_from_rollup(metrics_from, metrics_to, group_by, status_filter):
+    """(bucket, group, count, mrc, comisiones, margin_sum, margin_count) rows from kpi_rollup."""
+    group_column = KpiRollup.salesman if group_by == 'salesman' else None
+    columns = [KpiRollup.month]
+    if group_column is not None:
+        columns.append(group_column)
+
+    query = db.session.query(
+        *columns,
+        func.sum(KpiRollup.transaction_count),
+        func.sum(KpiRollup.mrc_pen_sum),
+        func.sum(KpiRollup.comisiones_sum),
+        func.sum(KpiRollup.gross_margin_ratio_sum),
+        func.sum(KpiRollup.gross_margin_ratio_count)
+    ).filter(KpiRollup.month > date(1970, 1, 1))  # Skip rows without a submissionDate
+
+    if current_user.role == 'SALES':
+        query = query.filter(KpiRollup.salesman == current_user.username)
+    if status_filter is not None:
+        query = query.filter(KpiRollup.ApprovalStatus == status_filter)
+    if metrics_from is not None:
+        query = query.filter(KpiRollup.month >= metrics_from)
+    if metrics_to is not None:
+        query = query.filter(KpiRollup.month < metrics_to)
+
+    rows = query.group_by(*columns).all()
+    if group_column is None:
+        return [(row[0], None) + tuple(row[1:]) for row in rows]
+    return [tuple(row) for row in rows]
+
+
+def _timeseries_rows_from_transactions(bucket, metrics_from, metrics_to, group_by, status_filter):
+    """Same rows as _timeseries_rows_from_rollup, grouped with date_trunc over the transaction table."""
+    # 'bucket' is whitelisted (TIMESERIES_BUCKETS); inlined so SELECT and GROUP BY match
+    bucket_column = func.date_trunc(literal_column(f"'{bucket}'"), Transaction.submissionDate)
+    group_column = getattr(Transaction, group_by) if group_by else None
+    columns = [bucket_column]
+    if group_column is not None:
+        columns.append(group_column)
+
+    query = db.session.query(
+        *columns,
+        func.count(Transaction.id),
+        func.sum(Transaction.MRC_pen),
+        func.sum(Transaction.comisiones),
+        func.sum(Transaction.grossMarginRatio),
+        func.count(Transaction.grossMarginRatio)
+    ).filter(Transaction.submissionDate.isnot(None))
+
+    if current_user.role == 'SALES':
+        query = query.filter(Transaction.salesman == current_user.username)
+    if status_filter is not None:
+        query = query.filter(Transaction.ApprovalStatus == status_filter)
+    # Range filters on the raw column so the submissionDate indexes can be used
+    if metrics_from is not None:
+        query = query.filter(Transaction.submissionDate >= datetime.combine(metrics_from, datetime.min.time()))
+    if metrics_to is not None:
+        query = query.filter(Transaction.submissionDate < datetime.combine(metrics_to, datetime.min.time()))
+
+    rows = query.group_by(*columns).all()
+    result = []
+    for row in rows:
+        bucket_value = row[0].date() if isinstance(row[0], datetime) else row[0]
+        if group_column is None:
+            result.append((bucket_value, None) + tuple(row[1:]))
+        else:
+            result.append((bucket_value,) + tuple(row[1:]))
+    return result
+
+
+def get_kpi_timeseries(bucket='month', metrics=None, group_by=None, status_filter=None,
+                       date_from=None, date_to=None):
+    """
+    Returns KPI trends per time bucket as columnar arrays ready for charting.
+
+    Parameters:
+        bucket (str): 'month' or 'week' (weeks start on Monday).
+        metrics (list, optional): Any of 'mrc', 'count', 'comisiones', 'gross_margin'.
+                                  If None, includes all metrics.
+        group_by (str, optional): 'salesman' or 'unidadNegocio' for one series per group.
+        status_filter (str, optional): Filter by ApprovalStatus (e.g., 'APPROVED').
+        date_from / date_to (date, optional): Include the buckets containing these dates
+                                              and every bucket in between.
+
+    Monthly series without a unidadNegocio breakdown are read from kpi_rollup;
+    the rest are grouped with date_trunc over the transaction table.
+
+    Role-based filtering:
+    - SALES: Only their own transactions (matching salesman field)
+    - FINANCE: All transactions
+    - ADMIN: All transactions
+
+    Returns:
+        tuple: (dict, status_code) on error, or dict on success
+    """
+    try:
+        metrics = list(metrics or TIMESERIES_METRICS)
+        metrics_from = _bucket_start(date_from, bucket) if date_from else None
+        metrics_to = _next_bucket(_bucket_start(date_to, bucket), bucket) if date_to else None
+
+        if bucket == 'month' and group_by != 'unidadNegocio':
+            rows = _timeseries_rows_from_rollup(metrics_from, metrics_to, group_by, status_filter)
+        else:
+            rows = _timeseries_rows_from_transactions(bucket, metrics_from, metrics_to, group_by, status_filter)
+
+        # Continuous bucket axis, so charts show empty periods as gaps/zeros
+        buckets = []
+        if rows:
+            current = metrics_from or min(row[0] for row in rows)
+            last = max(row[0] for row in rows)
+            if metrics_to is not None:
+                last = metrics_to - timedelta(days=1)
+            while current <= last:
+                buckets.append(current)
+                current = _next_bucket(current, bucket)
+        positions = {bucket_start: i for i, bucket_start in enumerate(buckets)}
+
+        series = {}
+        for bucket_start, group, count, mrc, comisiones, margin_sum, margin_count in rows:
+            entry = series.get(group)
+            if entry is None:
+                entry = series[group] = {
+                    'count': [0] * len(buckets),
+                    'mrc': [0.0] * len(buckets),
+                    'comisiones': [0.0] * len(buckets),
+                    'gross_margin': [None] * len(buckets),
+                }
+            i = positions[bucket_start]
+            entry['count'][i] = int(count or 0)
+            entry['mrc'][i] = float(mrc or 0.0)
+            entry['comisiones'][i] = float(comisiones or 0.0)
+            if margin_count:
+                entry['gross_margin'][i] = float(margin_sum) / int(margin_count)
+
+        return {
+            "success": True,
+            "data": {
+                "bucket": bucket,
+                "group_by": group_by,
+                "metrics": metrics,
+                "buckets": [bucket_start.isoformat() for bucket_start in buckets],
+                "series": [
+                    {"group": group, **{metric: values[metric] for metric in metrics}}
+                    for group, values in sorted(series.items(), key=lambda item: item[0] or '')
+                ]
+            },
+            "user_role": current_user.role,
+            "username": current_user.username,
+            "filters": {
+                "status_filter": status_filter,
+                "from": date_from.isoformat() if date_from else None,
+                "to": date_to.isoformat() if date_to else None
+            }
+        }
+
+    except Exception as e:
+        return ({"success": False, "error": f"Database error: {str(e)}"}, 500)
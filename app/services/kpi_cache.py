@@ -0,0 +1,105 @@
+# app/services/kpi_cache.py
+# Per-process cache of serialized KPI responses.
+#
+# KPIs are read far more often than deals change, so responses are cached for
+# a short TTL and dropped explicitly whenever a transaction of the affected
+# salesman is committed. Invalidation is local to the worker process that
+# handled the write; other gunicorn workers converge within KPI_CACHE_TTL.
+
+import time
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from flask_login import current_user
+
+# Scope for FINANCE/ADMIN entries, which aggregate every salesman
+SCOPE_ALL = 'ALL'
+SCOPE_OWN = 'OWN'
+
+
+class KpiCache:
+    """
+    TTL cache of (body, etag) pairs keyed by (scope, owner, endpoint, params),
+    where owner is the salesman (SCOPE_OWN) or the user id (SCOPE_ALL).
+    Oldest entries are evicted beyond 'max_entries'.
+    """
+
+    def __init__(self, ttl=30, max_entries=2000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (body, etag) or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, body, etag = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            return body, etag
+
+    def set(self, key, body, etag):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, body, etag)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_salesman(self, salesman):
+        """Drops the salesman's own entries and every all-salesmen entry."""
+        with self._lock:
+            stale_keys = [
+                key for key in self._entries
+                if key[0] == SCOPE_ALL or key[1] == salesman
+            ]
+            for key in stale_keys:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Module-level singleton (one per gunicorn worker process)
+_kpi_cache = None
+_singleton_lock = threading.Lock()
+
+
+def get_kpi_cache():
+    """Returns the process-wide KPI response cache, configured from app config."""
+    global _kpi_cache
+    if _kpi_cache is None:
+        with _singleton_lock:
+            if _kpi_cache is None:
+                config = current_app.config
+                _kpi_cache = KpiCache(
+                    ttl=config['KPI_CACHE_TTL'],
+                    max_entries=config['KPI_CACHE_MAX_ENTRIES']
+                )
+    return _kpi_cache
+
+
+def kpi_cache_key(endpoint, params):
+    """
+    Cache key for the current user. Responses echo the requesting user's
+    username and role, so entries are never shared between users: SALES
+    entries are keyed by salesman, FINANCE/ADMIN entries by user id.
+    """
+    normalized_params = tuple(sorted((name, tuple(values)) for name, values in params.lists()))
+    if current_user.role == 'SALES':
+        return (SCOPE_OWN, current_user.username, endpoint, normalized_params)
+    return (SCOPE_ALL, current_user.id, endpoint, normalized_params)
+
+
+def invalidate_kpi_cache(salesman):
+    """Called after a transaction of 'salesman' is committed."""
+    try:
+        get_kpi_cache().invalidate_salesman(salesman)
+    except Exception as e:
+        # Never fail a committed write because of the cache; entries expire anyway
+        current_app.logger.warning("KPI cache invalidation failed for %s: %s", salesman, str(e))
@@ -0,0 +1,168 @@
+# app/services/kpi_rollup.py
+# Incremental maintenance of the kpi_rollup aggregate table.
+#
+# Every service that writes a Transaction takes a snapshot of the row's KPI
+# contribution before and after the change and calls
+# record_kpi_rollup_change() before committing, so the rollup is updated in
+# the same DB transaction as the deal itself.
+
+from datetime import date
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models import Transaction, KpiRollup
+
+# Month bucket used for rows without a submissionDate (legacy data)
+_UNKNOWN_MONTH = date(1970, 1, 1)
+
+
+def _rollup_key(salesman, status, submission_date):
+    month = submission_date.date().replace(day=1) if submission_date else _UNKNOWN_MONTH
+    return (salesman or '', status or '', month)
+
+
+def kpi_rollup_snapshot(transaction):
+    """
+    Returns the contribution of a transaction to kpi_rollup as
+    (key, mrc_pen, comisiones, gross_margin_ratio), or None for no transaction.
+    """
+    if transaction is None:
+        return None
+    key = _rollup_key(transaction.salesman, transaction.ApprovalStatus, transaction.submissionDate)
+    return (key, transaction.MRC_pen or 0.0, transaction.comisiones or 0.0, transaction.grossMarginRatio)
+
+
+def _upsert_delta(key, count, mrc_pen, comisiones, gm_sum, gm_count):
+    """Adds a delta to one rollup row, creating the row if needed (INSERT ... ON CONFLICT)."""
+    salesman, status, month = key
+    dialect = db.session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+
+    table = KpiRollup.__table__
+    stmt = insert(table).values(
+        salesman=salesman,
+        ApprovalStatus=status,
+        month=month,
+        transaction_count=count,
+        mrc_pen_sum=mrc_pen,
+        comisiones_sum=comisiones,
+        gross_margin_ratio_sum=gm_sum,
+        gross_margin_ratio_count=gm_count
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.salesman, table.c.ApprovalStatus, table.c.month],
+        set_={
+            'transaction_count': table.c.transaction_count + stmt.excluded.transaction_count,
+            'mrc_pen_sum': table.c.mrc_pen_sum + stmt.excluded.mrc_pen_sum,
+            'comisiones_sum': table.c.comisiones_sum + stmt.excluded.comisiones_sum,
+            'gross_margin_ratio_sum': table.c.gross_margin_ratio_sum + stmt.excluded.gross_margin_ratio_sum,
+            'gross_margin_ratio_count': table.c.gross_margin_ratio_count + stmt.excluded.gross_margin_ratio_count,
+        }
+    )
+    db.session.execute(stmt)
+
+
+def _apply_snapshot(snapshot, sign):
+    key, mrc_pen, comisiones, gross_margin_ratio = snapshot
+    has_margin = gross_margin_ratio is not None
+    _upsert_delta(
+        key,
+        sign,
+        sign * mrc_pen,
+        sign * comisiones,
+        sign * (gross_margin_ratio if has_margin else 0.0),
+        sign if has_margin else 0
+    )
+
+
+def record_kpi_rollup_change(before, after):
+    """
+    Moves a transaction's contribution from the 'before' snapshot to the
+    'after' snapshot (either may be None for inserts/deletes).
+    Must be called inside the DB transaction that writes the deal.
+    """
+    if before == after:
+        return
+    if before is not None:
+        _apply_snapshot(before, -1)
+    if after is not None:
+        _apply_snapshot(after, 1)
+
+
+# --- RECONCILIATION ---
+
+def compute_rollup_from_transactions():
+    """
+    Recomputes the rollup with a full scan of the transaction table.
+
+    Returns:
+        dict: {key: [count, mrc_pen_sum, comisiones_sum, gm_sum, gm_count]}
+    """
+    totals = {}
+    rows = db.session.query(
+        Transaction.salesman,
+        Transaction.ApprovalStatus,
+        Transaction.submissionDate,
+        Transaction.MRC_pen,
+        Transaction.comisiones,
+        Transaction.grossMarginRatio
+    ).yield_per(1000)
+
+    for salesman, status, submission_date, mrc_pen, comisiones, gross_margin_ratio in rows:
+        key = _rollup_key(salesman, status, submission_date)
+        bucket = totals.setdefault(key, [0, 0.0, 0.0, 0.0, 0])
+        bucket[0] += 1
+        bucket[1] += mrc_pen or 0.0
+        bucket[2] += comisiones or 0.0
+        if gross_margin_ratio is not None:
+            bucket[3] += gross_margin_ratio
+            bucket[4] += 1
+    return totals
+
+
+def _values_match(a, b):
+    return abs((a or 0) - (b or 0)) <= 1e-6 * max(1.0, abs(a or 0), abs(b or 0))
+
+
+def reconcile_kpi_rollup(fix=False):
+    """
+    Verifies kpi_rollup against a full scan of the transaction table.
+
+    Args:
+        fix: If True, rebuilds kpi_rollup from the full scan when mismatches are found
+
+    Returns:
+        list: Mismatches as dicts {'key': ..., 'expected': [...], 'actual': [...]}
+    """
+    expected = compute_rollup_from_transactions()
+    actual = {
+        (row.salesman, row.ApprovalStatus, row.month): [
+            row.transaction_count, row.mrc_pen_sum, row.comisiones_sum,
+            row.gross_margin_ratio_sum, row.gross_margin_ratio_count
+        ]
+        for row in KpiRollup.query.all()
+    }
+
+    mismatches = []
+    empty = [0, 0.0, 0.0, 0.0, 0]
+    for key in set(expected) | set(actual):
+        exp = expected.get(key, empty)
+        act = actual.get(key, empty)
+        if not all(_values_match(e, a) for e, a in zip(exp, act)):
+            mismatches.append({'key': key, 'expected': exp, 'actual': act})
+
+    if fix and mismatches:
+        KpiRollup.query.delete()
+        for (salesman, status, month), values in expected.items():
+            db.session.add(KpiRollup(
+                salesman=salesman,
+                ApprovalStatus=status,
+                month=month,
+                transaction_count=values[0],
+                mrc_pen_sum=values[1],
+                comisiones_sum=values[2],
+                gross_margin_ratio_sum=values[3],
+                gross_margin_ratio_count=values[4]
+            ))
+        db.session.commit()
+
+    return mismatches
@@ -0,0 +1,223 @@
+# app/services/portfolio.py
+# Company-wide cash-flow projection of the APPROVED portfolio.
+#
+# Every approved deal's cached timeline (financial_cache['timeline']) starts at
+# t=0 = its approval month. The projection shifts each timeline to calendar
+# months and sums them into per-process NumPy arrays. The aggregate is built
+# once and then updated incrementally: approvals handled by this worker are
+# added right away, and each read folds in approvals committed elsewhere.
+
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+from app import db
+from app.models import Transaction
+
+# Approvals committed with an older approvalDate than the newest one already
+# folded in (slow commits) are still picked up if they are within this window
+_CATCH_UP_LAG = timedelta(minutes=10)
+
+
+def _month_index(moment):
+    return moment.year * 12 + moment.month - 1
+
+
+def _month_label(index):
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def _deal_cash_flows(financial_cache):
+    """
+    Returns (cash_in, cash_out) arrays indexed by period from a cached
+    timeline, or None if the deal has no usable timeline.
+    Cash-out values are negative, as in the timeline.
+    """
+    timeline = (financial_cache or {}).get('timeline')
+    if not timeline or not timeline.get('net_cash_flow'):
+        return None
+
+    num_periods = len(timeline['net_cash_flow'])
+
+    def _series(values):
+        array = np.zeros(num_periods)
+        if values:
+            array[:len(values)] = np.nan_to_num(np.asarray(values, dtype=float))[:num_periods]
+        return array
+
+    revenues = timeline.get('revenues', {})
+    expenses = timeline.get('expenses', {})
+
+    cash_in = _series(revenues.get('nrc')) + _series(revenues.get('mrc'))
+    cash_out = _series(expenses.get('comisiones')) + _series(expenses.get('egreso'))
+    for fixed_cost in expenses.get('fixed_costs') or []:
+        cash_out += _series(fixed_cost.get('timeline_values'))
+
+    return cash_in, cash_out
+
+
+class PortfolioProjection:
+    """
+    Calendar-month cash-in / cash-out totals of the approved portfolio.
+    Arrays start at 'origin' (a month index) and grow as deals are added.
+    """
+
+    def __init__(self):
+        self.origin = None
+        self.cash_in = np.zeros(0)
+        self.cash_out = np.zeros(0)
+        self.deal_ids = set()
+        self.missing_timeline_ids = set()
+        self.watermark = None  # Newest approvalDate folded in
+        self.built_at = datetime.utcnow()
+
+    def _ensure_range(self, start, length):
+        """Grows the arrays so months [start, start + length) are addressable."""
+        if self.origin is None:
+            self.origin = start
+        if start < self.origin:
+            padding = self.origin - start
+            self.cash_in = np.concatenate([np.zeros(padding), self.cash_in])
+            self.cash_out = np.concatenate([np.zeros(padding), self.cash_out])
+            self.origin = start
+        needed = start - self.origin + length
+        if needed > len(self.cash_in):
+            extra = needed - len(self.cash_in)
+            self.cash_in = np.concatenate([self.cash_in, np.zeros(extra)])
+            self.cash_out = np.concatenate([self.cash_out, np.zeros(extra)])
+
+    def add_deal(self, transaction_id, approval_date, financial_cache):
+        """
+        Adds one approved deal (idempotent per transaction_id). A deal without
+        a usable timeline is only remembered in missing_timeline_ids, so it can
+        be added once its financial_cache is rebuilt.
+        """
+        if transaction_id in self.deal_ids:
+            return
+        if self.watermark is None or approval_date > self.watermark:
+            self.watermark = approval_date
+
+        flows = _deal_cash_flows(financial_cache)
+        if flows is None:
+            self.missing_timeline_ids.add(transaction_id)
+            return
+
+        self.missing_timeline_ids.discard(transaction_id)
+        cash_in, cash_out = flows
+        start = _month_index(approval_date)
+        self._ensure_range(start, len(cash_in))
+        offset = start - self.origin
+        self.cash_in[offset:offset + len(cash_in)] += cash_in
+        self.cash_out[offset:offset + len(cash_out)] += cash_out
+        self.deal_ids.add(transaction_id)
+
+    def window(self, first_month, months):
+        """Returns (cash_in, cash_out) arrays for 'months' months starting at 'first_month'."""
+        cash_in = np.zeros(months)
+        cash_out = np.zeros(months)
+        if self.origin is None:
+            return cash_in, cash_out
+
+        src_start = max(first_month, self.origin)
+        src_end = min(first_month + months, self.origin + len(self.cash_in))
+        if src_start < src_end:
+            dst = slice(src_start - first_month, src_end - first_month)
+            src = slice(src_start - self.origin, src_end - self.origin)
+            cash_in[dst] = self.cash_in[src]
+            cash_out[dst] = self.cash_out[src]
+        return cash_in, cash_out
+
+
+# Module-level state (one projection per gunicorn worker process)
+_projection = None
+_projection_lock = threading.Lock()
+
+
+def _approved_timelines(since=None, transaction_ids=None):
+    query = db.session.query(
+        Transaction.id,
+        Transaction.approvalDate,
+        Transaction.financial_cache
+    ).filter(
+        Transaction.ApprovalStatus == 'APPROVED',
+        Transaction.approvalDate.isnot(None)
+    )
+    if since is not None:
+        query = query.filter(Transaction.approvalDate >= since)
+    if transaction_ids is not None:
+        query = query.filter(Transaction.id.in_(transaction_ids))
+    return query.order_by(Transaction.approvalDate).yield_per(500)
+
+
+def _get_projection():
+    """
+    Builds the projection on first use, then folds in approvals made by other
+    workers and deals whose timeline was missing but has since been cached
+    (e.g. self-healed by get_transaction_details after a failed recalculation).
+    """
+    global _projection
+    with _projection_lock:
+        if _projection is None:
+            projection = PortfolioProjection()
+            for transaction_id, approval_date, financial_cache in _approved_timelines():
+                projection.add_deal(transaction_id, approval_date, financial_cache)
+            _projection = projection
+            current_app.logger.info("Portfolio projection built from %d approved deals", len(projection.deal_ids))
+        elif _projection.watermark is not None:
+            for transaction_id, approval_date, financial_cache in _approved_timelines(_projection.watermark - _CATCH_UP_LAG):
+                _projection.add_deal(transaction_id, approval_date, financial_cache)
+            if _projection.missing_timeline_ids:
+                for transaction_id, approval_date, financial_cache in _approved_timelines(
+                        transaction_ids=list(_projection.missing_timeline_ids)):
+                    _projection.add_deal(transaction_id, approval_date, financial_cache)
+        return _projection
+
+
+def record_portfolio_approval(transaction):
+    """
+    Adds a just-approved transaction to this worker's projection, if built.
+    Best-effort: a failure here is logged and the next read catches up.
+    """
+    try:
+        with _projection_lock:
+            if _projection is not None:
+                _projection.add_deal(transaction.id, transaction.approvalDate, transaction.financial_cache)
+    except Exception as e:
+        current_app.logger.warning("Portfolio projection update failed for %s: %s", transaction.id, str(e))
+
+
+def get_portfolio_projection(months=12):
+    """
+    Projects company-wide monthly cash-in, cash-out and net cash flow of the
+    APPROVED portfolio for the next 'months' months (starting this month).
+    Access is restricted to FINANCE/ADMIN at the route level.
+
+    Returns:
+        tuple: (dict, status_code) on error, or dict on success
+    """
+    try:
+        projection = _get_projection()
+        first_month = _month_index(datetime.utcnow())
+
+        with _projection_lock:
+            cash_in, cash_out = projection.window(first_month, months)
+            deal_count = len(projection.deal_ids)
+            missing_count = len(projection.missing_timeline_ids)
+
+        return {
+            "success": True,
+            "data": {
+                "months": [_month_label(first_month + i) for i in range(months)],
+                "cash_in": cash_in.round(2).tolist(),
+                "cash_out": cash_out.round(2).tolist(),
+                "net_cash_flow": (cash_in + cash_out).round(2).tolist(),
+                "deal_count": deal_count,
+                # Approved deals without a cached timeline (legacy data) are not projected
+                "deals_without_timeline": missing_count
+            }
+        }
+
+    except Exception as e:
+        current_app.logger.error("Error computing portfolio projection: %s", str(e), exc_info=True)
+        return ({"success": False, "error": f"Database error: {str(e)}"}, 500)
@@ -4,17 +4,29 @@
 import pandas as pd
 import numpy as np
 import numpy_financial as npf
+import itertools
+import os
+import secrets
+import threading
 from flask import current_app
 from flask_login import current_user, login_required
 from app import db
 from app.models import Transaction, FixedCost, RecurringService, User
+from app.utils import make_etag
 import json
-from datetime import datetime
+import base64
+import binascii
+from datetime import datetime, timedelta
+from sqlalchemy import func, tuple_, and_, or_, insert, update, delete
+from sqlalchemy.orm.exc import StaleDataError
 
 # --- Service Dependencies ---
-from .email_service import send_new_transaction_email, send_status_update_email
+from .email_service import send_new_transaction_email, send_status_update_email, send_status_digest_emails
 # Import the newly separated commission calculator
 from .commission_rules import _calculate_final_commission
+from .kpi_rollup import kpi_rollup_snapshot, record_kpi_rollup_change
+from .kpi_cache import invalidate_kpi_cache
+from .portfolio import record_portfolio_approval
 
 
 # --- HELPER FUNCTIONS ---
@@ -45,23 +57,33 @@ def _initialize_timeline(num_periods):
         'net_cash_flow': [0.0] * num_periods,
     }
 
-def _generate_unique_id(customer_name, business_unit):
+# Per-process parts of transaction IDs (see _generate_unique_id). The node id
+# is regenerated after a fork, so every gunicorn worker gets its own.
+_id_lock = threading.Lock()
+_id_node = None
+_id_node_pid = None
+_id_sequence = itertools.count()
+
+def _generate_unique_id():
     """
-    Generates a unique transaction ID using microseconds for maximum granularity.
-    
-    Format: FLXYYYY(UNIT PART)-MMDDHHMMSSFFFFFF
+    Generates a unique, time-sortable transaction ID.
+
+    Format: FLXYY-MMDDHHMMSSFFFFFF-NNNNNNSSSS
+        MMDDHHMMSSFFFFFF: creation time to the microsecond (IDs sort by creation
+                          time, so primary key inserts stay append-mostly)
+        NNNNNN: random per-process node id (distinct across workers and hosts)
+        SSSS: per-process sequence (distinct within the same microsecond)
     """
-    now = datetime.now()
-    
-    # 1. Extract the Date/Time Components
-    year_part = now.strftime("%y")    
-    datetime_micro_part = now.strftime("%m%d%H%M%S%f") 
-    
-    # 2. Extract the Unit Part
-    unit_part = (business_unit or "XXX")[:3].upper()
+    global _id_node, _id_node_pid
+    with _id_lock:
+        if _id_node_pid != os.getpid():
+            _id_node = secrets.token_hex(3).upper()
+            _id_node_pid = os.getpid()
+        sequence = next(_id_sequence) % 0x10000
+        now = datetime.now()
+        node = _id_node
 
-    # 3. Construct the new ID
-    return f"FLX{year_part}-{datetime_micro_part}"
+    return f"FLX{now:%y}-{now:%m%d%H%M%S%f}-{node}{sequence:04X}"
 
 def _convert_numpy_types(obj):
     """
@@ -303,13 +325,34 @@ def _calculate_financial_metrics(data):
 
 # --- MAIN SERVICE FUNCTIONS ---
 
+# --- OPTIMISTIC CONCURRENCY CONTROL ---
+
+def _bump_content_version(transaction):
+    """Records a write of the deal (see Transaction.content_version)."""
+    transaction.content_version = (transaction.content_version or 1) + 1
+
+
+def _version_conflict(transaction_id, current_version=None):
+    """
+    409 response for a write based on an outdated content_version, either
+    detected up front (client's expected version) or at commit (StaleDataError).
+    """
+    if current_version is None:
+        current_version = db.session.query(Transaction.content_version).filter_by(id=transaction_id).scalar()
+    return {
+        "success": False,
+        "error": "The transaction was modified by another user. Reload it and try again.",
+        "current_version": current_version
+    }, 409
+
+
 def _update_transaction_data(transaction, data_payload):
     """
     Central helper function to update a transaction's scalar fields and relationships.
 
     This function:
     1. Updates scalar fields (MRC, Unit, Contract Term, etc.) on the transaction model
-    2. Replaces FixedCost and RecurringService records by clearing and recreating them
+    2. Syncs FixedCost and RecurringService records with the payload (see _sync_child_rows)
     3. Recalculates all financial metrics (VAN, TIR, Commissions) based on new values
     4. Does NOT change the transaction status or ID
 
@@ -343,67 +386,21 @@ def _update_transaction_data(transaction, data_payload):
             if field in tx_data:
                 setattr(transaction, field, tx_data[field])
 
-        # 2. Replace FixedCost records (clear and recreate)
-        # Delete all existing fixed costs for this transaction
-        FixedCost.query.filter_by(transaction_id=transaction.id).delete()
-
-        # Create new fixed costs from payload
-        for cost_item in fixed_costs_data:
-            new_cost = FixedCost(
-                transaction=transaction,
-                categoria=cost_item.get('categoria'),
-                tipo_servicio=cost_item.get('tipo_servicio'),
-                ticket=cost_item.get('ticket'),
-                ubicacion=cost_item.get('ubicacion'),
-                cantidad=cost_item.get('cantidad'),
-                costoUnitario_original=cost_item.get('costoUnitario_original'),
-                costoUnitario_currency=cost_item.get('costoUnitario_currency', 'USD'),
-                costoUnitario_pen=cost_item.get('costoUnitario_pen'),
-                periodo_inicio=cost_item.get('periodo_inicio', 0),
-                duracion_meses=cost_item.get('duracion_meses', 1)
-            )
-            db.session.add(new_cost)
-
-        # 3. Replace RecurringService records (clear and recreate)
-        # Delete all existing recurring services for this transaction
-        RecurringService.query.filter_by(transaction_id=transaction.id).delete()
-
-        # Create new recurring services from payload
-        tipoCambio = transaction.tipoCambio or 1
-        for service_item in recurring_services_data:
-            # Ensure _pen fields are calculated if missing
-            if service_item.get('P_pen') in [0, None, '']:
-                P_original = service_item.get('P_original', 0)
-                P_currency = service_item.get('P_currency', 'PEN')
-                service_item['P_pen'] = _normalize_to_pen(P_original, P_currency, tipoCambio)
-
-            if service_item.get('CU1_pen') in [0, None, '']:
-                CU1_original = service_item.get('CU1_original', 0)
-                CU_currency = service_item.get('CU_currency', 'USD')
-                service_item['CU1_pen'] = _normalize_to_pen(CU1_original, CU_currency, tipoCambio)
-
-            if service_item.get('CU2_pen') in [0, None, '']:
-                CU2_original = service_item.get('CU2_original', 0)
-                CU_currency = service_item.get('CU_currency', 'USD')
-                service_item['CU2_pen'] = _normalize_to_pen(CU2_original, CU_currency, tipoCambio)
-
-            new_service = RecurringService(
-                transaction=transaction,
-                tipo_servicio=service_item.get('tipo_servicio'),
-                nota=service_item.get('nota'),
-                ubicacion=service_item.get('ubicacion'),
-                Q=service_item.get('Q'),
-                P_original=service_item.get('P_original'),
-                P_currency=service_item.get('P_currency', 'PEN'),
-                P_pen=service_item.get('P_pen'),
-                CU1_original=service_item.get('CU1_original'),
-                CU2_original=service_item.get('CU2_original'),
-                CU_currency=service_item.get('CU_currency', 'USD'),
-                CU1_pen=service_item.get('CU1_pen'),
-                CU2_pen=service_item.get('CU2_pen'),
-                proveedor=service_item.get('proveedor')
-            )
-            db.session.add(new_service)
+        # 2. Sync FixedCost records (diff against the stored rows, matched by id)
+        _sync_child_rows(FixedCost, transaction.id, [
+            (_child_id(cost_item), _fixed_cost_values(cost_item)) for cost_item in fixed_costs_data
+        ])
+
+        # 3. Sync RecurringService records (diff against the stored rows, matched by id)
+        # Ensure _pen fields are calculated if missing
+        _fill_missing_service_pen(recurring_services_data, transaction.tipoCambio or 1)
+        _sync_child_rows(RecurringService, transaction.id, [
+            (_child_id(service_item), _recurring_service_values(service_item))
+            for service_item in recurring_services_data
+        ])
+
+        # The bulk statements bypass the relationship collections
+        db.session.expire(transaction, ['fixed_costs', 'recurring_services'])
 
         # 4. Flush changes to ensure relationships are updated before recalculation
         db.session.flush()
@@ -411,8 +408,8 @@ def _update_transaction_data(transaction, data_payload):
         # 5. Recalculate financial metrics based on new values
         # Assemble data package for recalculation
         recalc_data = transaction.to_dict()
-        recalc_data['fixed_costs'] = [fc.to_dict() for fc in transaction.fixed_costs]
-        recalc_data['recurring_services'] = [rs.to_dict() for rs in transaction.recurring_services]
+        recalc_data['fixed_costs'] = _child_rows(FixedCost, transaction.id)
+        recalc_data['recurring_services'] = _child_rows(RecurringService, transaction.id)
         recalc_data['gigalan_region'] = transaction.gigalan_region
         recalc_data['gigalan_sale_type'] = transaction.gigalan_sale_type
         recalc_data['gigalan_old_mrc'] = transaction.gigalan_old_mrc
@@ -434,8 +431,14 @@ def _update_transaction_data(transaction, data_payload):
         transaction.NRC_original = clean_metrics.get('NRC_original')
         transaction.NRC_pen = clean_metrics.get('NRC_pen')
 
+        # 7. Inputs changed: invalidates the PENDING metrics cache
+        _bump_content_version(transaction)
+
         return {"success": True}, None
 
+    except StaleDataError:
+        # Concurrent write detected while flushing; handled by the caller (409)
+        raise
     except Exception as e:
         import traceback
         print("--- ERROR DURING TRANSACTION UPDATE ---")
@@ -443,6 +446,114 @@ def _update_transaction_data(transaction, data_payload):
         print("--- END ERROR ---")
         return {"success": False, "error": f"Error updating transaction: {str(e)}"}, 500
 
+def _fixed_cost_values(cost_item):
+    """FixedCost column values from a payload row."""
+    return {
+        'categoria': cost_item.get('categoria'),
+        'tipo_servicio': cost_item.get('tipo_servicio'),
+        'ticket': cost_item.get('ticket'),
+        'ubicacion': cost_item.get('ubicacion'),
+        'cantidad': cost_item.get('cantidad'),
+        'costoUnitario_original': cost_item.get('costoUnitario_original'),
+        'costoUnitario_currency': cost_item.get('costoUnitario_currency', 'USD'),
+        'costoUnitario_pen': cost_item.get('costoUnitario_pen'),
+        'periodo_inicio': cost_item.get('periodo_inicio', 0),
+        'duracion_meses': cost_item.get('duracion_meses', 1)
+    }
+
+
+def _recurring_service_values(service_item):
+    """RecurringService column values from a payload row."""
+    return {
+        'tipo_servicio': service_item.get('tipo_servicio'),
+        'nota': service_item.get('nota'),
+        'ubicacion': service_item.get('ubicacion'),
+        'Q': service_item.get('Q'),
+        'P_original': service_item.get('P_original'),
+        'P_currency': service_item.get('P_currency', 'PEN'),
+        'P_pen': service_item.get('P_pen'),
+        'CU1_original': service_item.get('CU1_original'),
+        'CU2_original': service_item.get('CU2_original'),
+        'CU_currency': service_item.get('CU_currency', 'USD'),
+        'CU1_pen': service_item.get('CU1_pen'),
+        'CU2_pen': service_item.get('CU2_pen'),
+        'proveedor': service_item.get('proveedor')
+    }
+
+
+def _fill_missing_service_pen(services, tipoCambio):
+    """
+    Ensures the _pen fields of payload recurring services are calculated if
+    missing (0, None or ''), in place. Vectorized over all rows: one NumPy
+    pass per field instead of a _normalize_to_pen call per cell.
+    """
+    if not services:
+        return
+
+    for pen_key, original_key, currency_key, default_currency in (
+        ('P_pen', 'P_original', 'P_currency', 'PEN'),
+        ('CU1_pen', 'CU1_original', 'CU_currency', 'USD'),
+        ('CU2_pen', 'CU2_original', 'CU_currency', 'USD'),
+    ):
+        missing = np.array([item.get(pen_key) in [0, None, ''] for item in services])
+        if not missing.any():
+            continue
+
+        values = np.array([item.get(original_key, 0) or 0.0 for item in services], dtype=float)
+        to_convert = missing & np.array([item.get(currency_key, default_currency) == 'USD' for item in services])
+        if to_convert.any():
+            values[to_convert] *= tipoCambio
+
+        for index in np.flatnonzero(missing):
+            services[index][pen_key] = float(values[index])
+
+
+def _child_id(item):
+    """The integer id of a payload child row, or None for new rows."""
+    try:
+        return int(item.get('id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _sync_child_rows(model, transaction_id, rows):
+    """
+    Persists the FixedCost / RecurringService rows of a transaction as a diff
+    against the stored ones instead of deleting and recreating them all.
+
+    Args:
+        model: FixedCost or RecurringService
+        transaction_id: The parent transaction's ID
+        rows: List of (id or None, column values) from the payload
+
+    Incoming rows are matched to stored rows of this transaction by id:
+    unchanged rows are left alone, changed rows are UPDATEd, rows without a
+    matching id are INSERTed, and stored rows not in the payload are DELETEd.
+    Each kind of change is one batched (executemany) statement.
+    """
+    existing = {
+        row.id: row._mapping
+        for row in db.session.query(*model.__table__.columns).filter(model.transaction_id == transaction_id)
+    }
+
+    inserts, updates, kept_ids = [], [], set()
+    for item_id, values in rows:
+        stored = existing.get(item_id)
+        if stored is None or item_id in kept_ids:
+            inserts.append({'transaction_id': transaction_id, **values})
+            continue
+        kept_ids.add(item_id)
+        if any(stored[key] != value for key, value in values.items()):
+            updates.append({'id': item_id, **values})
+
+    deleted_ids = [item_id for item_id in existing if item_id not in kept_ids]
+    if deleted_ids:
+        db.session.execute(delete(model).where(model.id.in_(deleted_ids)))
+    if updates:
+        db.session.execute(update(model), updates)
+    if inserts:
+        db.session.execute(insert(model), inserts)
+
 @login_required
 def calculate_preview_metrics(request_data):
     """
@@ -515,12 +626,14 @@ def calculate_preview_metrics(request_data):
         return {"success": False, "error": f"An unexpected error occurred during preview: {str(e)}"}, 500
 
 @login_required 
-def recalculate_commission_and_metrics(transaction_id):
+def recalculate_commission_and_metrics(transaction_id, expected_version=None):
     """
     Applies the official commission, recalculates all financial metrics,
     and saves the updated Transaction object to the database.
     
     IMMUTABILITY CHECK: Only allows modification if status is 'PENDING'.
+    CONCURRENCY CHECK: If 'expected_version' (the content_version the client
+    last saw) is given and outdated, or a concurrent write wins, returns 409.
     
     --- REFACTORED ---
     This function now uses the new stateless _calculate_financial_metrics function
@@ -532,11 +645,16 @@ def recalculate_commission_and_metrics(transaction_id):
         if not transaction:
             return {"success": False, "error": "Transaction not found."}, 404
 
+        if expected_version is not None and expected_version != transaction.content_version:
+            return _version_conflict(transaction_id, transaction.content_version)
+
         # --- IMMUTABILITY CHECK (CRITICAL NEW LOGIC) ---
         if transaction.ApprovalStatus != 'PENDING':
             return {"success": False, "error": f"Transaction is already {transaction.ApprovalStatus}. Financial metrics can only be modified for 'PENDING' transactions."}, 403
         # ---------------------------------------------
 
+        kpi_before = kpi_rollup_snapshot(transaction)
+
         # 2. Assemble the data package
         # We convert the DB model and its relationships into a simple dictionary.
         tx_data = transaction.to_dict()
@@ -570,53 +688,156 @@ def recalculate_commission_and_metrics(transaction_id):
         transaction.NRC_original = clean_financial_metrics.get('NRC_original')
         transaction.NRC_pen = clean_financial_metrics.get('NRC_pen')
 
-        # 5. Commit changes
+        # Stored values changed: invalidates the PENDING metrics cache
+        _bump_content_version(transaction)
+
+        # 5. Commit changes (together with the KPI rollup delta)
+        record_kpi_rollup_change(kpi_before, kpi_rollup_snapshot(transaction))
         db.session.commit()
+        invalidate_kpi_cache(transaction.salesman)
 
         # 6. Return the full, updated transaction details
         return get_transaction_details(transaction_id)
 
+    except StaleDataError:
+        db.session.rollback()
+        return _version_conflict(transaction_id)
     except Exception as e:
         db.session.rollback()
         current_app.logger.error("Error during commission recalculation for ID %s: %s", transaction_id, str(e), exc_info=True)
         return {"success": False, "error": f"Error during commission recalculation: {str(e)}"}, 500
 
+def transaction_search_expression():
+    """
+    Text searched by the list's 'q' filter. Must stay identical to the
+    expression of the idx_transaction_search_trgm GIN index (see migrations).
+    """
+    return (
+        func.coalesce(Transaction.clientName, '') + ' ' +
+        func.coalesce(Transaction.companyID, '') + ' ' +
+        func.coalesce(Transaction.orderID, '') + ' ' +
+        Transaction.id
+    )
+
+
+def _transaction_filter_conditions(filters):
+    """
+    SQL conditions for the list filters (all optional):
+    status (list), unidadNegocio, salesman, date_from / date_to (submissionDate),
+    mrc_min / mrc_max (MRC_pen), margin_min / margin_max (grossMarginRatio), q.
+    """
+    filters = filters or {}
+    conditions = []
+
+    if filters.get('status'):
+        conditions.append(Transaction.ApprovalStatus.in_(filters['status']))
+    if filters.get('unidadNegocio'):
+        conditions.append(Transaction.unidadNegocio == filters['unidadNegocio'])
+    if filters.get('salesman'):
+        conditions.append(Transaction.salesman == filters['salesman'])
+    if filters.get('date_from') is not None:
+        conditions.append(Transaction.submissionDate >= datetime.combine(filters['date_from'], datetime.min.time()))
+    if filters.get('date_to') is not None:
+        conditions.append(Transaction.submissionDate < datetime.combine(filters['date_to'] + timedelta(days=1), datetime.min.time()))
+    if filters.get('mrc_min') is not None:
+        conditions.append(Transaction.MRC_pen >= filters['mrc_min'])
+    if filters.get('mrc_max') is not None:
+        conditions.append(Transaction.MRC_pen <= filters['mrc_max'])
+    if filters.get('margin_min') is not None:
+        conditions.append(Transaction.grossMarginRatio >= filters['margin_min'])
+    if filters.get('margin_max') is not None:
+        conditions.append(Transaction.grossMarginRatio <= filters['margin_max'])
+    if filters.get('q'):
+        # Substring match (ILIKE) served by the pg_trgm GIN index
+        escaped = filters['q'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append(transaction_search_expression().ilike(f"%{escaped}%", escape='\\'))
+
+    return conditions
+
+
+def _list_query_fields(fields):
+    """
+    Columns to select for a sparse list: the requested fields plus id and
+    submissionDate (needed for the keyset cursor). None selects all LIST_FIELDS.
+    """
+    if fields is None:
+        return None
+    return list(dict.fromkeys(['id', 'submissionDate', *fields]))
+
+
+def _transaction_list_query(include_counts=False, filters=None, fields=None):
+    """
+    Column-only query for list views: selects the Transaction.LIST_FIELDS
+    columns (no financial_cache, no ORM objects, no child rows) with the
+    role-based filter and the optional list filters applied. With
+    include_counts, adds fixed_costs_count and recurring_services_count from
+    grouped subqueries. 'fields' restricts the selected columns
+    (see _list_query_fields).
+    """
+    columns = Transaction.list_columns(_list_query_fields(fields))
+
+    if include_counts:
+        fixed_cost_counts = db.session.query(
+            FixedCost.transaction_id, func.count(FixedCost.id).label('item_count')
+        ).group_by(FixedCost.transaction_id).subquery()
+        service_counts = db.session.query(
+            RecurringService.transaction_id, func.count(RecurringService.id).label('item_count')
+        ).group_by(RecurringService.transaction_id).subquery()
+
+        query = db.session.query(
+            *columns,
+            func.coalesce(fixed_cost_counts.c.item_count, 0).label('fixed_costs_count'),
+            func.coalesce(service_counts.c.item_count, 0).label('recurring_services_count')
+        ).outerjoin(
+            fixed_cost_counts, fixed_cost_counts.c.transaction_id == Transaction.id
+        ).outerjoin(
+            service_counts, service_counts.c.transaction_id == Transaction.id
+        )
+    else:
+        query = db.session.query(*columns)
+
+    # --- ROLE-BASED FILTERING ---
+    if current_user.role == 'SALES':
+        # Filter to show only transactions uploaded by this salesman
+        query = query.filter(Transaction.salesman == current_user.username)
+    # ADMIN and FINANCE roles see all transactions, so no filter is needed.
+
+    return query.filter(*_transaction_filter_conditions(filters))
+
+
+def _list_row_to_dict(row, include_counts=False, fields=None):
+    data = Transaction.row_to_dict(row, ['id', *fields] if fields is not None else None)
+    if include_counts:
+        data['fixed_costs_count'] = row.fixed_costs_count
+        data['recurring_services_count'] = row.recurring_services_count
+    return data
+
+
 @login_required
-def get_transactions(page=1, per_page=30):
+def get_transactions(page=1, per_page=30, include_counts=False, filters=None, fields=None):
     """
     Retrieves a paginated list of transactions from the database, filtered by user role.
     - SALES: Only sees transactions where salesman matches current_user.username.
     - FINANCE/ADMIN: Sees all transactions.
+    Optional 'filters' are described in _transaction_filter_conditions.
+    Optional 'fields' (subset of Transaction.LIST_FIELDS) limits the columns
+    selected and returned ('id' is always returned).
 
-    PERFORMANCE FIX: Uses eager loading to prevent N+1 query problem.
+    PERFORMANCE FIX: Selects only the list columns (see _transaction_list_query);
+    child rows are never loaded, only optionally counted.
     """
     try:
-        from sqlalchemy.orm import joinedload
-
-        # Start with the base query with eager loading
-        # This loads fixed_costs and recurring_services in a single JOIN query
-        query = Transaction.query.options(
-            joinedload(Transaction.fixed_costs),
-            joinedload(Transaction.recurring_services)
-        )
-
-        # --- ROLE-BASED FILTERING (NEW LOGIC) ---
-        if current_user.role == 'SALES':
-            # Filter to show only transactions uploaded by this salesman
-            query = query.filter(Transaction.salesman == current_user.username)
-        # ADMIN and FINANCE roles see all transactions, so no filter is needed.
+        query = _transaction_list_query(include_counts, filters, fields)
 
         # Apply ordering and pagination
         transactions = query.order_by(Transaction.submissionDate.desc()).paginate(
             page=page, per_page=per_page, error_out=False
         )
-        # ------------------------------------------
 
         return {
             "success": True,
             "data": {
-                # <-- MODIFIED: to_dict() now includes currency fields
-                "transactions": [tx.to_dict() for tx in transactions.items],
+                "transactions": [_list_row_to_dict(row, include_counts, fields) for row in transactions.items],
                 "total": transactions.total,
                 "pages": transactions.pages,
                 "current_page": transactions.page,
@@ -628,10 +849,140 @@ def get_transactions(page=1, per_page=30):
         # NOTE: A failure here might mean the database filter failed or user is not logged in.
         return {"success": False, "error": f"An unexpected error occurred: {str(e)}"}
 
+def _encode_cursor(transaction):
+    """Opaque keyset cursor for the (submissionDate, id) position of a transaction."""
+    submission_date = transaction.submissionDate.isoformat() if transaction.submissionDate else None
+    payload = json.dumps([submission_date, transaction.id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    """
+    Returns (submissionDate, id) from a cursor; submissionDate is None for
+    legacy rows without a date. Raises ValueError if it is malformed.
+    """
+    try:
+        submission_date, transaction_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if submission_date is not None:
+            submission_date = datetime.fromisoformat(submission_date)
+        return submission_date, str(transaction_id)
+    except (binascii.Error, UnicodeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+
+
+def _after_cursor(cursor_date, cursor_id):
+    """
+    Keyset condition for rows after (cursor_date, cursor_id) in the order
+    submissionDate DESC NULLS LAST, id DESC. Rows without a submissionDate
+    come last, so they follow every dated cursor position.
+    """
+    if cursor_date is None:
+        return and_(Transaction.submissionDate.is_(None), Transaction.id < cursor_id)
+    return or_(
+        tuple_(Transaction.submissionDate, Transaction.id) < tuple_(cursor_date, cursor_id),
+        Transaction.submissionDate.is_(None)
+    )
+
+
+@login_required
+def get_transactions_page(cursor=None, per_page=30, include_total=False, include_counts=False, filters=None,
+                          fields=None):
+    """
+    Keyset (cursor) pagination over the transaction list, newest first.
+    Uses WHERE (submissionDate, id) < (cursor) instead of OFFSET, so deep
+    pages cost the same as the first one (idx_transaction_salesman_submission
+    for SALES users, ix_transaction_submissionDate otherwise).
+
+    Args:
+        cursor: Opaque 'next_cursor' from the previous page (None for the first page)
+        per_page: Page size
+        include_total: If True, also runs the COUNT(*) over the filtered set
+        include_counts: If True, adds per-transaction child counts
+        filters: Optional list filters (see _transaction_filter_conditions)
+        fields: Optional subset of Transaction.LIST_FIELDS to return ('id' is always returned)
+
+    Returns:
+        tuple: (dict, status_code) on error, or dict on success
+    """
+    try:
+        if include_total:
+            count_query = db.session.query(func.count(Transaction.id)).filter(
+                *_transaction_filter_conditions(filters)
+            )
+            if current_user.role == 'SALES':
+                count_query = count_query.filter(Transaction.salesman == current_user.username)
+            total = count_query.scalar()
+        else:
+            total = None
+
+        query = _transaction_list_query(include_counts, filters, fields)
+
+        if cursor:
+            try:
+                cursor_date, cursor_id = _decode_cursor(cursor)
+            except ValueError as e:
+                return {"success": False, "error": str(e)}, 400
+            query = query.filter(_after_cursor(cursor_date, cursor_id))
+
+        # One extra row tells whether another page exists
+        rows = query.order_by(
+            Transaction.submissionDate.desc().nulls_last(), Transaction.id.desc()
+        ).limit(per_page + 1).all()
+
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+
+        return {
+            "success": True,
+            "data": {
+                "transactions": [_list_row_to_dict(row, include_counts, fields) for row in rows],
+                "next_cursor": _encode_cursor(rows[-1]) if has_more else None,
+                "total": total,
+                "user_role": current_user.role
+            }
+        }
+    except Exception as e:
+        return {"success": False, "error": f"An unexpected error occurred: {str(e)}"}, 500
+
 # app/services/transactions.py
 
 @login_required
-def get_transaction_details(transaction_id):
+def get_transaction_etag(transaction_id, variant=None):
+    """
+    Strong ETag for the detail response, read from three columns only (no
+    ORM loading, no calculation). content_version changes with every edit or
+    recalculation and ApprovalStatus with approval/rejection, after which the
+    deal is immutable. 'variant' (e.g. the requested fieldset) is folded in.
+    Returns None if the transaction does not exist or the user may not see it.
+    """
+    row = db.session.query(
+        Transaction.salesman, Transaction.ApprovalStatus, Transaction.content_version
+    ).filter(Transaction.id == transaction_id).first()
+
+    if row is None:
+        return None
+    if current_user.role == 'SALES' and row.salesman != current_user.username:
+        return None
+    return make_etag('transaction', transaction_id, row.ApprovalStatus, row.content_version, variant)
+
+
+@login_required
+def get_transaction_list_etag(data, params=None):
+    """
+    Weak ETag for a list response, hashed from the serialized page actually
+    returned (rows, next_cursor / total when present), so it costs no query
+    beyond the page itself. 'params' (e.g. page, cursor, filters) are folded in as-is.
+    """
+    scope = current_user.username if current_user.role == 'SALES' else 'ALL'
+    return make_etag('transaction-list', scope, params, json.dumps(data, sort_keys=True, default=str))
+
+
+# Optional parts of the detail response (all included by default)
+DETAIL_INCLUDES = ('timeline', 'fixed_costs', 'recurring_services')
+
+
+@login_required
+def get_transaction_details(transaction_id, fields=None, include=None):
     """
     Retrieves a single transaction and its full details from the database by its string ID.
     Access control: SALES can only view their own transactions.
@@ -640,140 +991,127 @@ def get_transaction_details(transaction_id):
     This function now runs the financial calculator to include the 'timeline' (Flujo)
     object in the initial response, preventing frontend lag.
 
-    PERFORMANCE FIX: Uses eager loading to prevent N+1 query problem.
+    PERFORMANCE FIX: Single-pass assembly. The transaction and each child
+    table are read with one column-only query, every row is serialized once,
+    and the serialized children are shared between the calculator input and
+    the response. Legacy recurring services without PEN values were backfilled
+    by migration e2f7a1c3b954, so no healing happens on read.
+
+    Sparse fieldsets (both optional; without them the full response is returned):
+        fields: Transaction fields to return (subset of Transaction.LIST_FIELDS; 'id' is always kept)
+        include: Parts of DETAIL_INCLUDES to return. If only 'fields' is given, nothing is included.
+                 Children are neither loaded nor serialized unless included (or needed
+                 to recalculate metrics that are not cached yet).
     """
     try:
-        from sqlalchemy.orm import joinedload
+        if fields is None and include is None:
+            include = DETAIL_INCLUDES
+        include = set(include or [])
 
-        # Start with a base query with eager loading
-        # This loads fixed_costs and recurring_services in a single JOIN query
-        query = Transaction.query.options(
-            joinedload(Transaction.fixed_costs),
-            joinedload(Transaction.recurring_services)
-        ).filter_by(id=transaction_id)
+        query = db.session.query(
+            *Transaction.list_columns(),
+            Transaction.financial_cache,
+            Transaction.financial_cache_version
+        ).filter(Transaction.id == transaction_id)
 
         # --- ROLE-BASED ACCESS CHECK (NEW LOGIC) ---
         if current_user.role == 'SALES':
             # SALES users can only load their own transactions
             query = query.filter(Transaction.salesman == current_user.username)
 
-        transaction = query.first()
+        row = query.first()
         # ------------------------------------------
-        
-        if transaction:
-            # --- PERFORMANCE OPTIMIZATION: Use cache for immutable transactions ---
-            # For APPROVED/REJECTED transactions, use cached metrics to avoid expensive recalculation
-            # For PENDING transactions, calculate on-the-fly for live "what-if" analysis
-
-            if transaction.ApprovalStatus in ['APPROVED', 'REJECTED'] and transaction.financial_cache:
-                # Cache hit - use stored metrics (zero CPU cost)
-                clean_financial_metrics = transaction.financial_cache
-                transaction_details = transaction.to_dict()
-                transaction_details.update(clean_financial_metrics)
-
-            elif transaction.ApprovalStatus in ['APPROVED', 'REJECTED'] and not transaction.financial_cache:
-                # Cache miss (legacy data) - recalculate and self-heal the cache
-                current_app.logger.info("Cache miss for %s transaction %s - self-healing",
-                                       transaction.ApprovalStatus, transaction.id)
-
-                # 1. Assemble the data package from the DB model
-                tx_data = transaction.to_dict()
-                tx_data['fixed_costs'] = [fc.to_dict() for fc in transaction.fixed_costs]
-                tx_data['recurring_services'] = [rs.to_dict() for rs in transaction.recurring_services]
-                tx_data['gigalan_region'] = transaction.gigalan_region
-                tx_data['gigalan_sale_type'] = transaction.gigalan_sale_type
-                tx_data['gigalan_old_mrc'] = transaction.gigalan_old_mrc
-                tx_data['tasaCartaFianza'] = transaction.tasaCartaFianza
-                tx_data['aplicaCartaFianza'] = transaction.aplicaCartaFianza
-
-                # 2. Calculate and cache the metrics
-                financial_metrics = _calculate_financial_metrics(tx_data)
-                clean_financial_metrics = _convert_numpy_types(financial_metrics)
-
-                # 3. Self-heal: Update the cache for future requests
-                transaction.financial_cache = clean_financial_metrics
-                db.session.commit()
-
-                # 4. Merge into transaction details
-                transaction_details = transaction.to_dict()
-                transaction_details.update(clean_financial_metrics)
 
-            else:
-                # PENDING transaction - calculate on-the-fly for live editing
-                # 1. Assemble the data package from the DB model
-                tx_data = transaction.to_dict()
-                tx_data['fixed_costs'] = [fc.to_dict() for fc in transaction.fixed_costs]
-                tx_data['recurring_services'] = [rs.to_dict() for rs in transaction.recurring_services]
-
-                # Add GIGALAN fields to the dict for the commission calculator
-                tx_data['gigalan_region'] = transaction.gigalan_region
-                tx_data['gigalan_sale_type'] = transaction.gigalan_sale_type
-                tx_data['gigalan_old_mrc'] = transaction.gigalan_old_mrc
-                tx_data['tasaCartaFianza'] = transaction.tasaCartaFianza
-                tx_data['aplicaCartaFianza'] = transaction.aplicaCartaFianza
-
-                # 2. Call the calculator to get fresh metrics and the timeline
-                financial_metrics = _calculate_financial_metrics(tx_data)
-                clean_financial_metrics = _convert_numpy_types(financial_metrics)
-
-                # 3. Merge the fresh calculations into the main transaction details
-                # This adds the 'timeline' object and ensures all KPIs are in sync.
-                transaction_details = transaction.to_dict()
-                transaction_details.update(clean_financial_metrics)
-
-            # --- END PERFORMANCE OPTIMIZATION ---
-
-            # --- FIX: Recalculate _pen fields if missing (for legacy data) ---
-            recurring_services_list = [rs.to_dict() for rs in transaction.recurring_services]
-            tipoCambio = transaction.tipoCambio
-
-            for service in recurring_services_list:
-                # If _pen fields are missing/zero but original values exist, recalculate
-                if (service.get('ingreso_pen') in [0, None] and
-                    service.get('P_original') and service.get('Q')):
-
-                    P_pen = _normalize_to_pen(
-                        service['P_original'],
-                        service.get('P_currency', 'PEN'),
-                        tipoCambio
-                    )
-                    service['P_pen'] = P_pen
-                    service['ingreso_pen'] = P_pen * service['Q']
-
-                if (service.get('egreso_pen') in [0, None] and
-                    service.get('Q')):
-
-                    CU1_pen = _normalize_to_pen(
-                        service.get('CU1_original', 0),
-                        service.get('CU_currency', 'USD'),
-                        tipoCambio
-                    )
-                    CU2_pen = _normalize_to_pen(
-                        service.get('CU2_original', 0),
-                        service.get('CU_currency', 'USD'),
-                        tipoCambio
-                    )
-                    service['CU1_pen'] = CU1_pen
-                    service['CU2_pen'] = CU2_pen
-                    service['egreso_pen'] = (CU1_pen + CU2_pen) * service['Q']
-            # --- END FIX ---
-
-            return {
-                "success": True,
-                "data": {
-                    # This 'transaction_details' object now contains the 'timeline'
-                    "transactions": transaction_details,
-                    "fixed_costs": [fc.to_dict() for fc in transaction.fixed_costs],
-                    "recurring_services": recurring_services_list
-                }
-            }
-        else:
+        if row is None:
             # Return Not Found if transaction ID doesn't exist OR if the user doesn't have permission
             return {"success": False, "error": "Transaction not found or access denied."}
+
+        transaction_details = Transaction.row_to_dict(row)
+        is_closed = row.ApprovalStatus in ['APPROVED', 'REJECTED']
+
+        # --- PERFORMANCE OPTIMIZATION: Use cache for immutable transactions ---
+        # For APPROVED/REJECTED transactions, use cached metrics to avoid expensive recalculation
+        # For PENDING transactions, reuse the metrics cached for the current content_version,
+        # otherwise calculate on-the-fly for live "what-if" analysis
+        if row.financial_cache and (is_closed or row.financial_cache_version == row.content_version):
+            clean_financial_metrics = row.financial_cache
+            needs_calculation = False
+        else:
+            clean_financial_metrics = None
+            needs_calculation = True
+
+        fixed_costs = recurring_services = None
+        if needs_calculation or 'fixed_costs' in include:
+            fixed_costs = _child_rows(FixedCost, transaction_id)
+        if needs_calculation or 'recurring_services' in include:
+            recurring_services = _child_rows(RecurringService, transaction_id)
+
+        if needs_calculation:
+            # 1. Assemble the calculator input from the already-serialized rows.
+            # The calculator normalizes the children's PEN values in place, so it
+            # gets copies: the response returns the rows as stored, the same as
+            # on a cache hit (both share one ETag).
+            tx_data = dict(transaction_details)
+            tx_data['fixed_costs'] = [dict(row) for row in fixed_costs]
+            tx_data['recurring_services'] = [dict(row) for row in recurring_services]
+
+            # 2. Call the calculator to get fresh metrics and the timeline
+            financial_metrics = _calculate_financial_metrics(tx_data)
+            clean_financial_metrics = _convert_numpy_types(financial_metrics)
+
+            # 3. Store the metrics
+            if is_closed:
+                # Cache miss (legacy data) - self-heal the cache
+                current_app.logger.info("Cache miss for %s transaction %s - self-healing",
+                                       row.ApprovalStatus, transaction_id)
+                Transaction.query.filter_by(id=transaction_id).update(
+                    {'financial_cache': clean_financial_metrics}, synchronize_session=False
+                )
+            else:
+                # PENDING: cache against the current content_version (reused until
+                # the inputs change). Skipped if an edit landed in the meantime.
+                Transaction.query.filter_by(id=transaction_id, content_version=row.content_version).update(
+                    {'financial_cache': clean_financial_metrics,
+                     'financial_cache_version': row.content_version},
+                    synchronize_session=False
+                )
+            db.session.commit()
+
+        # 4. Merge the metrics into the transaction details
+        # This adds the 'timeline' object and ensures all KPIs are in sync.
+        transaction_details.update(clean_financial_metrics)
+        # --- END PERFORMANCE OPTIMIZATION ---
+
+        # --- SPARSE FIELDSETS ---
+        if 'timeline' not in include:
+            transaction_details.pop('timeline', None)
+        if fields is not None:
+            transaction_details = {
+                key: transaction_details[key]
+                for key in ['id', *fields] if key in transaction_details
+            }
+
+        data = {
+            # This 'transaction_details' object contains the 'timeline' unless excluded
+            "transactions": transaction_details
+        }
+        if 'fixed_costs' in include:
+            data["fixed_costs"] = fixed_costs
+        if 'recurring_services' in include:
+            data["recurring_services"] = recurring_services
+        return {"success": True, "data": data}
     except Exception as e:
         return {"success": False, "error": f"An unexpected error occurred: {str(e)}"}
 
 
+def _child_rows(model, transaction_id):
+    """Serialized FixedCost / RecurringService rows of one transaction (one column-only query)."""
+    rows = db.session.query(*model.__table__.columns).filter(
+        model.transaction_id == transaction_id
+    ).order_by(model.id)
+    return [model.row_to_dict(row) for row in rows]
+
+
 @login_required # <-- SECURITY WRAPPER ADDED
 def save_transaction(data):
     """
@@ -819,7 +1157,7 @@ def save_transaction(data):
             current_app.logger.warning("Falling back to frontend-provided values for transaction")
         # -------------------------------------------------------
 
-        unique_id = _generate_unique_id(tx_data.get('clientName'), tx_data.get('unidadNegocio'))
+        unique_id = _generate_unique_id()
 
         # --- NEW STEP: Extract GIGALAN Data ---
         # This data now comes from the frontend modal
@@ -863,64 +1201,38 @@ def save_transaction(data):
             ApprovalStatus='PENDING'
         )
         db.session.add(new_transaction)
+        # The parent row must exist before the children are inserted
+        db.session.flush()
 
-        # Loop through fixed costs and add them
-        for cost_item in data.get('fixed_costs', []):
-            new_cost = FixedCost(
-                transaction=new_transaction, categoria=cost_item.get('categoria'),
-                tipo_servicio=cost_item.get('tipo_servicio'), ticket=cost_item.get('ticket'),
-                ubicacion=cost_item.get('ubicacion'), cantidad=cost_item.get('cantidad'),
-                costoUnitario_original=cost_item.get('costoUnitario_original'),
-                costoUnitario_currency=cost_item.get('costoUnitario_currency', 'USD'),
-                costoUnitario_pen=cost_item.get('costoUnitario_pen'),
-                periodo_inicio=cost_item.get('periodo_inicio', 0),
-                duracion_meses=cost_item.get('duracion_meses', 1)
-            )
-            db.session.add(new_cost)
-
-        # Loop through recurring services and add them
-        for service_item in data.get('recurring_services', []):
-            # --- FIX: Ensure _pen fields are calculated if missing ---
-            tipoCambio = tx_data.get('tipoCambio', 1)
-
-            if service_item.get('P_pen') in [0, None, '']:
-                P_original = service_item.get('P_original', 0)
-                P_currency = service_item.get('P_currency', 'PEN')
-                service_item['P_pen'] = _normalize_to_pen(P_original, P_currency, tipoCambio)
-
-            if service_item.get('CU1_pen') in [0, None, '']:
-                CU1_original = service_item.get('CU1_original', 0)
-                CU_currency = service_item.get('CU_currency', 'USD')
-                service_item['CU1_pen'] = _normalize_to_pen(CU1_original, CU_currency, tipoCambio)
-
-            if service_item.get('CU2_pen') in [0, None, '']:
-                CU2_original = service_item.get('CU2_original', 0)
-                CU_currency = service_item.get('CU_currency', 'USD')
-                service_item['CU2_pen'] = _normalize_to_pen(CU2_original, CU_currency, tipoCambio)
-            # --- END FIX ---
-
-            new_service = RecurringService(
-                transaction=new_transaction, tipo_servicio=service_item.get('tipo_servicio'),
-                nota=service_item.get('nota'), ubicacion=service_item.get('ubicacion'),
-                Q=service_item.get('Q'),
-                P_original=service_item.get('P_original'),
-                P_currency=service_item.get('P_currency', 'PEN'),
-                P_pen=service_item.get('P_pen'),
-                CU1_original=service_item.get('CU1_original'),
-                CU2_original=service_item.get('CU2_original'),
-                CU_currency=service_item.get('CU_currency', 'USD'),
-                CU1_pen=service_item.get('CU1_pen'),
-                CU2_pen=service_item.get('CU2_pen'),
-                proveedor=service_item.get('proveedor')
-            )
-            db.session.add(new_service)
+        # --- BULK INSERT OF CHILD ROWS ---
+        # One executemany INSERT per table (batched into multi-row VALUES by
+        # insertmanyvalues on psycopg2) instead of one ORM object and one
+        # INSERT per row. Resulting rows are the same as before.
+        fixed_cost_rows = [
+            {'transaction_id': unique_id, **_fixed_cost_values(cost_item)}
+            for cost_item in data.get('fixed_costs', [])
+        ]
+        if fixed_cost_rows:
+            db.session.execute(insert(FixedCost), fixed_cost_rows)
+
+        # --- FIX: Ensure _pen fields are calculated if missing ---
+        recurring_services_data = data.get('recurring_services', [])
+        _fill_missing_service_pen(recurring_services_data, tx_data.get('tipoCambio', 1))
+        service_rows = [
+            {'transaction_id': unique_id, **_recurring_service_values(service_item)}
+            for service_item in recurring_services_data
+        ]
+        if service_rows:
+            db.session.execute(insert(RecurringService), service_rows)
 
         # --- DIAGNOSTIC CHANGES ---
         db.session.flush()
         new_id = new_transaction.id
+        record_kpi_rollup_change(None, kpi_rollup_snapshot(new_transaction))
         print(f"--- DIAGNOSTIC: Attempting to commit transaction with temporary ID: {new_id} by user {current_user.username} ---")
 
         db.session.commit()
+        invalidate_kpi_cache(current_user.username)
 
         print(f"--- DIAGNOSTIC: Commit successful for transaction ID: {new_id} ---")
 
@@ -946,7 +1258,7 @@ def save_transaction(data):
         return {"success": False, "error": f"Database error: {str(e)}"}
 
 @login_required
-def update_transaction_content(transaction_id, data_payload):
+def update_transaction_content(transaction_id, data_payload, expected_version=None):
     """
     Updates a PENDING transaction's content without changing its status or ID.
     This is the dedicated service for the "Edit" feature.
@@ -955,6 +1267,8 @@ def update_transaction_content(transaction_id, data_payload):
         transaction_id: The ID of the transaction to update
         data_payload: Dictionary containing updated transaction data.
                      Structure: {'transactions': {...}, 'fixed_costs': [...], 'recurring_services': [...]}
+        expected_version: Optional content_version the client based the edit on.
+                          If outdated, or a concurrent write wins, returns 409.
 
     Returns:
         Success response with updated transaction details, or error response with status code
@@ -977,25 +1291,64 @@ def update_transaction_content(transaction_id, data_payload):
         if current_user.role == 'SALES' and transaction.salesman != current_user.username:
             return {"success": False, "error": "You do not have permission to edit this transaction."}, 403
 
+        if expected_version is not None and expected_version != transaction.content_version:
+            return _version_conflict(transaction_id, transaction.content_version)
+
+        kpi_before = kpi_rollup_snapshot(transaction)
+
         # 4. Apply updates using the central helper
         update_result, error_status = _update_transaction_data(transaction, data_payload)
         if error_status:
             db.session.rollback()
             return update_result, error_status
 
-        # 5. Commit the changes
+        # 5. Commit the changes (together with the KPI rollup delta)
+        record_kpi_rollup_change(kpi_before, kpi_rollup_snapshot(transaction))
         db.session.commit()
+        invalidate_kpi_cache(transaction.salesman)
 
         # 6. Return the updated transaction details
         return get_transaction_details(transaction_id)
 
+    except StaleDataError:
+        db.session.rollback()
+        return _version_conflict(transaction_id)
     except Exception as e:
         db.session.rollback()
         current_app.logger.error("Error updating transaction content for ID %s: %s", transaction_id, str(e), exc_info=True)
         return {"success": False, "error": f"Error updating transaction: {str(e)}"}, 500
 
+def _apply_final_metrics(transaction, clean_metrics):
+    """
+    Writes freshly calculated metrics to a transaction that is being approved
+    or rejected, and stores them in financial_cache (immutable from now on).
+    """
+    for key, value in clean_metrics.items():
+        if hasattr(transaction, key):
+            setattr(transaction, key, value)
+
+    transaction.costoInstalacion = clean_metrics.get('costoInstalacion')
+    transaction.MRC_original = clean_metrics.get('MRC_original')
+    transaction.MRC_pen = clean_metrics.get('MRC_pen')
+    transaction.NRC_original = clean_metrics.get('NRC_original')
+    transaction.NRC_pen = clean_metrics.get('NRC_pen')
+
+    transaction.financial_cache = clean_metrics
+    transaction.financial_cache_version = transaction.content_version
+
+
+def _discard_financial_cache(transaction):
+    """
+    Drops the cached metrics of a transaction being approved or rejected whose
+    recalculation failed. The cache may hold a payload of an older PENDING
+    version, and closed deals trust financial_cache as-is, so it is cleared
+    to let get_transaction_details recalculate (self-heal) on the next read.
+    """
+    transaction.financial_cache = None
+    transaction.financial_cache_version = None
+
 @login_required # <-- SECURITY WRAPPER ADDED
-def approve_transaction(transaction_id, data_payload=None):
+def approve_transaction(transaction_id, data_payload=None, expected_version=None):
     """
     Approves a transaction by updating its status and approval date.
     Immutability Check: Only allows approval if status is 'PENDING'.
@@ -1005,6 +1358,8 @@ def approve_transaction(transaction_id, data_payload=None):
         data_payload: Optional dictionary containing updated transaction data.
                      If provided, updates the transaction before approval.
                      Structure: {'transactions': {...}, 'fixed_costs': [...], 'recurring_services': [...]}
+        expected_version: Optional content_version the client based the decision on.
+                          If outdated, or a concurrent write wins, returns 409.
 
     CRITICAL FIX: Recalculates financial metrics before approval to ensure
     database has the latest calculated values (prevents stale data).
@@ -1014,12 +1369,17 @@ def approve_transaction(transaction_id, data_payload=None):
         if not transaction:
             return {"success": False, "error": "Transaction not found."}, 404
 
+        if expected_version is not None and expected_version != transaction.content_version:
+            return _version_conflict(transaction_id, transaction.content_version)
+
         # --- STATE CONSISTENCY CHECK ---
         if transaction.ApprovalStatus != 'PENDING':
             # Block approval if not pending
             return {"success": False, "error": f"Cannot approve transaction. Current status is '{transaction.ApprovalStatus}'. Only 'PENDING' transactions can be approved."}, 400
         # -------------------------------
 
+        kpi_before = kpi_rollup_snapshot(transaction)
+
         # --- NEW: Apply data updates if provided ---
         if data_payload:
             update_result, error_status = _update_transaction_data(transaction, data_payload)
@@ -1028,6 +1388,8 @@ def approve_transaction(transaction_id, data_payload=None):
                 return update_result, error_status
         # ------------------------------------------
 
+        _bump_content_version(transaction)
+
         # --- CRITICAL FIX: Recalculate metrics before approval ---
         # This ensures the database contains the latest calculated values
         # and prevents stale data from being frozen in the approved state
@@ -1046,30 +1408,24 @@ def approve_transaction(transaction_id, data_payload=None):
             financial_metrics = _calculate_financial_metrics(tx_data)
             clean_metrics = _convert_numpy_types(financial_metrics)
 
-            # Update transaction with fresh calculations
-            for key, value in clean_metrics.items():
-                if hasattr(transaction, key):
-                    setattr(transaction, key, value)
-
-            transaction.costoInstalacion = clean_metrics.get('costoInstalacion')
-            transaction.MRC_original = clean_metrics.get('MRC_original')
-            transaction.MRC_pen = clean_metrics.get('MRC_pen')
-            transaction.NRC_original = clean_metrics.get('NRC_original')
-            transaction.NRC_pen = clean_metrics.get('NRC_pen')
-
-            # --- PERFORMANCE OPTIMIZATION: Cache financial metrics ---
-            # Store the complete calculated metrics in financial_cache
+            # Update transaction with fresh calculations and cache them
             # This prevents expensive recalculations when viewing approved transactions
-            transaction.financial_cache = clean_metrics
-            # --------------------------------------------------------
+            _apply_final_metrics(transaction, clean_metrics)
+        except StaleDataError:
+            # Concurrent write detected by an autoflush; handled below (409)
+            raise
         except Exception as calc_error:
             current_app.logger.error("Error recalculating metrics before approval for ID %s: %s", transaction_id, str(calc_error), exc_info=True)
             # Continue with approval even if recalculation fails (log the error but don't block)
+            _discard_financial_cache(transaction)
         # ---------------------------------------------------------
 
         transaction.ApprovalStatus = 'APPROVED'
         transaction.approvalDate = datetime.utcnow()
+        record_kpi_rollup_change(kpi_before, kpi_rollup_snapshot(transaction))
         db.session.commit()
+        invalidate_kpi_cache(transaction.salesman)
+        record_portfolio_approval(transaction)
 
         # --- NEW: SEND APPROVAL EMAIL ---
         try:
@@ -1078,14 +1434,17 @@ def approve_transaction(transaction_id, data_payload=None):
             print(f"--- ERROR: Transaction approved, but email notification failed: {str(e)} ---")
         # --------------------------------
 
-        return {"success": True, "message": "Transaction approved successfully."}
+        return {"success": True, "message": "Transaction approved successfully.", "content_version": transaction.content_version}
+    except StaleDataError:
+        db.session.rollback()
+        return _version_conflict(transaction_id)
     except Exception as e:
         db.session.rollback()
         current_app.logger.error("Error during transaction approval for ID %s: %s", transaction_id, str(e), exc_info=True)
         return {"success": False, "error": f"Database error: {str(e)}"}, 500
 
 @login_required
-def reject_transaction(transaction_id, rejection_note=None, data_payload=None):
+def reject_transaction(transaction_id, rejection_note=None, data_payload=None, expected_version=None):
     """
     Rejects a transaction by updating its status and approval date.
     Immutability Check: Only allows rejection if status is 'PENDING'.
@@ -1096,6 +1455,8 @@ def reject_transaction(transaction_id, rejection_note=None, data_payload=None):
         data_payload: Optional dictionary containing updated transaction data.
                      If provided, updates the transaction before rejection.
                      Structure: {'transactions': {...}, 'fixed_costs': [...], 'recurring_services': [...]}
+        expected_version: Optional content_version the client based the decision on.
+                          If outdated, or a concurrent write wins, returns 409.
 
     CRITICAL FIX: Recalculates financial metrics before rejection to ensure
     database has the latest calculated values (prevents stale data).
@@ -1105,12 +1466,17 @@ def reject_transaction(transaction_id, rejection_note=None, data_payload=None):
         if not transaction:
             return {"success": False, "error": "Transaction not found."}, 404
 
+        if expected_version is not None and expected_version != transaction.content_version:
+            return _version_conflict(transaction_id, transaction.content_version)
+
         # --- STATE CONSISTENCY CHECK ---
         if transaction.ApprovalStatus != 'PENDING':
             # Block rejection if not pending
             return {"success": False, "error": f"Cannot reject transaction. Current status is '{transaction.ApprovalStatus}'. Only 'PENDING' transactions can be rejected."}, 400
         # -------------------------------
 
+        kpi_before = kpi_rollup_snapshot(transaction)
+
         # --- NEW: Apply data updates if provided ---
         if data_payload:
             update_result, error_status = _update_transaction_data(transaction, data_payload)
@@ -1119,6 +1485,8 @@ def reject_transaction(transaction_id, rejection_note=None, data_payload=None):
                 return update_result, error_status
         # ------------------------------------------
 
+        _bump_content_version(transaction)
+
         # --- CRITICAL FIX: Recalculate metrics before rejection ---
         # This ensures the database contains the latest calculated values
         # and prevents stale data from being frozen in the rejected state
@@ -1137,25 +1505,16 @@ def reject_transaction(transaction_id, rejection_note=None, data_payload=None):
             financial_metrics = _calculate_financial_metrics(tx_data)
             clean_metrics = _convert_numpy_types(financial_metrics)
 
-            # Update transaction with fresh calculations
-            for key, value in clean_metrics.items():
-                if hasattr(transaction, key):
-                    setattr(transaction, key, value)
-
-            transaction.costoInstalacion = clean_metrics.get('costoInstalacion')
-            transaction.MRC_original = clean_metrics.get('MRC_original')
-            transaction.MRC_pen = clean_metrics.get('MRC_pen')
-            transaction.NRC_original = clean_metrics.get('NRC_original')
-            transaction.NRC_pen = clean_metrics.get('NRC_pen')
-
-            # --- PERFORMANCE OPTIMIZATION: Cache financial metrics ---
-            # Store the complete calculated metrics in financial_cache
+            # Update transaction with fresh calculations and cache them
             # This prevents expensive recalculations when viewing rejected transactions
-            transaction.financial_cache = clean_metrics
-            # --------------------------------------------------------
+            _apply_final_metrics(transaction, clean_metrics)
+        except StaleDataError:
+            # Concurrent write detected by an autoflush; handled below (409)
+            raise
         except Exception as calc_error:
             current_app.logger.error("Error recalculating metrics before rejection for ID %s: %s", transaction_id, str(calc_error), exc_info=True)
             # Continue with rejection even if recalculation fails (log the error but don't block)
+            _discard_financial_cache(transaction)
         # ---------------------------------------------------------
 
         transaction.ApprovalStatus = 'REJECTED'
@@ -1165,7 +1524,9 @@ def reject_transaction(transaction_id, rejection_note=None, data_payload=None):
         if rejection_note:
             transaction.rejection_note = rejection_note.strip()
 
+        record_kpi_rollup_change(kpi_before, kpi_rollup_snapshot(transaction))
         db.session.commit()
+        invalidate_kpi_cache(transaction.salesman)
 
         # --- NEW: SEND REJECTION EMAIL ---
         try:
@@ -1174,8 +1535,161 @@ def reject_transaction(transaction_id, rejection_note=None, data_payload=None):
             print(f"--- ERROR: Transaction rejected, but email notification failed: {str(e)} ---")
         # ---------------------------------
 
-        return {"success": True, "message": "Transaction rejected successfully."}
+        return {"success": True, "message": "Transaction rejected successfully.", "content_version": transaction.content_version}
+    except StaleDataError:
+        db.session.rollback()
+        return _version_conflict(transaction_id)
     except Exception as e:
         db.session.rollback()
         current_app.logger.error("Error during transaction rejection for ID %s: %s", transaction_id, str(e), exc_info=True)
-        return {"success": False, "error": f"Database error: {str(e)}"}, 500
\ No newline at end of file
+        return {"success": False, "error": f"Database error: {str(e)}"}, 500
+
+
+# --- BATCH APPROVAL / REJECTION ---
+
+def _child_rows_by_transaction(model, transaction_ids):
+    """Serialized FixedCost / RecurringService rows of many transactions (one IN query)."""
+    rows_by_transaction = {transaction_id: [] for transaction_id in transaction_ids}
+    rows = db.session.query(*model.__table__.columns).filter(
+        model.transaction_id.in_(transaction_ids)
+    ).order_by(model.id)
+    for row in rows:
+        rows_by_transaction[row.transaction_id].append(model.row_to_dict(row))
+    return rows_by_transaction
+
+
+def _calculate_metrics_batch(transactions):
+    """
+    Batch calculator: recalculates the metrics of several transactions from
+    two IN queries for all their children (instead of two lazy loads per deal).
+
+    Returns:
+        dict: {transaction_id: clean_metrics, or None if the calculation failed}
+    """
+    transaction_ids = [transaction.id for transaction in transactions]
+    fixed_costs = _child_rows_by_transaction(FixedCost, transaction_ids)
+    recurring_services = _child_rows_by_transaction(RecurringService, transaction_ids)
+
+    metrics = {}
+    for transaction in transactions:
+        tx_data = transaction.to_dict()
+        tx_data['fixed_costs'] = fixed_costs[transaction.id]
+        tx_data['recurring_services'] = recurring_services[transaction.id]
+        try:
+            metrics[transaction.id] = _convert_numpy_types(_calculate_financial_metrics(tx_data))
+        except Exception as calc_error:
+            current_app.logger.error("Error recalculating metrics in batch for ID %s: %s", transaction.id, str(calc_error), exc_info=True)
+            metrics[transaction.id] = None
+    return metrics
+
+
+def _decide_transactions_batch(transaction_ids, new_status, rejection_note=None, expected_versions=None):
+    """
+    Approves or rejects several PENDING transactions in one DB transaction.
+
+    Transactions that do not exist, are not PENDING or whose content_version
+    differs from 'expected_versions' ({id: version}, optional) are skipped and reported;
+    the rest are recalculated (see _calculate_metrics_batch), frozen with their
+    financial_cache and committed together. Each salesman gets one digest email.
+
+    Returns:
+        tuple: (dict, status_code) on error, or dict on success
+    """
+    action = 'approved' if new_status == 'APPROVED' else 'rejected'
+    try:
+        # Keep the request order, ignore duplicates
+        transaction_ids = list(dict.fromkeys(str(transaction_id) for transaction_id in transaction_ids))
+
+        transactions = {
+            transaction.id: transaction
+            for transaction in Transaction.query.filter(Transaction.id.in_(transaction_ids)).all()
+        }
+
+        skipped = []
+        targets = []
+        for transaction_id in transaction_ids:
+            transaction = transactions.get(transaction_id)
+            expected_version = (expected_versions or {}).get(transaction_id)
+            if transaction is None:
+                skipped.append({"id": transaction_id, "error": "Transaction not found."})
+            elif expected_version is not None and expected_version != transaction.content_version:
+                skipped.append({
+                    "id": transaction_id,
+                    "error": "The transaction was modified by another user.",
+                    "current_version": transaction.content_version
+                })
+            elif transaction.ApprovalStatus != 'PENDING':
+                skipped.append({
+                    "id": transaction_id,
+                    "error": f"Current status is '{transaction.ApprovalStatus}'. Only 'PENDING' transactions can be {action}."
+                })
+            else:
+                targets.append(transaction)
+
+        if targets:
+            metrics = _calculate_metrics_batch(targets)
+            decision_date = datetime.utcnow()
+
+            for transaction in targets:
+                kpi_before = kpi_rollup_snapshot(transaction)
+                _bump_content_version(transaction)
+                # Continue even if recalculation failed (same as the single-deal endpoints)
+                if metrics[transaction.id] is not None:
+                    _apply_final_metrics(transaction, metrics[transaction.id])
+                else:
+                    _discard_financial_cache(transaction)
+
+                transaction.ApprovalStatus = new_status
+                transaction.approvalDate = decision_date
+                if rejection_note:
+                    transaction.rejection_note = rejection_note.strip()
+                record_kpi_rollup_change(kpi_before, kpi_rollup_snapshot(transaction))
+
+            db.session.commit()
+
+            for salesman in {transaction.salesman for transaction in targets}:
+                invalidate_kpi_cache(salesman)
+            if new_status == 'APPROVED':
+                for transaction in targets:
+                    record_portfolio_approval(transaction)
+
+            # --- ONE DIGEST EMAIL PER SALESMAN ---
+            try:
+                send_status_digest_emails(targets, new_status)
+            except Exception as e:
+                print(f"--- ERROR: Transactions {action}, but digest email notification failed: {str(e)} ---")
+
+        return {
+            "success": True,
+            "message": f"{len(targets)} transaction(s) {action}, {len(skipped)} skipped.",
+            "data": {
+                "processed": [
+                    {"id": transaction.id, "content_version": transaction.content_version}
+                    for transaction in targets
+                ],
+                "skipped": skipped
+            }
+        }
+    except StaleDataError:
+        # A concurrent write hit one of the deals; nothing in the batch was committed
+        db.session.rollback()
+        return {
+            "success": False,
+            "error": "One or more transactions were modified by another user. Nothing was changed; reload and try again."
+        }, 409
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error("Error during batch %s: %s", new_status, str(e), exc_info=True)
+        return {"success": False, "error": f"Database error: {str(e)}"}, 500
+
+
+@login_required
+def approve_transactions_batch(transaction_ids, expected_versions=None):
+    """Approves several PENDING transactions at once (see _decide_transactions_batch)."""
+    return _decide_transactions_batch(transaction_ids, 'APPROVED', expected_versions=expected_versions)
+
+
+@login_required
+def reject_transactions_batch(transaction_ids, rejection_note=None, expected_versions=None):
+    """Rejects several PENDING transactions at once (see _decide_transactions_batch)."""
+    return _decide_transactions_batch(transaction_ids, 'REJECTED', rejection_note, expected_versions)
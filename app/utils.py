@@ -1,7 +1,8 @@
 # app/utils.py
 
+import hashlib
 from functools import wraps
-from flask import jsonify, current_app
+from flask import jsonify, current_app, request
 from flask_login import current_user
 
 # --- NEW: Helper variables/functions moved from routes.py ---
@@ -64,6 +65,123 @@ def finance_admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def make_etag(*parts):
+    """Stable ETag value (without quotes) from the given parts."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def etag_matches(etag, weak=False):
+    """True if the request's If-None-Match already holds 'etag'."""
+    if weak:
+        return request.if_none_match.contains_weak(etag)
+    return request.if_none_match.contains(etag)
+
+
+def not_modified_response(etag, weak=False):
+    """Empty 304 response carrying the ETag and the revalidation policy."""
+    response = current_app.response_class(status=304)
+    response.set_etag(etag, weak=weak)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _handle_conditional_service_result(result, etag, weak=False, default_error_status=500):
+    """
+    Same as _handle_service_result, but successful responses carry the ETag
+    and 'Cache-Control: private, no-cache' so clients revalidate with If-None-Match.
+    """
+    response = current_app.make_response(_handle_service_result(result, default_error_status))
+    if etag and response.status_code == 200:
+        response.set_etag(etag, weak=weak)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def kpi_cached(f):
+    """
+    Decorator for KPI routes: serves the JSON response from the per-process
+    KPI cache when possible and adds ETag / Cache-Control headers, so browsers
+    revalidate with If-None-Match and get a 304 when nothing changed.
+    Must be applied below @login_required (the cache key depends on the user).
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        from app.services.kpi_cache import get_kpi_cache, kpi_cache_key
+
+        cache = get_kpi_cache()
+        key = kpi_cache_key(request.endpoint, request.args)
+        entry = cache.get(key)
+
+        if entry is None:
+            response = current_app.make_response(f(*args, **kwargs))
+            # Only successful responses are cached
+            if response.status_code != 200:
+                return response
+            response.add_etag()
+            cache.set(key, response.get_data(), response.get_etag()[0])
+        else:
+            body, etag = entry
+            response = current_app.response_class(body, mimetype='application/json')
+            response.set_etag(etag)
+
+        # Private (per-user data), and always revalidated because entries are
+        # invalidated as soon as a transaction changes
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+    return decorated_function
+
+
+def idempotent(f):
+    """
+    Decorator for non-idempotent POST routes: honours an optional
+    Idempotency-Key header. A retry with the same key and body replays the
+    stored response (with 'Idempotent-Replayed: true') instead of running the
+    route again; 5xx responses are not stored, so those can be retried.
+    Must be applied below @login_required (keys are scoped per user).
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(*args, **kwargs)
+
+        from app.services.idempotency import (
+            MAX_KEY_LENGTH, claim_idempotency_key, complete_idempotency_key, release_idempotency_key
+        )
+
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"success": False, "error": f"Idempotency-Key cannot exceed {MAX_KEY_LENGTH} characters."}), 400
+
+        request_hash = hashlib.sha256(
+            b'\n'.join([request.method.encode(), request.path.encode(), request.get_data()])
+        ).hexdigest()
+        outcome, record = claim_idempotency_key(key, request_hash)
+
+        if outcome == 'replay':
+            response = current_app.response_class(
+                record.response_body, status=record.status_code, mimetype='application/json'
+            )
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        if outcome == 'mismatch':
+            return jsonify({"success": False, "error": "Idempotency-Key was already used for a different request."}), 422
+        if outcome == 'in_progress':
+            return jsonify({"success": False, "error": "A request with this Idempotency-Key is still being processed."}), 409
+
+        try:
+            response = current_app.make_response(f(*args, **kwargs))
+        except Exception:
+            release_idempotency_key(key)
+            raise
+
+        if response.status_code >= 500:
+            release_idempotency_key(key)
+        else:
+            complete_idempotency_key(key, response.status_code, response.get_data(as_text=True))
+        return response
+    return decorated_function
+
+
 def get_editable_categories():
     """
     Returns a list of unique categories the current user's role is authorized to edit.
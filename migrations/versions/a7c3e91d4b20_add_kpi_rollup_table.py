@@ -0,0 +1,53 @@
+"""Add kpi_rollup aggregate table for dashboard KPIs
+
+Revision ID: a7c3e91d4b20
+Revises: 9fccfb87603f
+Create Date: 2026-10-19 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e91d4b20'
+down_revision = '9fccfb87603f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('kpi_rollup',
+    sa.Column('salesman', sa.String(length=128), nullable=False),
+    sa.Column('ApprovalStatus', sa.String(length=64), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('transaction_count', sa.Integer(), nullable=False),
+    sa.Column('mrc_pen_sum', sa.Float(), nullable=False),
+    sa.Column('comisiones_sum', sa.Float(), nullable=False),
+    sa.Column('gross_margin_ratio_sum', sa.Float(), nullable=False),
+    sa.Column('gross_margin_ratio_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('salesman', 'ApprovalStatus', 'month')
+    )
+
+    # Backfill from existing transactions (must match services/kpi_rollup.py keys)
+    op.execute("""
+        INSERT INTO kpi_rollup (
+            salesman, "ApprovalStatus", month, transaction_count, mrc_pen_sum,
+            comisiones_sum, gross_margin_ratio_sum, gross_margin_ratio_count
+        )
+        SELECT
+            COALESCE(salesman, ''),
+            COALESCE("ApprovalStatus", ''),
+            COALESCE(date_trunc('month', "submissionDate")::date, DATE '1970-01-01'),
+            COUNT(*),
+            COALESCE(SUM("MRC_pen"), 0),
+            COALESCE(SUM(comisiones), 0),
+            COALESCE(SUM("grossMarginRatio"), 0),
+            COUNT("grossMarginRatio")
+        FROM transaction
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade():
+    op.drop_table('kpi_rollup')
@@ -0,0 +1,30 @@
+"""Add covering index for salesman leaderboard analytics
+
+Revision ID: b5d81f0c6e37
+Revises: a7c3e91d4b20
+Create Date: 2026-10-19 11:04:17.552310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d81f0c6e37'
+down_revision = 'a7c3e91d4b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.create_index(
+            'idx_transaction_leaderboard_covering', ['submissionDate'], unique=False,
+            postgresql_include=['salesman', 'unidadNegocio', 'ApprovalStatus',
+                                'MRC_pen', 'payback', 'grossMarginRatio']
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_index('idx_transaction_leaderboard_covering')
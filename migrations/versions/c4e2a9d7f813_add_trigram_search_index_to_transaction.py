@@ -0,0 +1,32 @@
+"""Add pg_trgm GIN index for transaction list search
+
+Revision ID: c4e2a9d7f813
+Revises: b5d81f0c6e37
+Create Date: 2026-10-19 11:48:05.907112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e2a9d7f813'
+down_revision = 'b5d81f0c6e37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Trigram index over the same expression as transaction_search_expression()
+    # in services/transactions.py, so 'q' ILIKE '%...%' searches use it
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute("""
+        CREATE INDEX idx_transaction_search_trgm ON transaction USING gin (
+            (coalesce("clientName", '') || ' ' || coalesce("companyID", '') || ' ' ||
+             coalesce("orderID", '') || ' ' || id) gin_trgm_ops
+        )
+    """)
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS idx_transaction_search_trgm')
@@ -0,0 +1,31 @@
+"""Add content_version and financial_cache_version to transaction
+
+Revision ID: d9b4c6e1a275
+Revises: c4e2a9d7f813
+Create Date: 2026-10-19 12:30:52.114870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b4c6e1a275'
+down_revision = 'c4e2a9d7f813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_version', sa.Integer(), nullable=False, server_default='1'))
+        batch_op.add_column(sa.Column('financial_cache_version', sa.Integer(), nullable=True))
+
+    # Existing APPROVED/REJECTED caches were computed from the current content
+    op.execute('UPDATE transaction SET financial_cache_version = 1 WHERE financial_cache IS NOT NULL')
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_column('financial_cache_version')
+        batch_op.drop_column('content_version')
@@ -0,0 +1,61 @@
+"""Backfill missing PEN values of legacy recurring services
+
+Revision ID: e2f7a1c3b954
+Revises: d9b4c6e1a275
+Create Date: 2026-10-19 14:05:37.402519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f7a1c3b954'
+down_revision = 'd9b4c6e1a275'
+branch_labels = None
+depends_on = None
+
+# Same conditions the detail endpoint used to heal on every read:
+# no PEN revenue although P_original and Q are set, or no PEN expense although Q is set
+_MISSING_P_PEN = """
+    COALESCE(rs."P_pen", 0) = 0 AND COALESCE(rs."P_original", 0) <> 0 AND COALESCE(rs."Q", 0) <> 0
+    AND (rs."P_currency" <> 'USD' OR t."tipoCambio" IS NOT NULL)
+"""
+_MISSING_CU_PEN = """
+    COALESCE(rs."CU1_pen", 0) + COALESCE(rs."CU2_pen", 0) = 0 AND COALESCE(rs."Q", 0) <> 0
+    AND (COALESCE(rs."CU1_original", 0) <> 0 OR COALESCE(rs."CU2_original", 0) <> 0)
+    AND (rs."CU_currency" <> 'USD' OR t."tipoCambio" IS NOT NULL)
+"""
+
+
+def upgrade():
+    # PENDING deals whose inputs change get a new content_version, so their
+    # cached metrics are recalculated on the next read
+    op.execute(f"""
+        UPDATE transaction SET content_version = content_version + 1
+        WHERE "ApprovalStatus" = 'PENDING' AND id IN (
+            SELECT rs.transaction_id
+            FROM recurring_service rs JOIN transaction t ON t.id = rs.transaction_id
+            WHERE ({_MISSING_P_PEN}) OR ({_MISSING_CU_PEN})
+        )
+    """)
+
+    op.execute(f"""
+        UPDATE recurring_service AS rs
+        SET "P_pen" = rs."P_original" * CASE WHEN rs."P_currency" = 'USD' THEN t."tipoCambio" ELSE 1 END
+        FROM transaction t
+        WHERE t.id = rs.transaction_id AND {_MISSING_P_PEN}
+    """)
+
+    op.execute(f"""
+        UPDATE recurring_service AS rs
+        SET "CU1_pen" = COALESCE(rs."CU1_original", 0) * CASE WHEN rs."CU_currency" = 'USD' THEN t."tipoCambio" ELSE 1 END,
+            "CU2_pen" = COALESCE(rs."CU2_original", 0) * CASE WHEN rs."CU_currency" = 'USD' THEN t."tipoCambio" ELSE 1 END
+        FROM transaction t
+        WHERE t.id = rs.transaction_id AND {_MISSING_CU_PEN}
+    """)
+
+
+def downgrade():
+    # Data fix only; the previous (missing) values are not restored
+    pass